@@ -0,0 +1,416 @@
+"""
+aggregates.py — In-memory analytical engine for count and trend questions
+
+Questions like "What are the most refused areas in Dublin?" or "How many
+residential units were approved in the Docklands?" cannot be answered from
+the top-10 records a similarity search returns. build_vectordb.py stores the
+processed records in columnar form (dictionary-encoded dimensions plus a
+units and floor-area measures); at load time the engine precomputes group-by cubes for every
+dimension and every pair of dimensions, so typical questions are answered
+with an array lookup and the rest with a vectorised scan over all records.
+
+query_planning routes aggregate questions here and gives the LLM the exact
+computed figures instead of sampled documents.
+"""
+
+import json
+import re
+import threading
+from datetime import date
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+
+from gazetteer import PLACES, find_places, record_place
+from ref_index import extract_refs
+from query_filters import classify_decision, normalize_postcode, parse_date_range, parse_number, parse_query_filters
+
+AGGREGATES_FILE = "aggregates.json"  # Stored alongside the ChromaDB files
+
+DIMENSIONS = [
+    "postcode", "place", "year", "decision_class", "dev_category",
+    "land_type", "dev_scale", "has_appeal",
+]
+
+DIMENSION_LABELS = {
+    "postcode": "postcode", "place": "area", "year": "year", "decision_class": "decision",
+    "dev_category": "development category", "land_type": "land type",
+    "dev_scale": "development scale", "has_appeal": "appealed",
+}
+
+MAX_GROUPS_SHOWN = 15
+
+# Numeric range filters the engine can apply (column name -> label)
+RANGE_FILTERS = {"num_units": "residential units", "floor_area": "floor area (m²)"}
+
+_RANGE_OPS = {
+    "$gte": np.greater_equal, "$gt": np.greater, "$lte": np.less_equal, "$lt": np.less,
+}
+
+_cache = {"path": None, "mtime": None, "engine": None}
+_cache_lock = threading.Lock()
+
+
+def _units(value) -> int:
+    try:
+        return max(0, int(float(value)))
+    except (ValueError, TypeError):
+        return 0
+
+
+def record_dimensions(record: dict) -> dict:
+    """Dimension values for one processed record."""
+    reg_date = record.get('reg_date', '') or ''
+    return {
+        "postcode": normalize_postcode(record.get('postcode', '')),
+        "place": record_place(record.get('location', '')),
+        "year": reg_date[:4] if reg_date[:4].isdigit() else "",
+        "decision_class": classify_decision(record.get('decision', '')),
+        "dev_category": record.get('dev_category', ''),
+        "land_type": record.get('land_type', ''),
+        "dev_scale": record.get('dev_scale', ''),
+        "has_appeal": str(bool(record.get('has_appeal', False))),
+    }
+
+
+class AggregateEngine:
+    """Columnar store of record dimensions with precomputed 1-D and 2-D count cubes."""
+
+    def __init__(self, vocabs: dict, codes: dict, units, floor_area=None):
+        self.vocabs = vocabs  # dimension -> list of values (code = index)
+        self.lookup = {dim: {v: i for i, v in enumerate(values)} for dim, values in vocabs.items()}
+        self.codes = {dim: np.asarray(codes[dim], dtype=np.int32) for dim in DIMENSIONS}
+        self.units = np.asarray(units, dtype=np.int64)
+        self.num_records = len(self.units)
+        # Floor area in m² (NaN when not recorded); None for stores written before it was added
+        self.floor_area = None if floor_area is None else np.asarray(
+            [np.nan if v is None else v for v in floor_area], dtype=np.float64
+        )
+        self.ranges = {"num_units": self.units}
+        if self.floor_area is not None:
+            self.ranges["floor_area"] = self.floor_area
+
+        # Precomputed cubes: counts for every dimension and every pair of dimensions
+        self.cubes = {}
+        for dim in DIMENSIONS:
+            self.cubes[(dim,)] = np.bincount(self.codes[dim], minlength=len(vocabs[dim]))
+        for a, b in combinations(DIMENSIONS, 2):
+            size_a, size_b = len(vocabs[a]), len(vocabs[b])
+            flat = self.codes[a] * size_b + self.codes[b]
+            self.cubes[(a, b)] = np.bincount(flat, minlength=size_a * size_b).reshape(size_a, size_b)
+
+    @classmethod
+    def from_records(cls, records) -> "AggregateEngine":
+        vocabs = {dim: [] for dim in DIMENSIONS}
+        index = {dim: {} for dim in DIMENSIONS}
+        codes = {dim: [] for dim in DIMENSIONS}
+        units, floor_area = [], []
+        for record in records:
+            for dim, value in record_dimensions(record).items():
+                if value not in index[dim]:
+                    index[dim][value] = len(vocabs[dim])
+                    vocabs[dim].append(value)
+                codes[dim].append(index[dim][value])
+            units.append(_units(record.get('num_units', '')))
+            floor_area.append(parse_number(record.get('floor_area', '')))
+        return cls(vocabs, codes, units, floor_area)
+
+    def to_dict(self, version: str = "") -> dict:
+        return {
+            "version": version,
+            "vocabs": self.vocabs,
+            "codes": {dim: self.codes[dim].tolist() for dim in DIMENSIONS},
+            "units": self.units.tolist(),
+            "floor_area": None if self.floor_area is None else [
+                None if np.isnan(v) else float(v) for v in self.floor_area
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AggregateEngine":
+        return cls(data["vocabs"], data["codes"], data["units"], data.get("floor_area"))
+
+    # ── Querying ───────────────────────────────────────────────
+
+    def coverage(self, dim: str) -> float:
+        """Share of records with a non-empty value for a dimension."""
+        empty = self.lookup[dim].get("")
+        if empty is None or not self.num_records:
+            return 1.0
+        return 1 - self.cubes[(dim,)][empty] / self.num_records
+
+    def _mask(self, filters: dict):
+        mask = np.ones(self.num_records, dtype=bool)
+        for dim, values in filters.items():
+            if dim in RANGE_FILTERS:
+                for op, bound in values.items():
+                    mask &= _RANGE_OPS[op](self.ranges[dim], bound)
+                continue
+            wanted = [self.lookup[dim][v] for v in values if v in self.lookup[dim]]
+            mask &= np.isin(self.codes[dim], wanted)
+        return mask
+
+    def _from_cube(self, filters: dict, group_by: str):
+        """Counts from a precomputed cube, or None if the query needs a scan."""
+        if len(filters) > 1 or any(dim in RANGE_FILTERS for dim in filters):
+            return None
+        if not filters:
+            return self.cubes[(group_by,)] if group_by else np.array([self.num_records])
+        (dim, values), = filters.items()
+        codes = [self.lookup[dim][v] for v in values if v in self.lookup[dim]]
+        if not group_by:
+            return np.array([self.cubes[(dim,)][codes].sum()])
+        if dim == group_by:
+            counts = np.zeros(len(self.vocabs[dim]), dtype=np.int64)
+            counts[codes] = self.cubes[(dim,)][codes]
+            return counts
+        if (dim, group_by) in self.cubes:
+            return self.cubes[(dim, group_by)][codes].sum(axis=0)
+        return self.cubes[(group_by, dim)][:, codes].sum(axis=1)
+
+    def aggregate(self, filters: dict = None, group_by: str = None, measure: str = "count") -> dict:
+        """
+        Count records (or sum residential units) matching filters.
+
+        Args:
+            filters: dimension -> list of accepted values, plus optional
+                     "num_units" / "floor_area" -> {"$gte": n, ...} ranges
+            group_by: optional dimension to break the result down by
+            measure: "count", "units" or "floor_area" (sum of recorded floor areas)
+
+        Returns:
+            {"total": n} or {"total": n, "groups": {value: n}}
+        """
+        filters = {dim: values for dim, values in (filters or {}).items() if values}
+        counts = self._from_cube(filters, group_by) if measure == "count" else None
+        if counts is None:
+            mask = self._mask(filters)
+            weights = None
+            if measure == "units":
+                weights = self.units[mask]
+            elif measure == "floor_area":
+                weights = np.nan_to_num(self.floor_area[mask])
+            if group_by:
+                counts = np.bincount(self.codes[group_by][mask], weights=weights,
+                                     minlength=len(self.vocabs[group_by]))
+            else:
+                counts = np.array([weights.sum() if weights is not None else mask.sum()])
+
+        if not group_by:
+            return {"total": int(counts.sum())}
+        groups = {self.vocabs[group_by][i]: int(n) for i, n in enumerate(counts) if n}
+        return {"total": int(sum(groups.values())), "groups": groups}
+
+
+# ── Query routing ──────────────────────────────────────────────
+
+# Things the store can count or group by
+_COUNTABLE = (
+    r"(?:applications?|refusals?|approvals?|grants?|appeals?|permissions?|decisions?|schemes?|developments?|"
+    r"extensions?|units|homes|dwellings|apartments|areas|postcodes|districts|neighbourhoods|categories|types)"
+)
+_DECISION_WORD = r"(?:refused|rejected|approved|granted|appealed)"
+
+# Phrases that ask for figures on their own
+_AGGREGATE_RE = re.compile(
+    r"\b(trends?|per year|each year|by year|over time|statistics|stats|percentage|proportion|breakdown|"
+    r"(?:approval|refusal|grant|success|rejection|appeal) rates?|rates? of (?:approval|refusal|appeals?))\b",
+    re.IGNORECASE,
+)
+# "how many" / "number of" only for countable things: "how many units", "how many were
+# refused" — not "how many storeys can I build"
+_COUNT_RE = re.compile(
+    rf"\b(?:how many|number of|count of)\s+(?:(?:were|was|have|had|got|are)\b|(?:\w+\s+){{0,2}}?{_COUNTABLE}\b)",
+    re.IGNORECASE,
+)
+# Ranking words only directly before what is counted or grouped: "the most refused areas",
+# "the most refusals", "top 5 postcodes", "total units" — not "the most interesting application"
+_RANKING_RE = re.compile(
+    rf"\b(?:most|least|fewest|highest|lowest|total|top(?: \d+)?)\s+(?:{_DECISION_WORD}\s+)?{_COUNTABLE}\b",
+    re.IGNORECASE,
+)
+# "total floor area of offices approved in Dublin 2" sums floor areas
+_FLOOR_AREA_SUM_RE = re.compile(
+    r"\b(?:total|combined|sum of(?: the)?|how much)\s+(?:\w+\s+)?floor\s*(?:area|space)\b", re.IGNORECASE
+)
+_NOT_AGGREGATE_RE = re.compile(r"\bmost recent(ly)?\b", re.IGNORECASE)
+
+_GROUP_BY_RULES = [
+    (re.compile(r"\b(trends?|per year|each year|by year|over time|annually|over the years)\b", re.I), "year"),
+    (re.compile(r"(?<!floor )\b(areas?|postcodes?|districts?|neighbourhoods?|parts of)\b", re.I), "area"),
+    (re.compile(r"\b(categor(y|ies)|types? of)\b", re.I), "dev_category"),
+    (re.compile(r"\b(outcomes?|decisions?)\b", re.I), "decision_class"),
+    (re.compile(r"\b(scales?|sizes?)\b", re.I), "dev_scale"),
+    (re.compile(r"\bland types?\b", re.I), "land_type"),
+]
+
+# "How many (residential) units ..." asks for a sum of units, not a count of applications
+_UNITS_RE = re.compile(
+    r"\b(how many|number of|total)\s+(?:\w+\s+)?(units|homes|apartments|dwellings)\b", re.IGNORECASE
+)
+
+# Parsed metadata filters that map onto aggregate dimensions
+_FILTER_DIMENSIONS = ["postcode", "decision_class", "dev_category", "land_type", "dev_scale", "has_appeal"]
+
+
+def plan_aggregate(query: str):
+    """
+    Detect an aggregate (count/trend/ranking) question and turn it into a spec.
+
+    Questions naming a planning reference are about that application, not the dataset:
+
+    >>> plan_aggregate("How many units does 1005/20 have?") is None
+    True
+    >>> plan_aggregate("What is the most interesting application near Portobello?") is None
+    True
+    >>> plan_aggregate("How many storeys can I build in Dublin 6?") is None
+    True
+    >>> spec = plan_aggregate("What was the total floor area of offices approved in Dublin 2?")
+    >>> spec["measure"], spec["group_by"]
+    ('floor_area', None)
+
+    Returns:
+        {"filters": {dim: [values]}, "group_by": dim or "area" or None,
+         "measure": "count"|"units"|"floor_area", "ignored": [fields]}
+        or None for ordinary retrieval questions
+    """
+    if extract_refs(query):
+        return None  # "How many units does 1005/20 have?" needs that record, via the reference lookup
+    text = _NOT_AGGREGATE_RE.sub("", query)
+    floor_area_sum = _FLOOR_AREA_SUM_RE.search(text)
+    if not (_AGGREGATE_RE.search(text) or _COUNT_RE.search(text) or _RANKING_RE.search(text) or floor_area_sum):
+        return None
+
+    parsed = parse_query_filters(query)
+    filters = {dim: [parsed[dim]] for dim in _FILTER_DIMENSIONS if dim in parsed}
+
+    for dim in RANGE_FILTERS:
+        if dim in parsed:
+            filters[dim] = parsed[dim]
+    # Parsed filters the statistics have no column for, reported with the figures
+    ignored = [field for field in parsed if field not in filters and field not in ("reg_day", "postcode")]
+
+    # Registration-date ranges become the registration years they overlap
+    date_range = parse_date_range(query)
+    if date_range:
+        start, end = date_range
+        first = start.year if start else 1990
+        last = (end.year - (1 if end.month == 1 and end.day == 1 else 0)) if end else date.today().year
+        filters["year"] = [str(y) for y in range(first, last + 1)]
+
+    places = find_places(query)
+    if places:
+        info = PLACES[places[0]]
+        if "area_postcodes" in info:
+            filters["postcode"] = list(info["area_postcodes"])
+        else:
+            filters["place"] = [places[0]]
+
+    group_by = None
+    for pattern, dim in _GROUP_BY_RULES:
+        if pattern.search(text):
+            group_by = dim
+            break
+
+    measure = "floor_area" if floor_area_sum else "units" if _UNITS_RE.search(query) else "count"
+    return {"filters": filters, "group_by": group_by, "measure": measure, "ignored": ignored}
+
+
+def _describe_filters(filters: dict) -> str:
+    if not filters:
+        return "none (all records)"
+    parts = []
+    for dim, values in filters.items():
+        if dim in RANGE_FILTERS:
+            symbols = {"$gte": ">=", "$gt": ">", "$lte": "<=", "$lt": "<"}
+            parts.extend(f"{RANGE_FILTERS[dim]} {symbols[op]} {bound:g}" for op, bound in values.items())
+        elif dim == "year" and len(values) > 2:
+            parts.append(f"registration year {values[0]}-{values[-1]}")
+        else:
+            parts.append(f"{DIMENSION_LABELS[dim]} = {' or '.join(values)}")
+    return "; ".join(parts)
+
+
+def summarize_aggregate(engine: AggregateEngine, spec: dict) -> str:
+    """Run an aggregate spec and format the exact figures as prompt context."""
+    filters = dict(spec["filters"])
+    measure = spec["measure"]
+    group_by = spec["group_by"]
+    if group_by == "area":
+        # Group by whichever area dimension the data actually populates more
+        group_by = "postcode" if engine.coverage("postcode") >= engine.coverage("place") else "place"
+
+    ignored = list(spec.get("ignored", []))
+    for dim in RANGE_FILTERS:
+        if dim in filters and dim not in engine.ranges:
+            del filters[dim]  # Store written before this column existed
+            ignored.append(dim)
+    if measure == "floor_area" and engine.floor_area is None:
+        measure = "count"
+        ignored.append("floor_area")
+    noun = {
+        "units": "residential units (sum of units in matching applications)",
+        "floor_area": "floor area in m² (sum over matching applications that record one)",
+    }.get(measure, "applications")
+    result = engine.aggregate(filters, group_by, measure)
+
+    lines = [
+        f"Computed statistics over all {engine.num_records:,} indexed planning records "
+        f"(exact figures from the full dataset, not a sample).",
+        f"Filters: {_describe_filters(filters)}",
+    ]
+    if ignored:
+        labels = {"app_class": "application type", **RANGE_FILTERS}
+        lines.append("Not applied (no statistics for it — say so in the answer): "
+                     + ", ".join(labels.get(field, field.replace("_", " ")) for field in ignored))
+    lines.append(f"Total matching {noun}: {result['total']:,}")
+    if "decision_class" in filters and not group_by and measure == "count":
+        base = engine.aggregate({d: v for d, v in filters.items() if d != "decision_class"})["total"]
+        if base:
+            lines.append(f"Share of the {base:,} applications matching the other filters: {result['total'] / base:.1%}")
+    if group_by:
+        groups = result["groups"]
+        label = DIMENSION_LABELS[group_by]
+        # For a decision filter, also report the share of all applications in each group
+        baseline = None
+        if "decision_class" in filters and group_by != "decision_class" and measure == "count":
+            base_filters = {d: v for d, v in filters.items() if d != "decision_class"}
+            baseline = engine.aggregate(base_filters, group_by)["groups"]
+
+        if group_by == "year":
+            ordered = sorted(groups.items())
+            lines.append(f"Breakdown by {label}:")
+        else:
+            ordered = sorted(groups.items(), key=lambda item: item[1], reverse=True)[:MAX_GROUPS_SHOWN]
+            lines.append(f"Breakdown by {label} (top {len(ordered)} of {len(groups)}):")
+        for value, n in ordered:
+            line = f"- {value or '(not recorded)'}: {n:,}"
+            if baseline and baseline.get(value):
+                line += f" ({n / baseline[value]:.1%} of {baseline[value]:,} applications)"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+# ── Persistence ────────────────────────────────────────────────
+
+def save_aggregates(engine: AggregateEngine, chroma_dir: Path, version: str = ""):
+    """Write the columnar data next to the vector database."""
+    path = Path(chroma_dir) / AGGREGATES_FILE
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(engine.to_dict(version), f, ensure_ascii=False, separators=(",", ":"))
+    return path
+
+
+def load_aggregates(chroma_dir: Path):
+    """Load the engine (cached in memory, reloaded when the file changes). None if missing."""
+    path = Path(chroma_dir) / AGGREGATES_FILE
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    with _cache_lock:
+        if _cache["path"] != path or _cache["mtime"] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                _cache.update(path=path, mtime=mtime, engine=AggregateEngine.from_dict(json.load(f)))
+        return _cache["engine"]
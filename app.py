@@ -2,12 +2,12 @@
 app.py — Streamlit chat interface for Dublin Planning Permission AI Assistant
 
 Works both locally (via .env file) and on Streamlit Cloud (via st.secrets).
-On first run, automatically downloads data and builds the vector database.
+On first run, downloads data and builds the vector database in the
+background (see index_builder.py) while the app starts serving.
 """
 
 import streamlit as st
 import os
-from pathlib import Path
 
 # ── Load API keys from Streamlit secrets OR .env file ──────────
 # Streamlit Cloud uses st.secrets; local dev uses .env
@@ -145,48 +145,42 @@ with st.sidebar:
     st.divider()
     st.markdown("**Blindspot Labs** — The Strange Data Project\nNomad AI Competition 2025 🏆 2nd Place")
     show_sources = st.checkbox("Show retrieved sources", value=False)
+    show_timings = st.checkbox("Show stage timings with sources", value=False)
     st.caption("Embeddings: Local (MiniLM) | Generation: Claude")
 
 
-# ── Auto-setup: download data & build DB if needed ─────────────
-@st.cache_resource(show_spinner="Setting up planning database (first run only, ~5 min)...")
-def setup_and_load():
-    """Download data, build vector DB, and return the ChromaDB collection."""
+# ── Background setup: download data & build DB without blocking ──
+@st.cache_resource
+def get_index_builder():
+    """One background index builder per server process; starts a build if the index is missing or outdated."""
+    from index_builder import IndexBuilder
     
-    # Check API key — Anthropic for generation, embeddings are local (no key needed)
-    if not os.environ.get("ANTHROPIC_API_KEY"):
-        return None, "ANTHROPIC_API_KEY not found. Add it to .env (local) or Streamlit Secrets (cloud)."
-    
-    chroma_dir = Path("chroma_db")
-    data_dir = Path("data")
-    
-    # If vector DB doesn't exist yet, build it
-    if not chroma_dir.exists() or not any(chroma_dir.iterdir()):
-        try:
-            # Step 1: Download data
-            if not (data_dir / "processed_records.json").exists():
-                from download_data import download_all_data, clean_and_process_data
-                
-                if not download_all_data():
-                    return None, "Failed to download planning data from ArcGIS API."
-                
-                if not clean_and_process_data():
-                    return None, "Failed to process planning data."
-            
-            # Step 2: Build vector DB
-            from build_vectordb import build_vector_database
-            build_vector_database()
-            
-        except Exception as e:
-            return None, f"Setup failed: {str(e)}"
-    
-    # Load the collection
-    try:
-        from rag_engine import get_collection
-        collection = get_collection()
-        return collection, None
-    except Exception as e:
-        return None, f"Failed to load planning database: {str(e)}"
+    builder = IndexBuilder()
+    builder.ensure_index()
+    return builder
+
+
+def render_build_status(builder):
+    """Progress of a running build; reruns the whole app when it finishes or a partial index appears."""
+    status = builder.status()
+    if status["state"] == "running":
+        st.progress(status["progress"], text=f"🔧 Building planning database — {status['message']}")
+        if status["serving"] == "index":
+            st.caption(f"{status['reason']}. Answering from the current index until the new one is ready.")
+    elif status["state"] == "failed":
+        st.error(f"⚠️ Planning database build failed: {status['error']}")
+    if st.session_state.get("build_serving") not in (None, status["serving"]) or (
+        st.session_state.get("build_state") == "running" and status["state"] != "running"
+    ):
+        st.session_state.build_serving, st.session_state.build_state = status["serving"], status["state"]
+        st.rerun()
+    st.session_state.build_serving, st.session_state.build_state = status["serving"], status["state"]
+
+
+# Re-check the build every few seconds without a full rerun where Streamlit supports fragments
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if _fragment is not None:
+    render_build_status = _fragment(run_every=2)(render_build_status)
 
 
 # Initialize session state
@@ -195,24 +189,64 @@ if "messages" not in st.session_state:
 if "pending_question" not in st.session_state:
     st.session_state.pending_question = None
 
-# Load collection
-collection, error = setup_and_load()
-
-if error:
-    st.error(f"⚠️ {error}")
-    if "API_KEY" in error:
-        st.info(
-            "**Local:** Create a `.env` file with `OPENAI_API_KEY=sk-your-key`\n\n"
-            "**Streamlit Cloud:** Go to App Settings → Secrets and add:\n"
-            "```\nOPENAI_API_KEY = \"sk-your-key\"\n```"
-        )
+# Check API key — Anthropic for generation, embeddings are local (no key needed)
+if not os.environ.get("ANTHROPIC_API_KEY"):
+    st.error("⚠️ ANTHROPIC_API_KEY not found. Add it to .env (local) or Streamlit Secrets (cloud).")
+    st.info(
+        "**Local:** Create a `.env` file with `ANTHROPIC_API_KEY=sk-ant-your-key`\n\n"
+        "**Streamlit Cloud:** Go to App Settings → Secrets and add:\n"
+        "```\nANTHROPIC_API_KEY = \"sk-ant-your-key\"\n```"
+    )
     st.stop()
 
+builder = get_index_builder()
+with st.sidebar:
+    if st.button("🔄 Rebuild planning database", disabled=builder.running, use_container_width=True):
+        builder.start("Rebuild requested")
+        st.rerun()
+
+render_build_status(builder)
+if _fragment is None and builder.running:
+    st.button("Refresh build progress")
+
+# Live index, or while the first build runs the records indexed so far
+collection, degraded = builder.serving_collection()
+if collection is None:
+    st.info("The planning database is being prepared (first run only). "
+            "You can ask questions as soon as the first records are indexed.")
+elif degraded:
+    st.warning("⏳ Answers currently cover only the records indexed so far — "
+               "they will be complete when the build finishes.")
+
+
+def render_sources(sources, trace=None):
+    """Render retrieved source cards (and optionally stage timings) inside a collapsed expander."""
+    with st.expander("📎 Retrieved Sources", expanded=False):
+        if trace:
+            from metrics import format_trace
+            st.caption(f"⏱️ {format_trace(trace)}")
+        for src in sources:
+            cat_badge = f' | <strong>Type:</strong> {src.get("dev_category", "")}' if src.get("dev_category") else ''
+            land_badge = f' | <strong>Land:</strong> {src.get("land_type", "")}' if src.get("land_type") else ''
+            st.markdown(
+                f'<div class="source-card">'
+                f'<strong>Ref:</strong> {src["ref"]} | '
+                f'<strong>Location:</strong> {src["location"][:80]} | '
+                f'<strong>Decision:</strong> {src["decision"]} | '
+                f'<strong>Relevance:</strong> {src["relevance"]}'
+                f'{cat_badge}{land_badge}'
+                f'</div>',
+                unsafe_allow_html=True,
+            )
+
 
 def get_chat_history():
     history = []
     for msg in st.session_state.messages[-6:]:
-        history.append({"role": msg["role"], "content": msg["content"]})
+        turn = {"role": msg["role"], "content": msg["content"]}
+        if msg.get("record_ids"):
+            turn["record_ids"] = msg["record_ids"]  # Lets follow-ups reuse this answer's records
+        history.append(turn)
     return history
 
 
@@ -221,24 +255,11 @@ for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
         if show_sources and message["role"] == "assistant" and "sources" in message:
-            with st.expander("📎 Retrieved Sources", expanded=False):
-                for src in message["sources"]:
-                    cat_badge = f' | <strong>Type:</strong> {src.get("dev_category", "")}' if src.get("dev_category") else ''
-                    land_badge = f' | <strong>Land:</strong> {src.get("land_type", "")}' if src.get("land_type") else ''
-                    st.markdown(
-                        f'<div class="source-card">'
-                        f'<strong>Ref:</strong> {src["ref"]} | '
-                        f'<strong>Location:</strong> {src["location"][:80]} | '
-                        f'<strong>Decision:</strong> {src["decision"]} | '
-                        f'<strong>Relevance:</strong> {src["relevance"]}'
-                        f'{cat_badge}{land_badge}'
-                        f'</div>',
-                        unsafe_allow_html=True,
-                    )
+            render_sources(message["sources"], message.get("metrics") if show_timings else None)
 
 # Handle pending question from sidebar
 # Always render chat_input so it never disappears
-prompt = st.chat_input("Ask about Dublin planning applications...")
+prompt = st.chat_input("Ask about Dublin planning applications...", disabled=collection is None)
 
 # Sidebar click takes priority
 if st.session_state.pending_question:
@@ -252,45 +273,52 @@ if prompt:
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner("Searching planning records..."):
-            try:
-                from rag_engine import query_planning
-
-                result = query_planning(
-                    query=prompt,
-                    chat_history=get_chat_history(),
-                    collection=collection,
-                )
-                answer = result["answer"]
-                sources = result["sources"]
-
-                st.markdown(answer)
-
-                if show_sources and sources:
-                    with st.expander("📎 Retrieved Sources", expanded=False):
-                        for src in sources:
-                            cat_badge = f' | <strong>Type:</strong> {src.get("dev_category", "")}' if src.get("dev_category") else ''
-                            land_badge = f' | <strong>Land:</strong> {src.get("land_type", "")}' if src.get("land_type") else ''
-                            st.markdown(
-                                f'<div class="source-card">'
-                                f'<strong>Ref:</strong> {src["ref"]} | '
-                                f'<strong>Location:</strong> {src["location"][:80]} | '
-                                f'<strong>Decision:</strong> {src["decision"]} | '
-                                f'<strong>Relevance:</strong> {src["relevance"]}'
-                                f'{cat_badge}{land_badge}'
-                                f'</div>',
-                                unsafe_allow_html=True,
-                            )
-
-                st.session_state.messages.append(
-                    {"role": "assistant", "content": answer, "sources": sources}
-                )
-
-            except Exception as e:
-                error_msg = f"Sorry, I encountered an error: {str(e)}"
-                st.error(error_msg)
-                st.session_state.messages.append(
-                    {"role": "assistant", "content": error_msg, "sources": []}
-                )
+        try:
+            from rag_engine import stream_query_planning
+
+            events = stream_query_planning(
+                query=prompt,
+                chat_history=get_chat_history(),
+                collection=collection,
+                use_cache=not degraded,  # Don't cache answers or retrievals from a half-built index
+            )
+
+            # Sources arrive as soon as retrieval finishes; tokens follow
+            with st.spinner("Searching planning records..."):
+                first = next(events)
+            sources = first["sources"]
+            if first.get("cached"):
+                st.caption("⚡ Answered from cache")
+
+            # Placeholder keeps the answer above the sources while it streams in
+            answer_placeholder = st.empty()
+            if show_sources and sources:
+                render_sources(sources)
+
+            answer = ""
+            trace = None
+            for event in events:
+                if event["type"] == "fallback":
+                    # Claude is late or down: show the records now; tokens replace this if they follow
+                    answer_placeholder.markdown(event["answer"] + ("\n\n_Still waiting for Claude…_" if event["reason"] == "timeout" else ""))
+                elif event["type"] == "token":
+                    answer += event["text"]
+                    answer_placeholder.markdown(answer + "▌")
+                elif event["type"] == "done":
+                    answer = event["answer"]
+                    trace = event.get("metrics")
+            answer_placeholder.markdown(answer)
+
+            st.session_state.messages.append(
+                {"role": "assistant", "content": answer, "sources": sources, "metrics": trace,
+                 "record_ids": first.get("record_ids", [])}
+            )
+
+        except Exception as e:
+            error_msg = f"Sorry, I encountered an error: {str(e)}"
+            st.error(error_msg)
+            st.session_state.messages.append(
+                {"role": "assistant", "content": error_msg, "sources": []}
+            )
 
     st.rerun()
@@ -0,0 +1,316 @@
+"""
+async_engine.py — asyncio API over the RAG pipeline for concurrent users
+
+rag_engine is synchronous: embedding, the ChromaDB query and the Claude call
+all block. This module lets one server process hold many questions in flight:
+
+- embedding, search and context assembly run on a bounded thread pool
+  (ASYNC_WORKERS threads), keeping the event loop free
+- Claude is called through the async pooled client (llm_client.acreate_message)
+- at most MAX_CONCURRENT_QUERIES questions run at once; up to MAX_QUEUE_DEPTH
+  more wait for a slot, beyond that OverloadedError is raised
+- identical questions asked while one is in flight share its answer
+  (see coalescing.py)
+- generation has the same deadlines and templated fallbacks as rag_engine
+- in-flight, waiting and executor queue depths are tracked for monitoring
+
+Usage:
+    result = await aquery_planning("What was refused in Dublin 8?")
+    async for event in astream_query_planning(question): ...
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+import metrics
+from coalescing import AsyncSingleFlight, flight_key
+from rag_engine import (
+    COALESCE_QUERIES, FALLBACK_ANSWERS, ANSWER_DEADLINE_S, FIRST_TOKEN_DEADLINE_S,
+    get_collection, get_collection_version, retrieve_context, prepare_context, store_answer,
+    context_summary, generation_params, fallback_answer, pending_answers,
+)
+
+ASYNC_WORKERS = int(os.getenv("ASYNC_WORKERS", 4))  # Threads for embedding/search
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", 32))
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", 256))  # Questions allowed to wait for a slot
+
+
+class OverloadedError(RuntimeError):
+    """Raised when too many questions are already waiting for a slot."""
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_limits = {}  # id(event loop) -> (loop, asyncio.Semaphore)
+_late_answers = set()  # Generation tasks still running after their deadline
+
+_metrics = {
+    "in_flight": 0, "waiting": 0, "executor_pending": 0,
+    "peak_in_flight": 0, "peak_waiting": 0, "peak_executor_pending": 0,
+    "completed": 0, "failed": 0, "rejected": 0,
+}
+_metrics_lock = threading.Lock()
+query_flights = AsyncSingleFlight()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """The bounded thread pool used for blocking pipeline stages."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="rag-worker")
+    return _executor
+
+
+def shutdown_executor(wait: bool = True):
+    """Stop the worker threads (a new pool is created on next use)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def _adjust(name: str, delta: int):
+    with _metrics_lock:
+        _metrics[name] += delta
+        peak = "peak_" + name
+        if peak in _metrics and _metrics[name] > _metrics[peak]:
+            _metrics[peak] = _metrics[name]
+
+
+def _semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    entry = _limits.get(id(loop))
+    if entry is None or entry[0] is not loop:
+        entry = (loop, asyncio.Semaphore(MAX_CONCURRENT_QUERIES))
+        _limits[id(loop)] = entry
+    return entry[1]
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the worker pool and await its result (in the caller's metrics trace)."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    _adjust("executor_pending", 1)
+    try:
+        return await loop.run_in_executor(get_executor(), partial(context.run, fn, *args, **kwargs))
+    finally:
+        _adjust("executor_pending", -1)
+
+
+@asynccontextmanager
+async def query_slot():
+    """Hold one of the MAX_CONCURRENT_QUERIES slots for the duration of a question."""
+    with _metrics_lock:
+        if _metrics["waiting"] >= MAX_QUEUE_DEPTH:
+            _metrics["rejected"] += 1
+            raise OverloadedError(f"{_metrics['waiting']} questions already waiting")
+    _adjust("waiting", 1)
+    semaphore = _semaphore()
+    try:
+        await semaphore.acquire()
+    finally:
+        _adjust("waiting", -1)
+    _adjust("in_flight", 1)
+    try:
+        yield
+    except Exception:
+        _adjust("failed", 1)
+        raise
+    else:
+        _adjust("completed", 1)
+    finally:
+        _adjust("in_flight", -1)
+        semaphore.release()
+
+
+async def aretrieve_context(query: str, **kwargs) -> tuple[str, list[dict]]:
+    """Async retrieve_context (runs on the worker pool)."""
+    return await run_blocking(retrieve_context, query, **kwargs)
+
+
+async def aprepare_context(query: str, chat_history: list = None, collection=None,
+                           use_cache: bool = True) -> dict:
+    """Async prepare_context: aggregate routing, retrieval and cache lookup on the worker pool."""
+    if collection is None:
+        collection = await run_blocking(get_collection)
+    return await run_blocking(prepare_context, query, chat_history, collection, use_cache)
+
+
+async def agenerate_response(query: str, context: str, chat_history: list = None,
+                             context_label: str = "Retrieved Planning Records") -> str:
+    """Generate the answer with the async Claude client."""
+    from llm_client import acreate_message, response_text
+
+    response = await acreate_message(**generation_params(query, context, chat_history, context_label))
+    return response_text(response)
+
+
+async def agenerate_with_deadline(query: str, state: dict, chat_history: list = None,
+                                  deadline_s: float = ANSWER_DEADLINE_S) -> tuple:
+    """
+    Async rag_engine.generate_with_deadline: a templated answer if Claude fails
+    or misses deadline_s. The late answer keeps generating on the event loop:
+    it lands in the answer cache when eligible and can be collected with
+    rag_engine.wait_for_answer(answer_id), as with the sync engine.
+
+    Returns:
+        (answer, fallback_reason, answer_id) — reason None, "timeout" or "error";
+        answer_id only when a late answer is still on its way
+    """
+    coro = agenerate_response(query, state["context"], chat_history, state["context_label"])
+    if not FALLBACK_ANSWERS:
+        return await coro, None, None
+
+    task = asyncio.ensure_future(coro)
+    done, _ = await asyncio.wait({task}, timeout=deadline_s or None)
+    if not done:
+        answer_id = uuid.uuid4().hex
+        late = Future()  # Thread-safe handle for wait_for_answer (e.g. the service's /answer endpoint)
+        pending_answers.put(answer_id, late)
+        _late_answers.add(task)
+        task.add_done_callback(_late_answers.discard)
+        task.add_done_callback(partial(_settle_late_answer, query, state, late))
+        return fallback_answer(query, state, "timeout"), "timeout", answer_id
+    try:
+        return task.result(), None, None
+    except Exception as e:
+        metrics.flag("generation_error", type(e).__name__)
+        return fallback_answer(query, state, "error"), "error", None
+
+
+def _settle_late_answer(query: str, state: dict, late: Future, task: asyncio.Task):
+    if task.cancelled():
+        late.cancel()
+    elif task.exception() is not None:
+        late.set_exception(task.exception())
+    else:
+        late.set_result(task.result())
+        store_answer(query, state, task.result())
+
+
+async def aquery_planning(query: str, chat_history: list = None, collection=None,
+                          use_cache: bool = True) -> dict:
+    """Async query_planning: same result dict, without blocking the event loop."""
+    if not COALESCE_QUERIES:
+        return {**await _aquery_planning(query, chat_history, collection, use_cache), "coalesced": False}
+    if collection is None:
+        collection = await run_blocking(get_collection)
+    result, shared = await query_flights.do(
+        flight_key(query, chat_history, "answer", use_cache, get_collection_version(collection)),
+        lambda: _aquery_planning(query, chat_history, collection, use_cache),
+    )
+    return {**result, "coalesced": shared}
+
+
+async def _aquery_planning(query: str, chat_history: list, collection, use_cache: bool) -> dict:
+    async with query_slot():
+        with metrics.trace_query(query) as trace:
+            state = await aprepare_context(query, chat_history, collection, use_cache)
+            answer = state["cached_answer"]
+            fallback = answer_id = None
+            if answer is None:
+                if not os.getenv("ANTHROPIC_API_KEY"):
+                    raise ValueError("ANTHROPIC_API_KEY not found. Set it in .env.")
+                with metrics.stage("generate"):
+                    answer, fallback, answer_id = await agenerate_with_deadline(query, state, chat_history)
+                if fallback is None:
+                    store_answer(query, state, answer)
+        return {
+            "answer": answer, **context_summary(state), "metrics": trace.final,
+            "fallback": fallback, "answer_id": answer_id,
+        }
+
+
+async def astream_query_planning(query: str, chat_history: list = None, collection=None,
+                                 use_cache: bool = True):
+    """
+    Async stream_query_planning: yields the same sources/fallback/token/done
+    events. An identical question already streaming on this loop is replayed
+    rather than run again (done["coalesced"] is True).
+    """
+    if not os.getenv("ANTHROPIC_API_KEY"):
+        raise ValueError("ANTHROPIC_API_KEY not found. Set it in .env.")
+
+    def make_events():
+        return _astream_query_planning(query, chat_history, collection, use_cache)
+
+    if not COALESCE_QUERIES:
+        events, shared = make_events(), False
+    else:
+        if collection is None:
+            collection = await run_blocking(get_collection)
+        key = flight_key(query, chat_history, "stream", use_cache, get_collection_version(collection))
+        events, shared = query_flights.stream(key, make_events)
+    async for event in events:
+        if event["type"] == "done":
+            event = {**event, "coalesced": shared}
+        yield event
+
+
+async def _astream_query_planning(query: str, chat_history: list, collection, use_cache: bool):
+    from llm_client import astream_message
+
+    async with query_slot():
+        with metrics.trace_query(query) as trace:
+            state = await aprepare_context(query, chat_history, collection, use_cache)
+            yield {"type": "sources", **context_summary(state)}
+
+            answer = state["cached_answer"]
+            fallback = None
+            if answer is not None:
+                yield {"type": "token", "text": answer}
+            else:
+                answer_parts = []
+                params = generation_params(query, state["context"], chat_history, state["context_label"])
+                chunks = astream_message(**params).__aiter__()
+                with metrics.stage("generate"):
+                    try:
+                        first = asyncio.ensure_future(chunks.__anext__())
+                        if FALLBACK_ANSWERS and FIRST_TOKEN_DEADLINE_S:
+                            done, _ = await asyncio.wait({first}, timeout=FIRST_TOKEN_DEADLINE_S)
+                            if not done:  # Show the records while Claude catches up
+                                yield {"type": "fallback", "reason": "timeout",
+                                       "answer": fallback_answer(query, state, "timeout")}
+                        try:
+                            text = await first
+                        except StopAsyncIteration:
+                            text = None
+                        if text is not None:
+                            metrics.flag("first_token_ms", round((time.perf_counter() - trace.started) * 1000, 2))
+                            answer_parts.append(text)
+                            yield {"type": "token", "text": text}
+                            async for text in chunks:
+                                answer_parts.append(text)
+                                yield {"type": "token", "text": text}
+                    except Exception as e:
+                        if answer_parts or not FALLBACK_ANSWERS:
+                            raise
+                        metrics.flag("generation_error", type(e).__name__)
+                        fallback = "error"
+                        answer = fallback_answer(query, state, "error")
+                        yield {"type": "fallback", "reason": "error", "answer": answer}
+                if fallback is None:
+                    answer = "".join(answer_parts)
+                    store_answer(query, state, answer)
+        yield {"type": "done", "answer": answer, "fallback": fallback, "metrics": trace.final}
+
+
+def get_async_stats() -> dict:
+    """Current and peak concurrency/queue depths, plus completed/failed/rejected counts."""
+    with _metrics_lock:
+        stats = dict(_metrics)
+    stats["max_concurrent_queries"] = MAX_CONCURRENT_QUERIES
+    stats["max_queue_depth"] = MAX_QUEUE_DEPTH
+    stats["workers"] = ASYNC_WORKERS
+    stats["coalescing"] = query_flights.stats()
+    return stats
@@ -0,0 +1,106 @@
+"""
+benchmark_rerank.py — Added re-rank latency vs. prompt tokens saved
+
+For each benchmark question, over-fetches RERANK_CANDIDATES records once and
+compares the baseline (first-stage top TOP_K, no re-ranking) against each
+re-rank mode: re-rank time, assembled context tokens and records sent to
+Claude. No LLM calls are made; only the vector database is needed.
+
+Usage:
+    python benchmark_rerank.py
+    python benchmark_rerank.py --modes features --output rerank_benchmark.json
+"""
+
+import argparse
+import json
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+EXTRA_QUESTIONS = [
+    "What developments were approved near Portobello?",
+    "Were any large apartment schemes refused in Dublin 1 since 2020?",
+    "Tell me about extensions on Griffith Avenue",
+    "What are the most recent applications in Stoneybatter?",
+    "Show me retention applications for shopfronts in Rathmines",
+]
+
+
+def _p95(values: list[float]) -> float:
+    ordered = sorted(values)
+    return ordered[int(0.95 * (len(ordered) - 1))] if ordered else 0.0
+
+
+def run_benchmark(modes: list[str], output_file: str = None):
+    from evaluate import BASELINE_RESPONSES
+    from rag_engine import TOP_K, get_collection, retrieve_records, parse_query_filters
+    from context_builder import assemble_context
+    from reranker import RERANK_CANDIDATES, RERANK_TOP_N, rerank
+
+    questions = list(BASELINE_RESPONSES) + EXTRA_QUESTIONS
+    collection = get_collection()
+    retrieve_records(questions[0], collection=collection, rerank="off")  # Warm up the embedder
+
+    print(f"Benchmarking {len(questions)} questions: {RERANK_CANDIDATES} candidates -> top {RERANK_TOP_N}\n")
+    rows = {mode: {"rerank_ms": [], "tokens": [], "records": [], "overlap": []} for mode in ["baseline"] + modes}
+    retrieval_ms = []
+    for question in questions:
+        started = time.perf_counter()
+        candidates = retrieve_records(question, collection=collection, top_k=RERANK_CANDIDATES, rerank="off")
+        retrieval_ms.append((time.perf_counter() - started) * 1000)
+        filters = parse_query_filters(question)
+
+        baseline = candidates[:TOP_K]
+        _, used, stats = assemble_context(question, baseline, filters)
+        rows["baseline"]["rerank_ms"].append(0.0)
+        rows["baseline"]["tokens"].append(stats["context_tokens"])
+        rows["baseline"]["records"].append(len(used))
+        rows["baseline"]["overlap"].append(1.0)
+        baseline_ids = {r["id"] for r in baseline}
+
+        for mode in modes:
+            reranked, rerank_stats = rerank(question, candidates, mode=mode, top_n=RERANK_TOP_N)
+            _, used, stats = assemble_context(question, reranked, filters)
+            rows[mode]["rerank_ms"].append(rerank_stats["rerank_ms"])
+            rows[mode]["tokens"].append(stats["context_tokens"])
+            rows[mode]["records"].append(len(used))
+            rows[mode]["overlap"].append(
+                len(baseline_ids & {r["id"] for r in reranked}) / len(reranked) if reranked else 0.0
+            )
+
+    n = len(questions)
+    baseline_tokens = sum(rows["baseline"]["tokens"]) / n
+    summary = {}
+    print(f"First-stage retrieval ({RERANK_CANDIDATES} candidates): avg {sum(retrieval_ms) / n:.1f}ms\n")
+    print(f"{'Mode':<15} {'Rerank avg':>11} {'Rerank p95':>11} {'Ctx tokens':>11} {'Saved':>8} {'Records':>8} {'In top-10':>10}")
+    print("-" * 80)
+    for mode, row in rows.items():
+        avg_tokens = sum(row["tokens"]) / n
+        summary[mode] = {
+            "avg_rerank_ms": round(sum(row["rerank_ms"]) / n, 2),
+            "p95_rerank_ms": round(_p95(row["rerank_ms"]), 2),
+            "avg_context_tokens": round(avg_tokens, 1),
+            "avg_tokens_saved": round(baseline_tokens - avg_tokens, 1),
+            "avg_records": round(sum(row["records"]) / n, 2),
+            "baseline_overlap": round(sum(row["overlap"]) / n, 2),
+        }
+        s = summary[mode]
+        print(f"{mode:<15} {s['avg_rerank_ms']:>9.1f}ms {s['p95_rerank_ms']:>9.1f}ms "
+              f"{s['avg_context_tokens']:>11.0f} {s['avg_tokens_saved']:>8.0f} "
+              f"{s['avg_records']:>8.1f} {s['baseline_overlap']:>10.0%}")
+
+    if output_file:
+        with open(output_file, "w") as f:
+            json.dump({"questions": questions, "summary": summary}, f, indent=2)
+        print(f"\nResults saved to {output_file}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark re-ranking latency vs. prompt tokens")
+    parser.add_argument("--modes", nargs="+", default=["features", "cross-encoder"],
+                        choices=["features", "cross-encoder"])
+    parser.add_argument("--output", default=None, help="Write the summary to a JSON file")
+    args = parser.parse_args()
+    run_benchmark(args.modes, args.output)
@@ -5,14 +5,26 @@ Takes the cleaned JSON records and:
 1. Creates semantically meaningful text chunks for each application
 2. Generates embeddings using sentence-transformers (all-MiniLM-L6-v2) — local, free, no API key
 3. Stores everything in a local ChromaDB collection
+4. Writes an exact-match reference index, a BM25 lexical index, a spatial
+   grid index and the columnar aggregate store alongside it (see ref_index.py,
+   lexical_index.py, geo_index.py, aggregates.py)
+5. Stores per-area digest documents in a second collection (see digests.py)
 """
 
 import json
 import os
 import sys
+from datetime import datetime, timezone
 from pathlib import Path
 from dotenv import load_dotenv
 
+from query_filters import normalize_postcode, classify_decision, classify_app_type, epoch_day, parse_number
+from ref_index import build_ref_index, save_ref_index
+from lexical_index import BM25Index, save_lexical_index
+from geo_index import GeoGridIndex, save_geo_index
+from aggregates import AggregateEngine, save_aggregates
+from digests import DIGEST_COLLECTION_NAME, build_digests
+
 load_dotenv()
 
 DATA_DIR = Path("data")
@@ -122,8 +134,26 @@ def create_metadata(record: dict) -> dict:
         "dev_category": record.get('dev_category', ''),
         "land_type": record.get('land_type', ''),
         "dev_scale": record.get('dev_scale', ''),
+        # Normalised fields for metadata pre-filtering (see query_filters.py)
+        "postcode": normalize_postcode(record.get('postcode', '')),
+        "decision_class": classify_decision(record.get('decision', '')),
+        "app_class": classify_app_type(record.get('app_type', '')),
     }
     
+    # Typed fields for range filters: dates as days since 1970-01-01, sizes as numbers
+    for field, date_field in (('reg_day', 'reg_date'), ('dec_day', 'dec_date')):
+        day = epoch_day(record.get(date_field, ''))
+        if day is not None:
+            metadata[field] = day
+    
+    num_units = parse_number(record.get('num_units', ''))
+    if num_units is not None:
+        metadata['num_units'] = int(num_units)
+    
+    floor_area = parse_number(record.get('floor_area', ''))
+    if floor_area is not None:
+        metadata['floor_area'] = floor_area
+    
     # Add coordinates if available
     lat = record.get('lat', '')
     lon = record.get('lon', '')
@@ -138,8 +168,16 @@ def create_metadata(record: dict) -> dict:
     return {k: v for k, v in metadata.items() if v is not None and v != ''}
 
 
-def build_vector_database():
-    """Main function to build the ChromaDB vector database."""
+def build_vector_database(chroma_dir: Path = CHROMA_DIR, progress=None):
+    """
+    Main function to build the ChromaDB vector database.
+    
+    Args:
+        chroma_dir: Where to write the database and its side indexes
+        progress: Optional callback progress(fraction, message), called as
+                  batches are indexed (see index_builder.py)
+    """
+    chroma_dir = Path(chroma_dir)
     
     # No API key needed for embeddings — using local model
     
@@ -166,10 +204,10 @@ def build_vector_database():
     )
     
     # Create/reset ChromaDB
-    print(f"  Initializing ChromaDB at {CHROMA_DIR}...")
-    CHROMA_DIR.mkdir(exist_ok=True)
+    print(f"  Initializing ChromaDB at {chroma_dir}...")
+    chroma_dir.mkdir(exist_ok=True)
     
-    client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+    client = chromadb.PersistentClient(path=str(chroma_dir))
     
     # Delete existing collection if it exists
     try:
@@ -178,10 +216,15 @@ def build_vector_database():
     except Exception:
         pass
     
+    # Index version: caches keyed on the collection are invalidated when this changes
+    built_at = datetime.now(timezone.utc).isoformat()
     collection = client.create_collection(
         name=COLLECTION_NAME,
         embedding_function=st_ef,
-        metadata={"description": "Dublin City Council Planning Applications"}
+        metadata={
+            "description": "Dublin City Council Planning Applications",
+            "built_at": built_at,
+        }
     )
     print(f"    Created collection '{COLLECTION_NAME}'")
     
@@ -193,6 +236,10 @@ def build_vector_database():
     
     total_added = 0
     errors = 0
+    ref_entries = []  # (doc_id, ref, appeal_refs) for the exact-match reference index
+    lexical_docs = []  # (doc_id, location, proposal) for the BM25 index
+    geo_points = []  # (doc_id, lat, lon) for the spatial grid index
+    digest_entries = []  # (doc_id, record) for the area digests
     
     for batch_start in range(0, len(records), BATCH_SIZE):
         batch_end = min(batch_start + BATCH_SIZE, len(records))
@@ -201,6 +248,10 @@ def build_vector_database():
         documents = []
         metadatas = []
         ids = []
+        batch_refs = []
+        batch_lexical = []
+        batch_geo = []
+        batch_digest = []
         
         for i, record in enumerate(batch):
             doc_text = create_document_text(record)
@@ -214,6 +265,13 @@ def build_vector_database():
             documents.append(doc_text)
             metadatas.append(metadata)
             ids.append(doc_id)
+            appeal_refs = [record.get('appeal_ref', '')]
+            appeal_refs += [a.get('AppealRef', '') for a in record.get('appeal_details', [])]
+            batch_refs.append((doc_id, record.get('ref', ''), appeal_refs))
+            batch_lexical.append((doc_id, record.get('location', ''), record.get('proposal', '')))
+            if 'lat' in metadata and 'lon' in metadata:
+                batch_geo.append((doc_id, metadata['lat'], metadata['lon']))
+            batch_digest.append((doc_id, record))
         
         if not documents:
             continue
@@ -225,8 +283,14 @@ def build_vector_database():
                 ids=ids
             )
             total_added += len(documents)
+            ref_entries.extend(batch_refs)
+            lexical_docs.extend(batch_lexical)
+            geo_points.extend(batch_geo)
+            digest_entries.extend(batch_digest)
             pct = (batch_end / len(records)) * 100
             print(f"\r    Progress: {pct:.1f}% — {total_added:,} records indexed", end="")
+            if progress:
+                progress(batch_end / len(records), f"{total_added:,} of {len(records):,} records indexed")
         except Exception as e:
             errors += 1
             if errors <= 5:
@@ -238,7 +302,55 @@ def build_vector_database():
     print(f"    Total indexed: {total_added:,} records")
     if errors > 0:
         print(f"    Failed batches: {errors}")
-    print(f"    Database location: {CHROMA_DIR}")
+    print(f"    Database location: {chroma_dir}")
+    
+    if progress:
+        progress(1.0, "Writing reference, lexical, spatial, aggregate and digest indexes")
+    
+    # Exact-match reference lookup (planning refs + appeal refs → document IDs)
+    ref_index = build_ref_index(ref_entries, version=built_at)
+    save_ref_index(ref_index, chroma_dir)
+    print(f"    Reference index: {len(ref_index['refs']):,} refs, "
+          f"{len(ref_index['appeal_refs']):,} appeal refs")
+    
+    # Lexical BM25 index over location + proposal (for hybrid retrieval)
+    lexical_index = BM25Index.build(lexical_docs)
+    save_lexical_index(lexical_index, chroma_dir, version=built_at)
+    print(f"    Lexical index: {len(lexical_index.postings):,} terms")
+    
+    # Grid index over coordinates (for "near X" radius retrieval)
+    geo_index = GeoGridIndex.build(geo_points)
+    save_geo_index(geo_index, chroma_dir, version=built_at)
+    print(f"    Geo index: {len(geo_index.doc_ids):,} located records, {len(geo_index.cells):,} cells")
+    
+    # Columnar store + group-by cubes for count/trend questions
+    aggregates = AggregateEngine.from_records(records)
+    save_aggregates(aggregates, chroma_dir, version=built_at)
+    print(f"    Aggregates: {aggregates.num_records:,} records, {len(aggregates.cubes)} cubes")
+    
+    # One compact digest per area and period, for area-level questions
+    try:
+        client.delete_collection(name=DIGEST_COLLECTION_NAME)
+    except Exception:
+        pass
+    digest_collection = client.create_collection(
+        name=DIGEST_COLLECTION_NAME,
+        embedding_function=st_ef,
+        metadata={
+            "description": "Per-area digests of Dublin City Council planning applications",
+            "built_at": built_at,
+        }
+    )
+    digests = build_digests(digest_entries)
+    for batch_start in range(0, len(digests), BATCH_SIZE):
+        batch = digests[batch_start:batch_start + BATCH_SIZE]
+        digest_collection.add(
+            documents=[d["document"] for d in batch],
+            metadatas=[d["metadata"] for d in batch],
+            ids=[d["id"] for d in batch]
+        )
+    print(f"    Area digests: {len(digests):,} documents "
+          f"({len({d['metadata']['area'] for d in digests}):,} areas)")
     
     # Quick test query
     print("\n  Running test query: 'house extension Rathmines'...")
@@ -0,0 +1,212 @@
+"""
+caches.py — In-process caches for the RAG pipeline
+
+SemanticAnswerCache: stores generated answers keyed by query embedding. A new
+question is served from the cache when its embedding is within a cosine
+similarity threshold of a cached question AND retrieval returned the same
+record IDs, so a cached answer is only reused when it was grounded in exactly
+the same planning records. The cached embeddings are kept as one normalized
+matrix, so a lookup is a single matrix-vector product rather than a Python
+loop per entry. Entries expire by LRU size limit and TTL, and the whole
+cache is dropped when the collection version (index build) changes.
+
+LRUCache: a bounded exact-key cache with the same version invalidation, used
+for query embeddings and retrieval results.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _unit_vector(embedding) -> np.ndarray:
+    """Convert an embedding (list or numpy array) to a float32 unit vector (zeros stay zeros)."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """Thread-safe LRU/TTL cache of answers keyed by query embedding and retrieved record IDs."""
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = None
+        self._entries = OrderedDict()  # query text -> entry, least recently used first
+        self._matrix = None  # Unit embeddings of _keys, one row each; None when entries changed
+        self._keys = []
+        self._stored_at = None
+        self._groups = {}  # frozenset of record IDs -> group number
+        self._group_of = None  # Group number of each row
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        """Drop every entry if the collection has been rebuilt since they were stored."""
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._matrix = None
+            self.version = version
+
+    def _index(self):
+        """Rebuild the embedding matrix and per-row metadata after entries were added or removed."""
+        if self._matrix is not None:
+            return
+        entries = list(self._entries.items())
+        self._keys = [key for key, _ in entries]
+        self._groups = {}
+        self._group_of = np.array([self._groups.setdefault(entry["ids"], len(self._groups)) for _, entry in entries],
+                                  dtype=np.int64)
+        self._stored_at = np.array([entry["stored_at"] for _, entry in entries], dtype=np.float64)
+        self._matrix = (np.stack([entry["vector"] for _, entry in entries]) if entries
+                        else np.empty((0, 0), dtype=np.float32))
+
+    def lookup(self, embedding, record_ids: list[str], version=None):
+        """
+        Find a cached answer for a query.
+
+        Returns:
+            (answer_payload, similarity) on a hit, (None, best_similarity) on a miss
+        """
+        vector = _unit_vector(embedding)
+        ids_key = frozenset(record_ids)
+        now = time.time()
+        best_key, best_sim = None, 0.0
+
+        with self._lock:
+            self._check_version(version)
+            self._index()
+            expired = np.flatnonzero(now - self._stored_at > self.ttl_seconds)
+            if len(expired):
+                for row in expired:
+                    del self._entries[self._keys[row]]
+                self.expirations += len(expired)
+                self._matrix = None
+                self._index()
+
+            group = self._groups.get(ids_key)
+            if group is not None:
+                # Only entries grounded in the same records are candidates
+                sims = np.where(self._group_of == group, self._matrix @ vector, -1.0)
+                row = int(np.argmax(sims))
+                if sims[row] > best_sim:
+                    best_key, best_sim = self._keys[row], float(sims[row])
+
+            if best_key is not None and best_sim >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return self._entries[best_key]["payload"], best_sim
+
+            self.misses += 1
+            return None, best_sim
+
+    def store(self, query: str, embedding, record_ids: list[str], payload: dict, version=None):
+        """Store an answer payload for a query, evicting the least recently used entry if full."""
+        vector = _unit_vector(embedding)
+        with self._lock:
+            self._check_version(version)
+            self._matrix = None
+            self._entries[query] = {
+                "vector": vector,
+                "ids": frozenset(record_ids),
+                "payload": payload,
+                "stored_at": time.time(),
+            }
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries (stats are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        """Hit-rate and eviction metrics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class LRUCache:
+    """Thread-safe bounded LRU cache; all entries are dropped when the version changes."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key, version=None):
+        """Return the cached value for key, or None."""
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, version=None):
+        """Store a value, evicting the least recently used entry if full."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries (stats are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Hit-rate and eviction metrics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
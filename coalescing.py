@@ -0,0 +1,300 @@
+"""
+coalescing.py — Single-flight coalescing of identical in-flight questions
+
+When several users ask the same question at the same moment (e.g. everyone
+clicking a sample-question button), only the first caller (the leader) runs
+retrieval and generation; callers arriving while it is in flight wait for
+and share its result. Nothing is kept once the flight lands — repeats after
+that are the answer cache's job (see caches.py).
+
+- SingleFlight.do(): blocking calls, from any number of threads
+- SingleFlight.stream(): event generators; followers replay the leader's
+  events as they are produced, so they still stream
+- AsyncSingleFlight.do(): coroutines on one event loop
+- AsyncSingleFlight.stream(): async event generators, replayed like
+  SingleFlight.stream()
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+
+_SPACE_RE = re.compile(r"\s+")
+_TRAILING_RE = re.compile(r"[\s?.!]+$")
+
+
+def normalize_query(query: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question."""
+    return _TRAILING_RE.sub("", _SPACE_RE.sub(" ", query.strip().lower()))
+
+
+def flight_key(query: str, chat_history: list = None, *extra) -> str:
+    """Key under which identical questions (same normalized text and history) coalesce."""
+    history = [(msg.get("role"), msg.get("content"), msg.get("record_ids")) for msg in (chat_history or [])]
+    payload = json.dumps([normalize_query(query), history, *extra], default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One in-flight call: its events so far, then its result or error."""
+
+    def __init__(self):
+        self.events = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.cond = threading.Condition()
+
+    def publish(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def finish(self, result=None, error: BaseException = None):
+        with self.cond:
+            self.result, self.error, self.done = result, error, True
+            self.cond.notify_all()
+
+    def wait(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def replay(self):
+        """Yield the leader's events as they arrive, then raise its error if it failed."""
+        index = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: index < len(self.events) or self.done)
+                pending = self.events[index:]
+                finished = self.done
+            yield from pending
+            index += len(pending)
+            if finished and index >= len(self.events):
+                break
+        if self.error is not None:
+            raise self.error
+
+
+class _AsyncFlight:
+    """One in-flight async event stream: its events so far, then done (or its error)."""
+
+    def __init__(self):
+        self.events = []
+        self.error = None
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, event):
+        self.events.append(event)
+        self._wake()
+
+    def finish(self, error: BaseException = None):
+        self.error, self.done = error, True
+        self._wake()
+
+    async def replay(self):
+        """Yield the leader's events as they arrive, then raise its error if it failed."""
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                break
+            await self._changed.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class SingleFlight:
+    """Thread-safe group of in-flight calls keyed by flight_key()."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key: str):
+        """Return (flight, is_leader), registering a new flight if none is in progress."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.leaders += 1
+            return flight, True
+
+    def _land(self, key: str, flight: _Flight, result=None, error: BaseException = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)
+
+    def do(self, key: str, fn) -> tuple:
+        """
+        Run fn() unless an identical call is in flight, in which case wait for it.
+
+        Returns:
+            (result, shared) — shared is True when the result came from another caller
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.wait(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result=result)
+        return result, False
+
+    def stream(self, key: str, make_events) -> tuple:
+        """
+        Stream make_events() unless an identical stream is in flight, in which
+        case replay that one's events.
+
+        If the leader's consumer stops early, followers get a RuntimeError.
+
+        Returns:
+            (events, shared) — an iterator of events, and whether it is replayed
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.replay(), True
+        return self._lead(key, flight, make_events), False
+
+    def _lead(self, key: str, flight: _Flight, make_events):
+        try:
+            for event in make_events():
+                flight.publish(event)
+                yield event
+        except GeneratorExit:
+            self._land(key, flight, error=RuntimeError("Coalesced stream was abandoned by its leader"))
+            raise
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight)
+
+    def stats(self) -> dict:
+        """Calls executed (leaders), calls served from another's flight, and flights in progress."""
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesced_rate": round(self.coalesced / calls, 3) if calls else 0.0,
+            }
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines; flights are per event loop."""
+
+    def __init__(self):
+        self._flights = {}  # (id(loop), key) -> asyncio.Future
+        self._streams = {}  # (id(loop), key) -> (loop, _AsyncFlight)
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, make_coro) -> tuple:
+        """
+        Await make_coro() unless an identical call is in flight on this loop.
+
+        Returns:
+            (result, shared)
+        """
+        loop = asyncio.get_running_loop()
+        flight_id = (id(loop), key)
+        with self._lock:
+            future = self._flights.get(flight_id)
+            if future is not None and future.get_loop() is loop:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._flights[flight_id] = loop.create_future()
+                self.leaders += 1
+                leader = True
+        if not leader:
+            return await asyncio.shield(future), True
+
+        try:
+            result = await make_coro()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved: there may be no followers
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                if self._flights.get(flight_id) is future:
+                    del self._flights[flight_id]
+
+    def stream(self, key: str, make_events) -> tuple:
+        """
+        Iterate make_events() (an async generator) unless an identical stream
+        is in flight on this loop, in which case replay that one's events.
+
+        If the leader's consumer stops early, followers get a RuntimeError.
+
+        Returns:
+            (events, shared) — an async iterator of events, and whether it is replayed
+        """
+        loop = asyncio.get_running_loop()
+        flight_id = (id(loop), key)
+        with self._lock:
+            entry = self._streams.get(flight_id)
+            if entry is not None and entry[0] is loop:
+                self.coalesced += 1
+                return entry[1].replay(), True
+            flight = _AsyncFlight()
+            self._streams[flight_id] = (loop, flight)
+            self.leaders += 1
+        return self._lead(flight_id, flight, make_events), False
+
+    def _land(self, flight_id, flight: _AsyncFlight, error: BaseException = None):
+        with self._lock:
+            entry = self._streams.get(flight_id)
+            if entry is not None and entry[1] is flight:
+                del self._streams[flight_id]
+        flight.finish(error)
+
+    async def _lead(self, flight_id, flight: _AsyncFlight, make_events):
+        try:
+            async for event in make_events():
+                flight.publish(event)
+                yield event
+        except GeneratorExit:
+            self._land(flight_id, flight, error=RuntimeError("Coalesced stream was abandoned by its leader"))
+            raise
+        except BaseException as e:
+            self._land(flight_id, flight, error=e)
+            raise
+        self._land(flight_id, flight)
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                "in_flight": len(self._flights) + len(self._streams),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesced_rate": round(self.coalesced / calls, 3) if calls else 0.0,
+            }
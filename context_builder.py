@@ -0,0 +1,188 @@
+"""
+context_builder.py — Token-budgeted prompt context from retrieved records
+
+format_context used to paste every retrieved document in full: all the date
+lines, coordinates, appeal details and classification labels, whatever the
+question. assemble_context builds a leaner context:
+
+1. Adaptive k — stop at the first large drop in relevance (keeping a minimum)
+2. Near-duplicates (resubmissions of the same proposal on the same site) are
+   folded into one block with a "Similar applications" line
+3. Lines the question doesn't need are dropped (e.g. coordinates, appeal
+   details unless it asks about appeals) and long proposals are shortened
+4. Blocks are added in rank order until the token budget is reached
+
+Each call reports the tokens saved against the full context.
+"""
+
+import os
+import re
+import threading
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+RELEVANCE_GAP = float(os.getenv("CONTEXT_RELEVANCE_GAP", 0.15))  # Cut-off drop between consecutive results
+MIN_CONTEXT_RECORDS = 3  # Never cut below this many records on relevance alone
+MAX_PROPOSAL_CHARS = 600
+DUPLICATE_SIMILARITY = 0.9  # Jaccard similarity of location + proposal words
+
+# Document lines (see build_vectordb.create_document_text) grouped by when they are needed
+_ALWAYS = {"Planning Application Reference", "Location", "Proposal", "Application Type",
+           "Registration Date", "Decision", "Status"}
+_OPTIONAL = [
+    ({"Application Date", "Decision Date", "Final Grant Date"},
+     re.compile(r"\b(when|date|dates|how long|time|timeline|took|since|before|after|recent\w*|latest|year|month|19\d\d|20\d\d)\b", re.I)),
+    ({"Current Stage"}, re.compile(r"\b(stage|status|progress|pending|decided|outstanding)\b", re.I)),
+    ({"Coordinates"}, re.compile(r"\b(coordinates?|latitude|longitude|map)\b", re.I)),
+    ({"Appeal"}, re.compile(r"\b(appeal\w*|bord plean[aá]la|ABP|inspector)\b", re.I)),
+    ({"Development Category", "Land Type", "Development Scale"},
+     re.compile(r"\b(public|private|land|social|affordable|council|category|categor\w+|scale|large|small|medium|type of)\b", re.I)),
+]
+# Filter fields that make the matching lines relevant even if the wording didn't
+_FILTER_FIELDS = {
+    "reg_day": "Decision Date", "has_appeal": "Appeal", "dev_category": "Development Category",
+    "land_type": "Land Type", "dev_scale": "Development Scale",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+_totals = {"queries": 0, "full_tokens": 0, "context_tokens": 0}
+_totals_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English prose)."""
+    return (len(text) + 3) // 4
+
+
+def record_header(i: int, result: dict) -> str:
+    """Numbered block header with relevance (and distance for radius searches)."""
+    header = f"relevance: {result['relevance']:.2f}"
+    if "distance_m" in result:
+        header += f", {result['distance_m']:.0f} m from {result['near']}"
+    return f"--- Planning Record {i} ({header}) ---"
+
+
+def wanted_fields(query: str, filters: dict = None) -> set[str]:
+    """Document line labels worth including for this question."""
+    fields = set(_ALWAYS)
+    for labels, pattern in _OPTIONAL:
+        if pattern.search(query or ""):
+            fields |= labels
+    for field in filters or {}:
+        label = _FILTER_FIELDS.get(field)
+        if label:
+            fields |= next(labels for labels, _ in _OPTIONAL if label in labels)
+    return fields
+
+
+def _label(line: str) -> str:
+    label = line.split(":", 1)[0]
+    # "Appeal 1: ..." lines share the "Appeal" label
+    return "Appeal" if re.fullmatch(r"Appeal \d+", label) else label
+
+
+def compact_document(document: str, fields: set[str]) -> str:
+    """Keep only the wanted lines of a document, shortening a long proposal."""
+    lines = []
+    for line in document.split("\n"):
+        label = _label(line)
+        if label not in fields:
+            continue
+        if label == "Proposal" and len(line) > MAX_PROPOSAL_CHARS:
+            line = line[:MAX_PROPOSAL_CHARS].rsplit(" ", 1)[0] + " …"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def adaptive_cutoff(results: list[dict]) -> int:
+    """Number of results to keep: stop at the first relevance drop larger than RELEVANCE_GAP."""
+    for i in range(MIN_CONTEXT_RECORDS, len(results)):
+        if results[i - 1]["relevance"] - results[i]["relevance"] > RELEVANCE_GAP:
+            return i
+    return len(results)
+
+
+def _signature(result: dict) -> set[str]:
+    meta = result.get("metadata", {})
+    return set(_WORD_RE.findall(f"{meta.get('location', '')} {meta.get('proposal_short', '')}".lower()))
+
+
+def _similar(a: set[str], b: set[str]) -> bool:
+    if not a or not b:
+        return False
+    return len(a & b) / len(a | b) >= DUPLICATE_SIMILARITY
+
+
+def assemble_context(query: str, results: list[dict], filters: dict = None,
+                     budget: int = None) -> tuple[str, list[dict], dict]:
+    """
+    Build the prompt context for ranked results within a token budget.
+
+    Returns:
+        context_text: Numbered record blocks
+        used_results: The results that made it into the context (for sources/caching)
+        stats: records_in, records_used, dropped_gap, dropped_duplicate,
+               dropped_budget, full_tokens, context_tokens, tokens_saved
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    full_tokens = sum(
+        estimate_tokens(record_header(i, r) + "\n" + r["document"] + "\n")
+        for i, r in enumerate(results, start=1)
+    )
+    keep = adaptive_cutoff(results)
+    fields = wanted_fields(query, filters)
+
+    # Fold near-duplicates into the best-ranked copy
+    groups = []  # (result, signature, [duplicates])
+    dropped_duplicate = 0
+    for result in results[:keep]:
+        signature = _signature(result)
+        for kept, kept_signature, duplicates in groups:
+            if _similar(signature, kept_signature):
+                duplicates.append(result)
+                dropped_duplicate += 1
+                break
+        else:
+            groups.append((result, signature, []))
+
+    blocks, used, tokens = [], [], 0
+    for result, _, duplicates in groups:
+        block = record_header(len(used) + 1, result) + "\n" + compact_document(result["document"], fields)
+        if duplicates:
+            similar = "; ".join(
+                f"{d['metadata'].get('ref', '?')} ({d['metadata'].get('decision', 'Unknown')}, "
+                f"{d['metadata'].get('reg_date', '')[:10] or 'no date'})"
+                for d in duplicates
+            )
+            block += f"\nSimilar applications on this site: {similar}"
+        block_tokens = estimate_tokens(block + "\n\n")
+        if used and tokens + block_tokens > budget:
+            break
+        blocks.append(block)
+        used.append(result)
+        tokens += block_tokens
+
+    stats = {
+        "records_in": len(results),
+        "records_used": len(used),
+        "dropped_gap": len(results) - keep,
+        "dropped_duplicate": dropped_duplicate,
+        "dropped_budget": len(groups) - len(used),
+        "full_tokens": full_tokens,
+        "context_tokens": tokens,
+        "tokens_saved": max(full_tokens - tokens, 0),
+    }
+    with _totals_lock:
+        _totals["queries"] += 1
+        _totals["full_tokens"] += full_tokens
+        _totals["context_tokens"] += tokens
+    return "\n\n".join(blocks) + ("\n" if blocks else ""), used, stats
+
+
+def get_context_stats() -> dict:
+    """Running totals of prompt-context tokens before and after assembly."""
+    with _totals_lock:
+        totals = dict(_totals)
+    totals["tokens_saved"] = totals["full_tokens"] - totals["context_tokens"]
+    totals["saved_ratio"] = (totals["tokens_saved"] / totals["full_tokens"]) if totals["full_tokens"] else 0.0
+    return totals
@@ -0,0 +1,236 @@
+"""
+digests.py — Precomputed per-area digest documents for area-level questions
+
+Broad questions ("What developments are planned in Stoneybatter?", "What
+large developments were proposed in the Docklands?") retrieve ten arbitrary
+applications: many prompt tokens and an unrepresentative picture.
+build_vectordb.py writes one compact digest per area (gazetteer
+neighbourhood or postal district) and period (all years, plus five-year
+bands) into a separate collection: counts by decision, category and scale,
+appeal rate, registrations per year, the largest schemes, notable refusals
+and the most recent applications. query_planning answers area-level
+questions from the matching digest instead of individual records.
+"""
+
+import json
+import re
+from collections import Counter
+from datetime import date
+
+from gazetteer import PLACES, find_places, record_place
+from query_filters import classify_decision, normalize_postcode, parse_date_range, parse_query_filters
+from ref_index import extract_refs
+
+DIGEST_COLLECTION_NAME = "dublin_planning_digests"
+PERIOD_YEARS = 5  # Width of the period bands (aligned to multiples of 5: 2015-2019, 2020-2024, ...)
+MIN_PERIOD_RECORDS = 5  # Smaller bands are not worth a digest of their own
+MAX_PERIODS_PER_QUESTION = 2  # Longer ranges use the all-years digest
+LISTED_RECORDS = 4  # Per list (largest schemes, notable refusals, most recent)
+
+SCALE_RANK = {"large": 3, "medium": 2, "small_multi": 1, "single": 0}
+
+# Questions made only of these words (plus an area and years) ask about the area as a whole
+_GENERIC_WORDS = {
+    "a", "about", "activity", "all", "an", "and", "any", "application", "applications", "are", "area",
+    "around", "at", "been", "being", "big", "biggest", "built", "can", "construction", "current",
+    "currently", "development", "developments", "do", "does", "for", "from", "give", "going", "happen",
+    "happened", "happening", "has", "have", "in", "is", "large", "largest", "lately", "major", "me", "new", "of",
+    "on", "overview", "picture", "planned", "planning", "proposals", "proposed", "recent", "recently",
+    "schemes", "scheme", "show", "since", "so", "summarise", "summarize", "summary", "tell", "the",
+    "there", "this", "under", "was", "were", "what", "what's", "whats", "which", "years", "year",
+    "last", "past", "between", "after", "before", "until", "to", "up", "you", "your", "projects",
+}
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_POSTCODE_TOKEN_RE = re.compile(r"^(?:dublin|d\d{1,2}w?|\d{1,2}w?|\d{4}|\d+s)$")
+_PLACE_WORDS = {
+    word
+    for place, info in PLACES.items()
+    for name in [place, *info.get("aliases", [])]
+    for word in _WORD_RE.findall(name.lower())
+}
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def digest_id(area: str, period: str) -> str:
+    return f"digest_{_slug(area)}_{period}"
+
+
+def _band(year: int) -> str:
+    start = year - year % PERIOD_YEARS
+    return f"{start}-{start + PERIOD_YEARS - 1}"
+
+
+def record_areas(record: dict) -> list[str]:
+    """Areas a record's digest counts it under: its neighbourhood, its postal district, and district-made areas."""
+    areas = []
+    place = record_place(record.get('location', ''))
+    if place:
+        areas.append(place)
+    postcode = normalize_postcode(record.get('postcode', ''))
+    if postcode:
+        areas.append(postcode)
+        areas += [p for p, info in PLACES.items() if postcode in info.get("area_postcodes", [])]
+    return areas
+
+
+def _year(record: dict) -> str:
+    reg_date = record.get('reg_date', '') or ''
+    return reg_date[:4] if reg_date[:4].isdigit() else ""
+
+
+def _units(record: dict) -> int:
+    try:
+        return max(0, int(float(record.get('num_units', '') or 0)))
+    except (ValueError, TypeError):
+        return 0
+
+
+def _shares(counter: Counter, total: int) -> str:
+    return ", ".join(f"{value or 'not recorded'} {n} ({n / total:.0%})" for value, n in counter.most_common())
+
+
+def _record_line(number: int, record: dict) -> str:
+    details = [record.get('decision') or "no decision recorded"]
+    units = _units(record)
+    if units > 1:
+        details.insert(0, f"{units} units")
+    if record.get('has_appeal'):
+        details.append("appealed")
+    proposal = (record.get('proposal') or "").strip()
+    if len(proposal) > 120:
+        proposal = proposal[:120].rsplit(" ", 1)[0] + "…"
+    return (f"{number}. Ref {record.get('ref', 'unknown')} ({_year(record) or 'undated'}) — "
+            f"{record.get('location', '')}: {proposal} [{'; '.join(details)}]")
+
+
+def build_digest(area: str, period: str, entries: list[tuple]) -> tuple:
+    """
+    Summarise one area and period.
+
+    Args:
+        entries: (doc_id, record) pairs for the records in the area and period
+
+    Returns:
+        (text, listed_doc_ids) — the doc IDs in the order the digest numbers them
+    """
+    records = [record for _, record in entries]
+    total = len(records)
+    years = sorted(y for y in {_year(r) for r in records} if y)
+    span = "all years" if period == "all" else f"registered {period}"
+    postcode = PLACES.get(area, {}).get("postcode")
+    title = f"{area} ({postcode})" if postcode and "area_postcodes" not in PLACES[area] else area
+
+    decisions = Counter(classify_decision(r.get('decision', '')) for r in records)
+    appealed = sum(1 for r in records if r.get('has_appeal'))
+    lines = [
+        f"Area digest: {title} — {span}" + (f" ({years[0]}-{years[-1]})" if years else ""),
+        f"Applications: {total:,}; residential units proposed: {sum(_units(r) for r in records):,}",
+        f"Decisions: {_shares(decisions, total)}",
+        f"Appeals: {appealed} appealed ({appealed / total:.0%})",
+        f"Categories: {_shares(Counter(r.get('dev_category', '') for r in records), total)}",
+        f"Scale: {_shares(Counter(r.get('dev_scale', '') for r in records), total)}",
+    ]
+    per_year = Counter(_year(r) for r in records if _year(r))
+    if len(per_year) > 1:
+        lines.append("Per year: " + ", ".join(f"{y} {n}" for y, n in sorted(per_year.items())))
+
+    def by_size(entry):
+        record = entry[1]
+        return (_units(record), SCALE_RANK.get(record.get('dev_scale', ''), 0), record.get('reg_date', ''))
+
+    largest = [e for e in sorted(entries, key=by_size, reverse=True) if by_size(e)[:2] > (1, 0)]
+    refused = [e for e in entries if classify_decision(e[1].get('decision', '')) == "refused"]
+    sections = [
+        ("Largest schemes", largest),
+        ("Notable refusals", sorted(refused, key=by_size, reverse=True)),
+        ("Most recent applications", sorted(entries, key=lambda e: e[1].get('reg_date', ''), reverse=True)),
+    ]
+    listed = []
+    for heading, candidates in sections:
+        picked = [e for e in candidates if e[0] not in listed][:LISTED_RECORDS]
+        if not picked:
+            continue
+        lines.append(f"{heading}:")
+        for doc_id, record in picked:
+            listed.append(doc_id)
+            lines.append(_record_line(len(listed), record))
+    return "\n".join(lines), listed
+
+
+def build_digests(entries: list[tuple]) -> list[dict]:
+    """
+    Digest documents for every area, for all years and for each populated period band.
+
+    Args:
+        entries: (doc_id, record) pairs for every indexed record
+
+    Returns:
+        [{"id", "document", "metadata"}] ready for a Chroma collection
+    """
+    groups = {}
+    for doc_id, record in entries:
+        year = _year(record)
+        for area in record_areas(record):
+            groups.setdefault((area, "all"), []).append((doc_id, record))
+            if year:
+                groups.setdefault((area, _band(int(year))), []).append((doc_id, record))
+
+    digests = []
+    for (area, period), members in sorted(groups.items()):
+        if period != "all" and len(members) < MIN_PERIOD_RECORDS:
+            continue
+        text, listed = build_digest(area, period, members)
+        digests.append({
+            "id": digest_id(area, period),
+            "document": text,
+            "metadata": {
+                "area": area,
+                "area_type": "postcode" if area not in PLACES else "place",
+                "period": period,
+                "num_records": len(members),
+                "record_ids": json.dumps(listed),
+            },
+        })
+    return digests
+
+
+# ── Query side ─────────────────────────────────────────────────
+
+def _periods(query: str) -> list[str]:
+    """Period bands a question's date range covers (["all"] without a range or for long ranges)."""
+    date_range = parse_date_range(query)
+    if not date_range:
+        return ["all"]
+    start, end = date_range
+    if start is None:
+        return ["all"]
+    last = end.year - (1 if (end.month, end.day) == (1, 1) else 0) if end else date.today().year
+    bands = list(dict.fromkeys(_band(y) for y in range(start.year, last + 1)))
+    return bands if len(bands) <= MAX_PERIODS_PER_QUESTION else ["all"]
+
+
+def plan_digest(query: str):
+    """
+    Detect an area-level question ("what's planned in Stoneybatter?").
+
+    Returns:
+        {"area": str, "periods": [str]} or None when the question is about
+        something more specific than the area as a whole
+    """
+    if extract_refs(query):
+        return None  # A pasted reference ("2458/24") needs the exact lookup, not the area
+    places = find_places(query)
+    filters = parse_query_filters(query)
+    area = places[0] if places else filters.get("postcode")
+    if not area or len(places) > 1:
+        return None
+    # Narrower questions (refusals, extensions, a category, a size...) need the records themselves
+    if set(filters) - {"postcode", "dev_scale", "reg_day"} or filters.get("dev_scale", "large") != "large":
+        return None
+    for word in _WORD_RE.findall(query.lower()):
+        if word not in _GENERIC_WORDS and word not in _PLACE_WORDS and not _POSTCODE_TOKEN_RE.match(word):
+            return None
+    return {"area": area, "periods": _periods(query)}
@@ -55,11 +55,30 @@ def fetch_record_count():
         return 0
 
 
+def geometry_point(geometry):
+    """(lat, lon) of a WGS84 point geometry, or the mean vertex of a site polygon; None if absent."""
+    if not geometry:
+        return None
+    if "x" in geometry and "y" in geometry:
+        x, y = geometry["x"], geometry["y"]
+    else:
+        points = [p for ring in geometry.get("rings") or [] for p in ring]
+        if not points:
+            return None
+        x = sum(p[0] for p in points) / len(points)
+        y = sum(p[1] for p in points) / len(points)
+    if x is None or y is None or not (-90 <= y <= 90 and -180 <= x <= 180):
+        return None
+    return round(y, 6), round(x, 6)
+
+
 def fetch_page(offset, page_size=PAGE_SIZE):
-    """Fetch a page of records from the ArcGIS API."""
+    """Fetch a page of records from the ArcGIS API (attributes plus _lat/_lon from the geometry)."""
     params = {
         "where": f"PlanningAuthority='{PLANNING_AUTHORITY}'",
         "outFields": "*",
+        "returnGeometry": "true",
+        "outSR": "4326",  # WGS84 lat/lon rather than Irish Transverse Mercator
         "resultOffset": str(offset),
         "resultRecordCount": str(page_size),
         "orderByFields": "OBJECTID ASC",
@@ -71,7 +90,14 @@ def fetch_page(offset, page_size=PAGE_SIZE):
     data = response.json()
     
     if "features" in data:
-        return [f["attributes"] for f in data["features"]]
+        records = []
+        for feature in data["features"]:
+            record = dict(feature["attributes"])
+            point = geometry_point(feature.get("geometry"))
+            if point:
+                record["_lat"], record["_lon"] = point
+            records.append(record)
+        return records
     elif "error" in data:
         print(f"\n  API error: {data['error']}")
         return []
@@ -79,8 +105,13 @@ def fetch_page(offset, page_size=PAGE_SIZE):
         return []
 
 
-def download_all_data():
-    """Download all Dublin City Council planning records via ArcGIS API."""
+def download_all_data(progress=None):
+    """
+    Download all Dublin City Council planning records via ArcGIS API.
+    
+    Args:
+        progress: Optional callback progress(fraction, message), called per page
+    """
     print("=" * 60)
     print("STEP 1: Downloading Dublin City Council Planning Data")
     print("       (via ArcGIS Irish Planning Applications API)")
@@ -131,6 +162,8 @@ def download_all_data():
             all_records.extend(records)
             pct = min(100, (len(all_records) / total) * 100)
             print(f"\r  Progress: {pct:.1f}% -- {len(all_records):,} / {total:,} records (page {page_num})", end="", flush=True)
+            if progress:
+                progress(pct / 100, f"{len(all_records):,} of {total:,} records downloaded")
             
             offset += PAGE_SIZE
             
@@ -219,6 +252,8 @@ def clean_and_process_data():
             "num_units": _clean(raw.get("NumResidentialUnits")),
             "floor_area": _clean(raw.get("FloorArea")),
             "link": _clean(raw.get("LinkAppDetails")),
+            "lat": str(raw["_lat"]) if raw.get("_lat") is not None else "",
+            "lon": str(raw["_lon"]) if raw.get("_lon") is not None else "",
             "has_appeal": bool(
                 _clean(raw.get("AppealRefNumber")) or 
                 _clean(raw.get("AppealStatus"))
@@ -303,6 +338,10 @@ def clean_and_process_data():
         records.append(record)
     
     print(f"  Processed {len(records):,} valid records")
+    located = sum(1 for r in records if r['lat'])
+    print(f"  Records with coordinates: {located:,}")
+    if not located:
+        print(f"    ({raw_path} has no geometry — delete it and re-download to enable \"near X\" search)")
     
     # Save processed records
     processed_path = DATA_DIR / "processed_records.json"
@@ -14,7 +14,6 @@ Usage:
 import json
 import os
 import sys
-import time
 from pathlib import Path
 from datetime import datetime
 
@@ -175,9 +174,8 @@ Respond ONLY in this exact JSON format, no other text:
 
 def judge_responses(question: str, baseline_response: str, enhanced_response: str) -> dict:
     """Use Claude as judge to score both responses."""
-    from anthropic import Anthropic
-    
-    client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    from llm_client import create_message, response_text
+    from scheduler import BATCH
     
     user_prompt = f"""Question: {question}
 
@@ -189,15 +187,16 @@ def judge_responses(question: str, baseline_response: str, enhanced_response: st
 
 Score both responses on all 5 dimensions (0-10 each). Respond ONLY in JSON."""
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
+    response = create_message(
+        purpose="judge",
+        priority=BATCH,  # Queued behind interactive questions by the rate-limit scheduler
         system=JUDGE_SYSTEM_PROMPT,
         messages=[{"role": "user", "content": user_prompt}],
         temperature=0.0,
         max_tokens=500,
     )
     
-    text = response.content[0].text.strip()
+    text = response_text(response).strip()
     # Clean any markdown fences
     text = text.replace("```json", "").replace("```", "").strip()
     return json.loads(text)
@@ -216,7 +215,7 @@ def run_evaluation(output_file: str = None):
         print("ERROR: chroma_db not found. Run 'python download_data.py' first.")
         sys.exit(1)
     
-    from rag_engine import query_planning, get_collection
+    from rag_engine import batch_query_planning, get_collection
     
     print("=" * 70)
     print("  BLINDSPOT LABS — EVALUATION REPORT")
@@ -229,20 +228,22 @@ def run_evaluation(output_file: str = None):
     prompts = list(BASELINE_RESPONSES.keys())
     all_results = []
     
+    # Enhanced responses from our system, generated as one batch
+    print(f"Generating {len(prompts)} enhanced responses...")
+    enhanced = batch_query_planning(prompts, collection=collection)
+    print()
+    
     baseline_totals = {"specificity": 0, "accuracy": 0, "completeness": 0, "actionability": 0, "groundedness": 0}
     enhanced_totals = {"specificity": 0, "accuracy": 0, "completeness": 0, "actionability": 0, "groundedness": 0}
     
-    for i, prompt in enumerate(prompts, 1):
+    for i, (prompt, item) in enumerate(zip(prompts, enhanced), 1):
         print(f"[{i}/{len(prompts)}] Evaluating: {prompt[:60]}...")
         
-        # Get enhanced response from our system
-        try:
-            result = query_planning(prompt, collection=collection)
-            enhanced_answer = result["answer"]
-            num_sources = len(result["sources"])
-        except Exception as e:
-            print(f"  ERROR: {e}")
+        if not item["ok"]:
+            print(f"  ERROR: {item['error']}")
             continue
+        enhanced_answer = item["result"]["answer"]
+        num_sources = len(item["result"]["sources"])
         
         # Get baseline (use ChatGPT as representative baseline)
         baseline_answer = BASELINE_RESPONSES[prompt]["chatgpt"]
@@ -275,8 +276,6 @@ def run_evaluation(output_file: str = None):
             "enhanced_scores": es,
             "reasoning": scores.get("reasoning", ""),
         })
-        
-        time.sleep(0.5)  # Rate limiting
     
     n = len(all_results)
     if n == 0:
@@ -328,6 +327,17 @@ def run_evaluation(output_file: str = None):
     print(f"Baseline model:    ChatGPT (GPT-4o)")
     print(f"Enhanced system:   Blindspot Labs (RAG + Claude)")
     print(f"Judge model:       Claude Sonnet")
+    
+    from llm_client import get_call_stats
+    llm_stats = get_call_stats()
+    print(f"LLM calls:         {llm_stats['calls']} "
+          f"(avg {llm_stats['avg_latency_ms']:.0f}ms, "
+          f"{llm_stats['input_tokens']:,} input / {llm_stats['output_tokens']:,} output tokens)")
+    
+    from context_builder import get_context_stats
+    context_stats = get_context_stats()
+    print(f"Context tokens:    {context_stats['context_tokens']:,} "
+          f"({context_stats['tokens_saved']:,} saved, {context_stats['saved_ratio']:.0%} of full context)")
     print()
     
     # ── Save results ────────────────────────────────────────────
@@ -348,6 +358,8 @@ def run_evaluation(output_file: str = None):
                 for dim in dimensions
             },
         },
+        "llm_usage": llm_stats,
+        "context_usage": context_stats,
         "detailed_results": all_results,
     }
     
@@ -0,0 +1,282 @@
+"""
+fake_llm.py — Local stand-in for the Anthropic Messages API
+
+Serves POST /v1/messages with canned, Messages-API-shaped responses (plain
+JSON or a server-sent event stream when "stream": true) so the RAG pipeline
+can be exercised without the real API or an API key.
+
+Latency is tunable for load testing: a fixed delay before the first token,
+an output rate in tokens per second, a target answer length, a fraction
+of requests answered with 529 overloaded errors and a requests-per-minute
+limit enforced with 429s (and a retry-after header). Prompt caching is mimicked:
+prefixes ending at a cache_control block (of at least MIN_CACHEABLE_TOKENS)
+are remembered, and usage reports cache reads and writes like the real API.
+
+Usage:
+    python fake_llm.py --port 8089 --latency 0.5
+    python fake_llm.py --latency 0.8 --tokens-per-sec 60 --answer-tokens 300
+    python fake_llm.py --rpm 50   # answer 429 past 50 requests a minute
+
+Then point the engine at it:
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 ANTHROPIC_API_KEY=test streamlit run app.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8089
+MIN_CACHEABLE_TOKENS = 1024  # Shorter prefixes are not cached (as for Sonnet)
+
+_prompt_cache = set()  # Hashes of cached prompt prefixes
+_prompt_cache_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def _last_user_text(messages: list) -> str:
+    """Extract the text of the last user message (string or content blocks)."""
+    for msg in reversed(messages):
+        if msg.get("role") != "user":
+            continue
+        content = msg.get("content", "")
+        if isinstance(content, str):
+            return content
+        return "\n".join(b.get("text", "") for b in content if isinstance(b, dict))
+    return ""
+
+
+def _prompt_blocks(body: dict):
+    """Yield (text, cache_marked) for the system prompt and every message block, in order."""
+    system = body.get("system", "")
+    for block in (system if isinstance(system, list) else [{"text": system}]):
+        yield block.get("text", ""), "cache_control" in block
+    for msg in body.get("messages", []):
+        content = msg.get("content", "")
+        for block in (content if isinstance(content, list) else [{"text": content}]):
+            if isinstance(block, dict):
+                yield block.get("text", ""), "cache_control" in block
+
+
+def prompt_usage(body: dict) -> dict:
+    """
+    Input token usage split into uncached, cache-read and cache-write tokens.
+
+    Like the real API, a cached prefix is found at any block boundary up to
+    the last cache_control block, and new prefixes are written at the marked
+    blocks.
+    """
+    prefix = hashlib.sha1()
+    tokens = 0
+    boundaries = []  # (prefix hash, tokens up to here, marked)
+    for text, marked in _prompt_blocks(body):
+        prefix.update(text.encode("utf-8"))
+        tokens += estimate_tokens(text) if text else 0
+        boundaries.append((prefix.hexdigest(), tokens, marked))
+    last_marked = max((i for i, (_, _, marked) in enumerate(boundaries) if marked), default=-1)
+    boundaries = [b for b in boundaries[:last_marked + 1] if b[1] >= MIN_CACHEABLE_TOKENS]
+
+    read = write = 0
+    with _prompt_cache_lock:
+        for digest, prefix_tokens, _ in boundaries:
+            if digest in _prompt_cache:
+                read = prefix_tokens
+        for digest, prefix_tokens, marked in boundaries:
+            if marked and prefix_tokens > read:
+                write = prefix_tokens - read
+                _prompt_cache.add(digest)
+    return {
+        "input_tokens": max(1, tokens - read - write),
+        "cache_read_input_tokens": read,
+        "cache_creation_input_tokens": write,
+    }
+
+
+def build_answer(body: dict, answer_tokens: int = 0) -> str:
+    """Build a deterministic stand-in answer, padded to about answer_tokens tokens."""
+    question = _last_user_text(body.get("messages", []))
+    if "**Question:**" in question:
+        question = question.split("**Question:**", 1)[1].split("\n", 1)[0].strip()
+    answer = (
+        f"[stand-in response] You asked: {question[:300]}\n\n"
+        "This answer was produced by the local fake LLM endpoint, not by Claude."
+    )
+    answer_tokens = min(answer_tokens, body.get("max_tokens") or answer_tokens)
+    padding = answer_tokens - estimate_tokens(answer)
+    if padding > 0:
+        answer += "\n\n" + " ".join(["lorem"] * (padding * 4 // 6 + 1))
+    return answer
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """Request handler mimicking the Anthropic Messages endpoint."""
+
+    latency = 0.0  # Seconds to wait before responding
+    tokens_per_sec = 0.0  # Output rate (0 = instant)
+    answer_tokens = 0  # Pad answers to about this many tokens
+    error_rate = 0.0  # Fraction of requests answered with 529 overloaded
+    rpm = 0  # Requests per minute before answering 429 (0 = unlimited)
+    _recent = None  # Arrival times in the last minute (per configured server)
+    _recent_lock = None
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/messages":
+            self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"type": "error", "error": {"type": "invalid_request_error", "message": "bad JSON"}})
+            return
+
+        retry_after = self._rate_limited()
+        if retry_after:
+            self._send_json(429, {"type": "error", "error": {"type": "rate_limit_error", "message": "Rate limited"}},
+                            headers={"retry-after": f"{retry_after:.0f}"})
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+            return
+
+        answer = build_answer(body, self.answer_tokens)
+        if body.get("stream"):
+            self._stream_answer(body, answer)
+            return
+        if self.tokens_per_sec:
+            time.sleep(estimate_tokens(answer) / self.tokens_per_sec)
+        self._send_json(200, {
+            "id": f"msg_fake_{uuid.uuid4().hex[:16]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake-model"),
+            "content": [{"type": "text", "text": answer}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {**prompt_usage(body), "output_tokens": estimate_tokens(answer)},
+        })
+
+    def _rate_limited(self) -> float:
+        """Seconds until a slot frees up if this request is over the rpm limit, else 0."""
+        if not self.rpm:
+            return 0
+        now = time.monotonic()
+        with self._recent_lock:
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.rpm:
+                return max(1.0, 60 - (now - self._recent[0]))
+            self._recent.append(now)
+        return 0
+
+    def _send_event(self, event: str, payload: dict):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _stream_answer(self, body: dict, answer: str):
+        """Send the answer as a server-sent event stream, a few words per delta."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        self._send_event("message_start", {"type": "message_start", "message": {
+            "id": f"msg_fake_{uuid.uuid4().hex[:16]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake-model"),
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {**prompt_usage(body), "output_tokens": 1},
+        }})
+        self._send_event("content_block_start", {
+            "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""},
+        })
+        words = answer.split(" ")
+        for i in range(0, len(words), 3):
+            chunk = " ".join(words[i:i + 3]) + (" " if i + 3 < len(words) else "")
+            if self.tokens_per_sec:
+                time.sleep(estimate_tokens(chunk) / self.tokens_per_sec)
+            self._send_event("content_block_delta", {
+                "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk},
+            })
+        self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._send_event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": estimate_tokens(answer)},
+        })
+        self._send_event("message_stop", {"type": "message_stop"})
+
+
+def make_server(port: int = 0, latency: float = 0.0, tokens_per_sec: float = 0.0,
+                answer_tokens: int = 0, error_rate: float = 0.0, rpm: int = 0) -> ThreadingHTTPServer:
+    """Create the stand-in server with the given latency profile (not yet serving)."""
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "latency": latency, "tokens_per_sec": tokens_per_sec,
+        "answer_tokens": answer_tokens, "error_rate": error_rate,
+        "rpm": rpm, "_recent": deque(), "_recent_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_fake_llm(port: int = 0, latency: float = 0.0, tokens_per_sec: float = 0.0,
+                   answer_tokens: int = 0, error_rate: float = 0.0, rpm: int = 0):
+    """
+    Start the stand-in server on a background thread.
+
+    Returns:
+        (server, base_url) — call server.shutdown() to stop it
+    """
+    server = make_server(port, latency, tokens_per_sec, answer_tokens, error_rate, rpm)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Anthropic Messages API")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="Output token rate (0 = instant)")
+    parser.add_argument("--answer-tokens", type=int, default=0, help="Pad answers to about this many tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 529")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before answering 429 (0 = unlimited)")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency, args.tokens_per_sec, args.answer_tokens, args.error_rate, args.rpm)
+    print(f"Fake LLM listening on http://127.0.0.1:{args.port} (latency {args.latency}s, "
+          f"{args.tokens_per_sec or 'unlimited'} tokens/s)")
+    print(f"  export ANTHROPIC_BASE_URL=http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,75 @@
+"""
+fallback.py — Templated answers built from retrieved records, without Claude
+
+When generation misses its deadline or fails, rag_engine answers with what
+retrieval already has: a numbered list of the matching records (reference,
+location, decision, dates, appeal status, short proposal), the computed
+statistics for count/trend questions, or the area digest for area-level
+questions. The answer is clearly labelled as not written by Claude.
+"""
+
+MAX_FALLBACK_RECORDS = 10
+PROPOSAL_CHARS = 160
+
+REASONS = {
+    "timeout": "Claude is taking longer than usual",
+    "error": "Claude is unavailable right now",
+}
+
+
+def _label(reason: str) -> str:
+    why = REASONS.get(reason, REASONS["error"])
+    return (
+        f"> ⚠️ **Quick answer** — {why}, so this was built directly from the "
+        "retrieved planning records without an AI summary. Check each application "
+        "on the council's planning portal before relying on it."
+    )
+
+
+def _record_lines(i: int, meta: dict) -> list[str]:
+    lines = [f"{i}. **Ref {meta.get('ref') or 'unknown'}** — {meta.get('location') or 'location not recorded'}"]
+    details = [f"Decision: {meta.get('decision') or 'not recorded'}"]
+    if meta.get("reg_date"):
+        details.append(f"registered {meta['reg_date']}")
+    if meta.get("dec_date"):
+        details.append(f"decided {meta['dec_date']}")
+    if str(meta.get("has_appeal", "")).lower() == "true":
+        details.append("appealed")
+    lines.append("   " + " · ".join(details))
+    proposal = (meta.get("proposal_short") or "").strip()
+    if proposal:
+        if len(proposal) > PROPOSAL_CHARS:
+            proposal = proposal[:PROPOSAL_CHARS].rsplit(" ", 1)[0] + "…"
+        lines.append(f"   {proposal}")
+    return lines
+
+
+def extractive_answer(query: str, raw_results: list[dict], route: str = "retrieval",
+                      context: str = "", reason: str = "timeout") -> str:
+    """
+    Build a labelled answer from retrieval output alone.
+
+    Args:
+        raw_results: The records that made it into the prompt context
+        route: "aggregate" and "digest" answer with the statistics or area digest (context) instead
+        reason: "timeout" or "error" (worded in the label)
+    """
+    parts = [_label(reason), ""]
+    if route == "aggregate":
+        parts += ["**Computed statistics (full dataset):**", "", context.strip()]
+        return "\n".join(parts)
+    if route == "digest":
+        parts += ["**Area digest (precomputed from all records in the area):**", "", context.strip()]
+        return "\n".join(parts)
+    if not raw_results:
+        parts.append(f'No planning records matched "{query}".')
+        return "\n".join(parts)
+
+    shown = raw_results[:MAX_FALLBACK_RECORDS]
+    heading = f"**{len(raw_results)} matching planning record{'s' if len(raw_results) != 1 else ''}**"
+    if len(raw_results) > len(shown):
+        heading += f" (first {len(shown)} shown)"
+    parts += [heading + ":", ""]
+    for i, result in enumerate(shown, 1):
+        parts += _record_lines(i, result.get("metadata", {}))
+    return "\n".join(parts)
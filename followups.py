@@ -0,0 +1,97 @@
+"""
+followups.py — Cheap detection of follow-up questions about the previous answer
+
+"Tell me more about the second one" or "were any of those appealed?" refer
+to the records behind the previous answer; running a semantic search on the
+literal follow-up text finds unrelated records. Assistant turns in the chat
+history can carry the IDs of the records they were grounded in
+("record_ids"); when a question looks referential, rag_engine fetches those
+records by ID instead of searching.
+
+Detection is rule-based (a few regular expressions, no model call):
+- referential phrases: "those", "them", "any of these", "that application",
+  or a bare "tell me more"
+- ordinals pick one record: "the second one", "the last application", "#3";
+  an ordinal past the end of the list is not a follow-up
+- only the immediately previous assistant turn counts; an aggregate or
+  digest answer without records ends the chain
+- a question naming its own planning reference, area, postcode or date
+  range is a fresh search ("tell me more about social housing in Dublin 1")
+"""
+
+import re
+
+from gazetteer import find_places
+from query_filters import parse_query_filters
+from ref_index import extract_refs
+
+_REFERENTIAL_RE = re.compile(
+    r"\b(those|these|them|the above|that one|this one|which of|any of (?:them|these|those)"
+    r"|(?:that|this|the same) (?:application|scheme|development|site|record|proposal|decision))\b",
+    re.IGNORECASE,
+)
+# "tell me more" only on its own: "tell me more about extensions" is a new topic
+_MORE_RE = re.compile(
+    r"^\W*(?:(?:can|could) you |please )?(?:tell|give|show) me more"
+    r"(?: details?| info(?:rmation)?)?(?: about (?:it|that|this))?(?: please)?\W*$",
+    re.IGNORECASE,
+)
+# Filters that point a question somewhere else rather than narrowing the previous records
+_SCOPE_FILTERS = {"postcode", "reg_day"}
+
+_ORDINALS = {
+    "first": 0, "second": 1, "third": 2, "fourth": 3, "fifth": 4,
+    "sixth": 5, "seventh": 6, "eighth": 7, "ninth": 8, "tenth": 9, "last": -1,
+}
+_ORDINAL_RE = re.compile(
+    r"\b(" + "|".join(_ORDINALS) + r")\s+(?:one|application|record|result|scheme|site|proposal|development)\b",
+    re.IGNORECASE,
+)
+_NUMBERED_RE = re.compile(r"(?:\bnumber\s*|\bno\.\s*|#)(\d{1,2})\b", re.IGNORECASE)
+
+
+def previous_record_ids(chat_history: list = None) -> list[str]:
+    """Record IDs behind the most recent assistant turn (empty if it has none)."""
+    for msg in reversed(chat_history or []):
+        if msg.get("role") == "assistant":
+            return list(msg.get("record_ids") or [])
+    return []
+
+
+def names_own_scope(query: str) -> bool:
+    """True when a question names its own reference, area, postcode or date range."""
+    if extract_refs(query) or find_places(query):
+        return True
+    return bool(_SCOPE_FILTERS & set(parse_query_filters(query)))
+
+
+def selected_index(query: str):
+    """Index of the record an ordinal refers to ("the second one" -> 1, "the last one" -> -1), or None."""
+    match = _ORDINAL_RE.search(query)
+    if match:
+        return _ORDINALS[match.group(1).lower()]
+    match = _NUMBERED_RE.search(query)
+    if match and int(match.group(1)) >= 1:
+        return int(match.group(1)) - 1
+    return None
+
+
+def resolve_followup(query: str, chat_history: list = None):
+    """
+    Decide whether a question is about the previous answer's records.
+
+    Returns:
+        The record IDs to reuse (one ID when an ordinal picks a record), or
+        None when the question needs a fresh search
+    """
+    record_ids = previous_record_ids(chat_history)
+    if not record_ids or names_own_scope(query):
+        return None
+    index = selected_index(query)
+    if index is not None:
+        if -len(record_ids) <= index < len(record_ids):
+            return [record_ids[index]]
+        return None  # "the fifth one" after three records: search instead of guessing
+    if _REFERENTIAL_RE.search(query) or _MORE_RE.search(query):
+        return record_ids
+    return None
@@ -0,0 +1,89 @@
+"""
+gazetteer.py — Dublin City neighbourhoods and the names used for them
+
+Maps place names (and common aliases, e.g. the streets and quays that make up
+the Docklands) to a canonical neighbourhood, its postcode and an approximate
+centroid. Used to tag each record with a `place` when the index is built, to
+recognise areas mentioned in questions, and as the centre point for "near X"
+radius searches.
+"""
+
+import re
+
+# Canonical place -> postcode, approximate centroid, optional aliases, and (for areas
+# defined as whole postal districts, like the city centre) the postcodes that make up the area
+PLACES = {
+    "Ballsbridge": {"postcode": "Dublin 4", "lat": 53.3290, "lon": -6.2310},
+    "Beaumont": {"postcode": "Dublin 9", "lat": 53.3860, "lon": -6.2230},
+    "Cabra": {"postcode": "Dublin 7", "lat": 53.3660, "lon": -6.2950},
+    "Clontarf": {"postcode": "Dublin 3", "lat": 53.3640, "lon": -6.1990},
+    "Crumlin": {"postcode": "Dublin 12", "lat": 53.3240, "lon": -6.3090},
+    "Donnybrook": {"postcode": "Dublin 4", "lat": 53.3210, "lon": -6.2360},
+    "Drumcondra": {"postcode": "Dublin 9", "lat": 53.3700, "lon": -6.2550},
+    "Finglas": {"postcode": "Dublin 11", "lat": 53.3900, "lon": -6.2970},
+    "Glasnevin": {"postcode": "Dublin 9", "lat": 53.3720, "lon": -6.2700},
+    "Harold's Cross": {"postcode": "Dublin 6W", "lat": 53.3260, "lon": -6.2820, "aliases": ["harolds cross"]},
+    "Inchicore": {"postcode": "Dublin 8", "lat": 53.3400, "lon": -6.3160},
+    "Kilmainham": {"postcode": "Dublin 8", "lat": 53.3410, "lon": -6.3050},
+    "Marino": {"postcode": "Dublin 3", "lat": 53.3650, "lon": -6.2260},
+    "Phibsborough": {"postcode": "Dublin 7", "lat": 53.3600, "lon": -6.2730, "aliases": ["phibsboro"]},
+    "Portobello": {"postcode": "Dublin 8", "lat": 53.3310, "lon": -6.2660},
+    "Ranelagh": {"postcode": "Dublin 6", "lat": 53.3260, "lon": -6.2560},
+    "Rathgar": {"postcode": "Dublin 6", "lat": 53.3140, "lon": -6.2740},
+    "Rathmines": {"postcode": "Dublin 6", "lat": 53.3220, "lon": -6.2650},
+    "Ringsend": {"postcode": "Dublin 4", "lat": 53.3410, "lon": -6.2270},
+    "Sandymount": {"postcode": "Dublin 4", "lat": 53.3310, "lon": -6.2150},
+    "Smithfield": {"postcode": "Dublin 7", "lat": 53.3490, "lon": -6.2780},
+    "Stoneybatter": {"postcode": "Dublin 7", "lat": 53.3530, "lon": -6.2840},
+    "Terenure": {"postcode": "Dublin 6W", "lat": 53.3100, "lon": -6.2850},
+    "The Liberties": {"postcode": "Dublin 8", "lat": 53.3400, "lon": -6.2780, "aliases": ["liberties"]},
+    "Docklands": {
+        "postcode": "Dublin 1", "lat": 53.3478, "lon": -6.2400,
+        "aliases": [
+            "docklands", "north wall", "spencer dock", "grand canal dock", "east wall",
+            "north lotts", "hanover quay", "sir john rogerson", "custom house quay",
+        ],
+    },
+    "City Centre": {
+        "postcode": "Dublin 1", "lat": 53.3480, "lon": -6.2600,
+        "area_postcodes": ["Dublin 1", "Dublin 2"],
+        "aliases": ["city centre", "city center", "dublin city centre"],
+    },
+}
+
+
+def _build_pattern():
+    names = {}
+    for place, info in PLACES.items():
+        names[place.lower()] = place
+        for alias in info.get("aliases", []):
+            names[alias.lower()] = place
+    # Longest first so "dublin city centre" wins over "city centre"
+    alternatives = sorted(names, key=len, reverse=True)
+    pattern = re.compile(r"\b(" + "|".join(re.escape(a) for a in alternatives) + r")\b", re.IGNORECASE)
+    return pattern, names
+
+
+_PLACE_RE, _ALIAS_TO_PLACE = _build_pattern()
+
+
+def find_places(text: str) -> list[str]:
+    """Canonical places mentioned in text, in order of appearance (unique)."""
+    places = []
+    for match in _PLACE_RE.finditer(text or ""):
+        place = _ALIAS_TO_PLACE[match.group(1).lower()]
+        if place not in places:
+            places.append(place)
+    return places
+
+
+def record_place(location: str) -> str:
+    """
+    Neighbourhood of a record from its address ('' if none recognised).
+
+    Addresses run street -> locality, so the last place mentioned wins
+    ("12 Upper Rathmines Road, Glasnevin" is in Glasnevin). Areas made of
+    whole postal districts are never assigned from an address.
+    """
+    places = [p for p in find_places(location) if "area_postcodes" not in PLACES[p]]
+    return places[-1] if places else ""
@@ -0,0 +1,182 @@
+"""
+geo_index.py — Grid index over record coordinates for "near X" and radius questions
+
+Questions such as "What developments were approved near Portobello?" are
+spatial. download_data.py requests each application's geometry in WGS84 and
+stores its point (or the centre of its site polygon) as lat/lon;
+build_vectordb.py writes those coordinates to a small JSON file; at load time
+they are bucketed into a fixed grid of roughly 500 m cells so a radius
+lookup only scans the handful of cells that overlap the circle.
+rag_engine.retrieve_context uses the result to restrict the semantic search to the local neighbourhood. Without
+located records (e.g. data downloaded before geometry was requested) the
+index is empty and questions fall back to plain search.
+"""
+
+import json
+import math
+import re
+import threading
+from array import array
+from pathlib import Path
+
+from gazetteer import PLACES, find_places
+
+GEO_INDEX_FILE = "geo_index.json"  # Stored alongside the ChromaDB files
+CELL_DEG = 0.005  # Grid cell size in degrees (~550 m north-south, ~330 m east-west in Dublin)
+DEFAULT_RADIUS_M = 750  # "near X" radius
+MAX_RADIUS_M = 2000  # Upper bound when widening the radius to find enough records
+MAX_EXPLICIT_RADIUS_M = 20_000  # Ceiling for "within N km" (covers the whole council area from anywhere in it)
+RADIUS_GROWTH = 1.5  # Radius multiplier per widening step
+EARTH_RADIUS_M = 6_371_000
+
+# "near Portobello", "around Smithfield", "close to Ringsend", "within 500m of Ranelagh"
+_NEAR_RE = re.compile(r"\b(near(by)?|around|close to|beside|next to|in the vicinity of|walking distance)\b", re.I)
+_WITHIN_RE = re.compile(r"\bwithin\s+(\d+(?:\.\d+)?)\s*(km|kilomet(?:re|er)s?|m|met(?:re|er)s?)\b", re.I)
+
+_cache = {"path": None, "mtime": None, "index": None}
+_cache_lock = threading.Lock()
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Equirectangular distance in metres (accurate to well under 1% at city scale)."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+def bounding_box(lat: float, lon: float, radius_m: float) -> dict:
+    """Lat/lon ranges enclosing a circle, as range filters for build_where."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlon = dlat / math.cos(math.radians(lat))
+    return {
+        "lat": {"$gte": lat - dlat, "$lte": lat + dlat},
+        "lon": {"$gte": lon - dlon, "$lte": lon + dlon},
+    }
+
+
+def _cell(lat: float, lon: float) -> tuple[int, int]:
+    return int(math.floor(lat / CELL_DEG)), int(math.floor(lon / CELL_DEG))
+
+
+class GeoGridIndex:
+    """Uniform lat/lon grid over record coordinates."""
+
+    def __init__(self, doc_ids: list[str], lats, lons):
+        self.doc_ids = doc_ids
+        self.lats = array("d", lats)
+        self.lons = array("d", lons)
+        self.cells = {}
+        for i, (lat, lon) in enumerate(zip(self.lats, self.lons)):
+            self.cells.setdefault(_cell(lat, lon), []).append(i)
+
+    @classmethod
+    def build(cls, points) -> "GeoGridIndex":
+        """Build from (doc_id, lat, lon) tuples."""
+        doc_ids, lats, lons = [], [], []
+        for doc_id, lat, lon in points:
+            doc_ids.append(doc_id)
+            lats.append(lat)
+            lons.append(lon)
+        return cls(doc_ids, lats, lons)
+
+    def to_dict(self, version: str = "") -> dict:
+        """Serialisable form of the index (the grid is rebuilt on load)."""
+        return {
+            "version": version,
+            "doc_ids": self.doc_ids,
+            "lats": [round(lat, 6) for lat in self.lats],
+            "lons": [round(lon, 6) for lon in self.lons],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GeoGridIndex":
+        return cls(data["doc_ids"], data["lats"], data["lons"])
+
+    def within_radius(self, lat: float, lon: float, radius_m: float) -> list[tuple[str, float]]:
+        """Return (doc_id, distance_m) pairs within radius_m of the point, nearest first."""
+        box = bounding_box(lat, lon, radius_m)
+        row_lo, col_lo = _cell(box["lat"]["$gte"], box["lon"]["$gte"])
+        row_hi, col_hi = _cell(box["lat"]["$lte"], box["lon"]["$lte"])
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > len(self.cells):
+            # A box wider than the data: scan the occupied cells rather than every cell in the box
+            cells = [members for (row, col), members in self.cells.items()
+                     if row_lo <= row <= row_hi and col_lo <= col <= col_hi]
+        else:
+            cells = [self.cells.get((row, col), ()) for row in range(row_lo, row_hi + 1)
+                     for col in range(col_lo, col_hi + 1)]
+        lats, lons = self.lats, self.lons
+        hits = []
+        for members in cells:
+            for i in members:
+                dist = distance_m(lat, lon, lats[i], lons[i])
+                if dist <= radius_m:
+                    hits.append((dist, i))
+        hits.sort()
+        return [(self.doc_ids[i], dist) for dist, i in hits]
+
+    def nearby(self, lat: float, lon: float, radius_m: float, min_results: int = 0):
+        """
+        Records within radius_m, widening the radius (up to MAX_RADIUS_M) until
+        at least min_results are found.
+
+        Returns:
+            (hits, radius_m) — hits as from within_radius, and the radius used
+        """
+        hits = self.within_radius(lat, lon, radius_m)
+        while len(hits) < min_results and radius_m < MAX_RADIUS_M:
+            radius_m = min(radius_m * RADIUS_GROWTH, MAX_RADIUS_M)
+            hits = self.within_radius(lat, lon, radius_m)
+        return hits, radius_m
+
+
+def parse_spatial_query(query: str):
+    """
+    Recognise a radius question about a known place.
+
+    An explicit radius is capped at MAX_EXPLICIT_RADIUS_M.
+
+    Returns:
+        {"place", "lat", "lon", "radius_m", "explicit_radius"} or None
+    """
+    within = _WITHIN_RE.search(query)
+    if not within and not _NEAR_RE.search(query):
+        return None
+    places = [p for p in find_places(query) if "lat" in PLACES[p]]
+    if not places:
+        return None
+    place = places[0]
+    radius_m = DEFAULT_RADIUS_M
+    if within:
+        radius_m = float(within.group(1))
+        if within.group(2).lower().startswith("k"):
+            radius_m *= 1000
+        radius_m = min(radius_m, MAX_EXPLICIT_RADIUS_M)
+    return {
+        "place": place,
+        "lat": PLACES[place]["lat"],
+        "lon": PLACES[place]["lon"],
+        "radius_m": radius_m,
+        "explicit_radius": bool(within),
+    }
+
+
+def save_geo_index(index: GeoGridIndex, chroma_dir: Path, version: str = ""):
+    """Write the index next to the vector database."""
+    path = Path(chroma_dir) / GEO_INDEX_FILE
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(version), f, separators=(",", ":"))
+    return path
+
+
+def load_geo_index(chroma_dir: Path):
+    """Load the index (cached in memory, reloaded when the file changes). None if missing."""
+    path = Path(chroma_dir) / GEO_INDEX_FILE
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    with _cache_lock:
+        if _cache["path"] != path or _cache["mtime"] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                _cache.update(path=path, mtime=mtime, index=GeoGridIndex.from_dict(json.load(f)))
+        return _cache["index"]
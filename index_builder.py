@@ -0,0 +1,286 @@
+"""
+index_builder.py — Background index builds with a live swap
+
+The first visit to a fresh deployment used to block for minutes while
+app.py downloaded the data and built the vector database inside
+st.cache_resource. IndexBuilder runs download_data.py and build_vectordb.py
+on a background thread instead, reporting its stage and progress:
+
+- the new index is built in a staging directory (chroma_db.building) while
+  the current one, if any, keeps serving
+- before any index exists, the partially built staging collection serves
+  degraded answers (vector search over the records indexed so far, no
+  reference/lexical/spatial indexes)
+- when the build finishes the staging directory is swapped in for
+  chroma_db (the old one is kept as chroma_db.previous until the next
+  build) and the in-process caches are cleared
+
+An existing index is rebuilt in the background when it is missing any of
+the side indexes or the area digests written by the current
+build_vectordb.py. Either way, a compatible prebuilt snapshot (see
+snapshot.py) is restored in preference to downloading and embedding.
+"""
+
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from aggregates import AGGREGATES_FILE
+from digests import DIGEST_COLLECTION_NAME
+from geo_index import GEO_INDEX_FILE
+from lexical_index import LEXICAL_INDEX_FILE
+from ref_index import REF_INDEX_FILE
+
+CHROMA_DIR = Path("chroma_db")
+DATA_DIR = Path("data")
+STAGING_SUFFIX = ".building"
+PREVIOUS_SUFFIX = ".previous"
+
+SIDE_INDEX_FILES = [REF_INDEX_FILE, LEXICAL_INDEX_FILE, GEO_INDEX_FILE, AGGREGATES_FILE]
+
+# Stages in order, with their share of the overall progress bar
+STAGES = [("download", 0.35), ("process", 0.05), ("embed", 0.55), ("swap", 0.05)]
+RESTORE_STAGES = [("restore", 0.95), ("swap", 0.05)]
+
+
+def index_exists(chroma_dir: Path = CHROMA_DIR) -> bool:
+    chroma_dir = Path(chroma_dir)
+    return chroma_dir.exists() and any(chroma_dir.iterdir())
+
+
+def missing_parts(chroma_dir: Path = CHROMA_DIR) -> list[str]:
+    """Parts the current build_vectordb.py writes that an existing index lacks."""
+    import chromadb
+
+    chroma_dir = Path(chroma_dir)
+    missing = [name for name in SIDE_INDEX_FILES if not (chroma_dir / name).exists()]
+    try:
+        client = chromadb.PersistentClient(path=str(chroma_dir))
+        names = {getattr(c, "name", c) for c in client.list_collections()}
+    except Exception:
+        names = set()
+    if DIGEST_COLLECTION_NAME not in names:
+        missing.append(DIGEST_COLLECTION_NAME)
+    return missing
+
+
+def _forget_chroma_clients():
+    """Drop chromadb's per-path client cache so the next client opens the swapped-in files.
+
+    Collections already handed out keep working against the files they opened.
+    """
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+    except ImportError:
+        try:
+            from chromadb.api.client import SharedSystemClient
+        except ImportError:
+            return
+    SharedSystemClient.clear_system_cache()
+
+
+def swap_in(staging: Path, chroma_dir: Path = CHROMA_DIR):
+    """
+    Replace chroma_dir with a finished staging build.
+
+    The old index moves to chroma_dir.previous (not deleted, so queries still
+    holding its collection can finish); caches tied to the old index are cleared.
+    """
+    chroma_dir = Path(chroma_dir)
+    previous = chroma_dir.with_name(chroma_dir.name + PREVIOUS_SUFFIX)
+    shutil.rmtree(previous, ignore_errors=True)
+    if chroma_dir.exists():
+        os.replace(chroma_dir, previous)
+    os.replace(staging, chroma_dir)
+    _forget_chroma_clients()
+
+    import rag_engine
+    rag_engine.answer_cache.clear()
+    rag_engine.retrieval_cache.clear()
+    rag_engine.clear_digest_collections()
+
+
+class IndexBuilder:
+    """Runs the data download and index build on a background thread."""
+
+    def __init__(self, chroma_dir: Path = CHROMA_DIR, data_dir: Path = DATA_DIR):
+        self.chroma_dir = Path(chroma_dir)
+        self.data_dir = Path(data_dir)
+        self.staging = self.chroma_dir.with_name(self.chroma_dir.name + STAGING_SUFFIX)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._partial = None  # Staging collection, once it has records
+        self._stages = STAGES
+        self._from_snapshot = False
+        self._status = {
+            "state": "idle",  # idle | running | ready | failed
+            "stage": "",
+            "progress": 0.0,
+            "message": "",
+            "error": "",
+            "reason": "",
+            "snapshot": "",  # Why a snapshot was or was not used
+            "started": None,
+            "finished": None,
+        }
+
+    # ── Control ────────────────────────────────────────────────
+
+    def ensure_index(self) -> bool:
+        """Start a background build if there is no index or it is missing parts. True if one started."""
+        if not index_exists(self.chroma_dir):
+            return self.start("No planning database yet", from_snapshot=True)
+        missing = missing_parts(self.chroma_dir)
+        if missing:
+            return self.start(f"Index is missing {', '.join(missing)}", from_snapshot=True)
+        return False
+
+    def start(self, reason: str = "Rebuild requested", from_snapshot: bool = False) -> bool:
+        """
+        Start a build unless one is already running. True if it started.
+
+        With from_snapshot, a compatible snapshot at snapshot.SNAPSHOT_PATH is
+        restored instead when there is one.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._partial = None
+            self._from_snapshot = from_snapshot
+            self._status.update(state="running", stage="", progress=0.0, message="Starting...",
+                                error="", reason=reason, snapshot="", started=time.time(), finished=None)
+            self._thread = threading.Thread(target=self._run, name="index-builder", daemon=True)
+            self._thread.start()
+            return True
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for the running build; True if none is running afterwards."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return thread is None or not thread.is_alive()
+
+    # ── Status ─────────────────────────────────────────────────
+
+    def status(self) -> dict:
+        with self._lock:
+            status = dict(self._status)
+        status["serving"] = "index" if index_exists(self.chroma_dir) else (
+            "partial" if self._partial is not None else "none"
+        )
+        return status
+
+    @property
+    def running(self) -> bool:
+        return self.status()["state"] == "running"
+
+    def _report(self, stage: str, fraction: float, message: str):
+        stages = self._stages
+        names = [name for name, _ in stages]
+        done = sum(weight for _, weight in stages[:names.index(stage)])
+        progress = done + dict(stages)[stage] * max(0.0, min(1.0, fraction))
+        with self._lock:
+            self._status.update(stage=stage, progress=round(progress, 3), message=message)
+
+    def serving_collection(self):
+        """
+        The collection questions should use right now.
+
+        Returns:
+            (collection, degraded) — the live index (degraded False), the
+            partially built staging collection (degraded True), or (None, True)
+        """
+        if index_exists(self.chroma_dir):
+            from rag_engine import get_collection
+            try:
+                return get_collection(), False
+            except Exception:
+                pass
+        with self._lock:
+            return self._partial, True
+
+    # ── Build ──────────────────────────────────────────────────
+
+    def _run(self):
+        try:
+            self._build()
+        except BaseException as e:  # build_vectordb exits via SystemExit on missing data
+            with self._lock:
+                self._status.update(state="failed", error=f"{type(e).__name__}: {e}", finished=time.time())
+            return
+        with self._lock:
+            self._status.update(state="ready", stage="swap", progress=1.0,
+                                message="Planning database ready", finished=time.time())
+
+    def _build(self):
+        if self._from_snapshot and self._restore():
+            return
+        self._stages = STAGES
+        if not (self.data_dir / "processed_records.json").exists():
+            from download_data import download_all_data, clean_and_process_data
+
+            self._report("download", 0.0, "Downloading planning records...")
+            if not download_all_data(progress=lambda f, m: self._report("download", f, m)):
+                raise RuntimeError("Failed to download planning data from ArcGIS API")
+            self._report("process", 0.0, "Cleaning and classifying records...")
+            if not clean_and_process_data():
+                raise RuntimeError("Failed to process planning data")
+
+        from build_vectordb import build_vector_database
+
+        previous = self.chroma_dir.with_name(self.chroma_dir.name + PREVIOUS_SUFFIX)
+        shutil.rmtree(previous, ignore_errors=True)
+        shutil.rmtree(self.staging, ignore_errors=True)
+        self._report("embed", 0.0, "Loading the embedding model...")
+        build_vector_database(chroma_dir=self.staging, progress=self._embedded)
+
+        self._report("swap", 0.0, "Switching to the new index...")
+        with self._lock:
+            self._partial = None
+        swap_in(self.staging, self.chroma_dir)
+
+    def _restore(self) -> bool:
+        """Restore the configured snapshot if it is compatible. True if it was swapped in."""
+        from snapshot import SNAPSHOT_PATH, SnapshotError, incompatibilities, read_manifest, unpack_snapshot
+
+        if not SNAPSHOT_PATH.exists():
+            self._note_snapshot(f"No snapshot at {SNAPSHOT_PATH}")
+            return False
+        try:
+            problems = incompatibilities(read_manifest(SNAPSHOT_PATH))
+            if problems:
+                self._note_snapshot(f"Snapshot not used: {'; '.join(problems)}")
+                return False
+            self._stages = RESTORE_STAGES
+            self._report("restore", 0.0, f"Restoring {SNAPSHOT_PATH.name}...")
+            manifest = unpack_snapshot(SNAPSHOT_PATH, self.staging, self.data_dir,
+                                       progress=lambda f, m: self._report("restore", f, m))
+        except SnapshotError as e:
+            self._note_snapshot(f"Snapshot not used: {e}")
+            return False
+        self._report("swap", 0.0, "Switching to the restored index...")
+        swap_in(self.staging, self.chroma_dir)
+        self._note_snapshot(f"Restored {SNAPSHOT_PATH} (index built {manifest.get('built_at', '?')})")
+        return True
+
+    def _note_snapshot(self, note: str):
+        with self._lock:
+            self._status["snapshot"] = note
+
+    def _embedded(self, fraction: float, message: str):
+        """Progress from build_vectordb; opens the staging collection for degraded serving once it has records."""
+        self._report("embed", fraction, message)
+        if self._partial is None and not index_exists(self.chroma_dir):
+            import chromadb
+            from build_vectordb import COLLECTION_NAME
+            from rag_engine import get_embedding_function
+
+            try:
+                client = chromadb.PersistentClient(path=str(self.staging))
+                partial = client.get_collection(name=COLLECTION_NAME, embedding_function=get_embedding_function())
+            except Exception:
+                return
+            with self._lock:
+                self._partial = partial
@@ -0,0 +1,158 @@
+"""
+lexical_index.py — BM25 inverted index over record location and proposal text
+
+MiniLM embeddings blur street and place names together ("Griffith Avenue" vs
+"Griffith Court"), so build_vectordb.py also writes a compact BM25 index of
+each record's location and short proposal. retrieve_context can fuse the
+lexical and vector rankings with weighted reciprocal rank fusion (RRF).
+
+The in-memory structure is a dict of term -> (doc index array, term frequency
+array) plus per-document length normalisers, so a query only touches the
+postings of its own (rare) terms.
+"""
+
+import heapq
+import json
+import math
+import re
+import threading
+from array import array
+from pathlib import Path
+
+LEXICAL_INDEX_FILE = "lexical_index.json"  # Stored alongside the ChromaDB files
+LOCATION_BOOST = 2  # Location tokens are counted this many times
+MAX_DF_RATIO = 0.25  # Ignore query terms present in more than this share of records
+
+# Words that appear in most questions or records and carry no lexical signal
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "at", "be", "by", "co", "dublin", "for", "from", "had",
+    "has", "have", "how", "in", "is", "it", "me", "my", "near", "of", "on", "or", "show",
+    "that", "the", "there", "this", "to", "was", "were", "what", "which", "with",
+    "application", "applications", "planning", "permission", "development", "developments",
+    "proposed", "submitted", "tell", "about",
+}
+
+# Common address abbreviations, expanded so "Griffith Ave" matches "Griffith Avenue"
+ABBREVIATIONS = {
+    "ave": "avenue", "rd": "road", "sq": "square", "pde": "parade", "cres": "crescent",
+    "tce": "terrace", "pk": "park", "upr": "upper", "lwr": "lower", "nth": "north", "sth": "south",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_cache = {"path": None, "mtime": None, "index": None}
+_cache_lock = threading.Lock()
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens with stopwords removed and address abbreviations expanded."""
+    tokens = []
+    for token in _TOKEN_RE.findall((text or "").lower()):
+        token = ABBREVIATIONS.get(token, token)
+        if token in STOPWORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed document set."""
+
+    def __init__(self, doc_ids: list[str], doc_lengths: list[int], postings: dict,
+                 k1: float = 1.2, b: float = 0.75):
+        self.doc_ids = doc_ids
+        self.doc_lengths = array("I", doc_lengths)
+        self.k1 = k1
+        self.b = b
+        n = len(doc_ids)
+        avgdl = (sum(doc_lengths) / n) if n else 1.0
+        # Per-document length normaliser k1 * (1 - b + b * dl / avgdl)
+        self.norms = array("f", (k1 * (1 - b + b * dl / avgdl) for dl in doc_lengths))
+        self.postings = {
+            term: (array("I", docs), array("H", tfs)) for term, (docs, tfs) in postings.items()
+        }
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, (docs, _) in self.postings.items()
+        }
+        self.max_df = max(1, int(n * MAX_DF_RATIO))
+
+    @classmethod
+    def build(cls, docs) -> "BM25Index":
+        """Build from (doc_id, location, proposal) tuples."""
+        doc_ids, doc_lengths, postings = [], [], {}
+        for i, (doc_id, location, proposal) in enumerate(docs):
+            tokens = tokenize(location) * LOCATION_BOOST + tokenize(proposal)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                entry = postings.setdefault(token, ([], []))
+                entry[0].append(i)
+                entry[1].append(min(tf, 65535))
+            doc_ids.append(doc_id)
+            doc_lengths.append(len(tokens))
+        return cls(doc_ids, doc_lengths, postings)
+
+    def to_dict(self, version: str = "") -> dict:
+        """Serialisable form of the index."""
+        return {
+            "version": version,
+            "doc_ids": self.doc_ids,
+            "doc_lengths": list(self.doc_lengths),
+            "postings": {term: [list(docs), list(tfs)] for term, (docs, tfs) in self.postings.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        return cls(data["doc_ids"], data["doc_lengths"], data["postings"])
+
+    def search(self, query: str, top_n: int = 20) -> list[tuple[str, float]]:
+        """Return up to top_n (doc_id, score) pairs, best first."""
+        scores = {}
+        k1_plus_1 = self.k1 + 1
+        norms = self.norms
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None or len(posting[0]) > self.max_df:
+                continue
+            idf = self.idf[term]
+            for doc, tf in zip(*posting):
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * k1_plus_1 / (tf + norms[doc])
+        best = heapq.nlargest(top_n, scores.items(), key=lambda item: item[1])
+        return [(self.doc_ids[doc], score) for doc, score in best]
+
+
+def save_lexical_index(index: BM25Index, chroma_dir: Path, version: str = ""):
+    """Write the index next to the vector database."""
+    path = Path(chroma_dir) / LEXICAL_INDEX_FILE
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(version), f, ensure_ascii=False, separators=(",", ":"))
+    return path
+
+
+def load_lexical_index(chroma_dir: Path):
+    """Load the index (cached in memory, reloaded when the file changes). None if missing."""
+    path = Path(chroma_dir) / LEXICAL_INDEX_FILE
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    with _cache_lock:
+        if _cache["path"] != path or _cache["mtime"] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                _cache.update(path=path, mtime=mtime, index=BM25Index.from_dict(json.load(f)))
+        return _cache["index"]
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], weights: list[float], k: int = 60) -> list[tuple[str, float]]:
+    """
+    Fuse ranked ID lists: score(d) = sum_i weight_i / (k + rank_i(d)).
+
+    Returns (doc_id, score) pairs, best first.
+    """
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,354 @@
+"""
+llm_client.py — Shared Anthropic client for generation and evaluation
+
+Keeps one pooled Anthropic client per process so every question reuses the
+same HTTP connections instead of paying connection setup on each call, and
+records per-call latency and token usage, including prompt-cache reads and
+writes. Async callers (see async_engine.py)
+get a pooled AsyncAnthropic client per event loop with the same settings.
+
+Every call is admitted by the shared rate-limit scheduler (see scheduler.py)
+at its priority ("interactive" by default, "batch" for evaluation and batch
+work) and retried here, with backoff, on connection errors, 429/529 and
+5xx; the SDK's own retries are turned off so the two don't multiply.
+
+Configuration (environment or .env):
+    ANTHROPIC_API_KEY     API key (required)
+    ANTHROPIC_BASE_URL    Override the API endpoint, e.g. a local stand-in (see fake_llm.py)
+    LLM_TIMEOUT           Request timeout in seconds (default 60)
+    LLM_MAX_RETRIES       Retries on connection errors, 429/529s and 5xx (default 2)
+    LLM_RPM               Requests-per-minute budget (default 0 = unlimited)
+    LLM_TPM               Tokens-per-minute budget, input + output (default 0 = unlimited)
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import record_tokens
+from scheduler import INTERACTIVE, RateLimitScheduler, backoff_delay
+
+LLM_MODEL = "claude-sonnet-4-20250514"
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 2
+CALL_LOG_SIZE = 500  # Number of recent calls kept for stats
+CHARS_PER_TOKEN = 4  # Rough prompt size estimate for the token bucket
+
+scheduler = RateLimitScheduler(rpm=float(os.getenv("LLM_RPM", 0)), tpm=float(os.getenv("LLM_TPM", 0)))
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = {}  # id(event loop) -> (loop, AsyncAnthropic)
+_call_log = deque(maxlen=CALL_LOG_SIZE)
+_totals = {
+    "calls": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0,
+    "cache_read_tokens": 0, "cache_write_tokens": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _client_options() -> dict:
+    return {
+        "api_key": os.getenv("ANTHROPIC_API_KEY"),
+        "base_url": os.getenv("ANTHROPIC_BASE_URL") or None,
+        "timeout": float(os.getenv("LLM_TIMEOUT", DEFAULT_TIMEOUT)),
+        "max_retries": 0,  # Retried by _retry_delay() so waits go through the scheduler
+    }
+
+
+def _max_retries() -> int:
+    return int(os.getenv("LLM_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+
+
+def get_client():
+    """Return the process-wide Anthropic client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from anthropic import Anthropic
+
+                _client = Anthropic(**_client_options())
+    return _client
+
+
+def get_async_client():
+    """
+    Return the AsyncAnthropic client for the running event loop.
+
+    Async HTTP connection pools are bound to the loop that opened them, so
+    each loop gets its own client (normally there is just one).
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        for key, (other_loop, _) in list(_async_clients.items()):
+            if other_loop.is_closed():
+                del _async_clients[key]
+        entry = _async_clients.get(id(loop))
+        if entry is None or entry[0] is not loop:
+            from anthropic import AsyncAnthropic
+
+            entry = (loop, AsyncAnthropic(**_client_options()))
+            _async_clients[id(loop)] = entry
+    return entry[1]
+
+
+def reset_client():
+    """Close the pooled client so the next call picks up new configuration."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            try:
+                _client.close()
+            except Exception:
+                pass
+        _client = None
+        # Async clients can only be closed from their own loop; drop them
+        _async_clients.clear()
+
+
+def record_call(purpose: str, model: str, started: float, usage=None, error: Exception = None):
+    """Record latency and token usage for one LLM call."""
+    entry = {
+        "purpose": purpose,
+        "model": model,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        "cache_read_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+        "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        "ok": error is None,
+        "error": type(error).__name__ if error is not None else "",
+        "timestamp": time.time(),
+    }
+    with _stats_lock:
+        _call_log.append(entry)
+        _totals["calls"] += 1
+        _totals["errors"] += 0 if error is None else 1
+        _totals["input_tokens"] += entry["input_tokens"]
+        _totals["output_tokens"] += entry["output_tokens"]
+        _totals["cache_read_tokens"] += entry["cache_read_tokens"]
+        _totals["cache_write_tokens"] += entry["cache_write_tokens"]
+    record_tokens(usage)
+    return entry
+
+
+def estimate_tokens(kwargs: dict) -> int:
+    """Rough token cost of a request before it is sent: prompt size plus max_tokens."""
+    prompt = json.dumps([kwargs.get("system", ""), kwargs.get("messages", [])], default=str)
+    return len(prompt) // CHARS_PER_TOKEN + int(kwargs.get("max_tokens", 0) or 0)
+
+
+def _used_tokens(usage) -> int:
+    return sum(
+        getattr(usage, field, 0) or 0
+        for field in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+    )
+
+
+def _stream_usage(stream):
+    """Usage reported so far on a message stream (None if it never started)."""
+    try:
+        return stream.current_message_snapshot.usage
+    except (AttributeError, AssertionError):
+        return None
+
+
+def _retry_delay(error: Exception, attempt: int):
+    """
+    Seconds to wait before retrying a failed call, or None if it shouldn't be retried.
+
+    429 (rate limited) and 529 (overloaded) also pause the scheduler for
+    everyone, honouring the server's retry-after header.
+    """
+    import anthropic
+
+    if attempt >= _max_retries():
+        return None
+    if isinstance(error, anthropic.APIStatusError):
+        status = error.status_code
+        if status in (429, 529):
+            try:
+                retry_after = float(error.response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+            delay = backoff_delay(attempt, retry_after)
+            scheduler.pause(delay)
+        elif status in (408, 409) or status >= 500:
+            delay = backoff_delay(attempt)
+        else:
+            return None
+    elif isinstance(error, anthropic.APIConnectionError):
+        delay = backoff_delay(attempt)
+    else:
+        return None
+    scheduler.record_retry()
+    return delay
+
+
+def create_message(purpose: str = "generation", priority: str = INTERACTIVE, **kwargs):
+    """
+    Call messages.create on the pooled client and record the call.
+
+    Accepts the same keyword arguments as the Anthropic SDK; `model`
+    defaults to LLM_MODEL. The call waits for the scheduler at `priority`.
+    """
+    kwargs.setdefault("model", LLM_MODEL)
+    estimate = estimate_tokens(kwargs)
+    attempt = 0
+    while True:
+        scheduler.acquire(priority, estimate)
+        started = time.perf_counter()
+        try:
+            response = get_client().messages.create(**kwargs)
+        except Exception as e:
+            scheduler.settle(estimate, 0)
+            record_call(purpose, kwargs["model"], started, error=e)
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            time.sleep(delay)
+            continue
+        scheduler.settle(estimate, _used_tokens(response.usage))
+        record_call(purpose, kwargs["model"], started, usage=response.usage)
+        return response
+
+
+def stream_message(purpose: str = "generation", priority: str = INTERACTIVE, **kwargs):
+    """
+    Stream a Messages API call on the pooled client, yielding text chunks.
+
+    Latency and token usage are recorded once the stream completes. A
+    failure before the first chunk is retried like create_message. The
+    scheduler is settled with the usage received so far however the stream
+    ends, including when the caller stops reading early.
+    """
+    kwargs.setdefault("model", LLM_MODEL)
+    estimate = estimate_tokens(kwargs)
+    attempt = 0
+    while True:
+        scheduler.acquire(priority, estimate)
+        started = time.perf_counter()
+        streamed = False
+        stream = error = None
+        try:
+            with get_client().messages.stream(**kwargs) as stream:
+                for text in stream.text_stream:
+                    streamed = True
+                    yield text
+                stream.get_final_message()
+        except GeneratorExit:
+            # The caller stopped reading: record what was used before the stream closed
+            record_call(purpose, kwargs["model"], started, usage=_stream_usage(stream))
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            scheduler.settle(estimate, _used_tokens(_stream_usage(stream)))
+        if error is None:
+            record_call(purpose, kwargs["model"], started, usage=_stream_usage(stream))
+            return
+        record_call(purpose, kwargs["model"], started, error=error)
+        delay = None if streamed else _retry_delay(error, attempt)
+        if delay is None:
+            raise error
+        attempt += 1
+        time.sleep(delay)
+
+
+async def acreate_message(purpose: str = "generation", priority: str = INTERACTIVE, **kwargs):
+    """Async messages.create on the loop's pooled client (scheduled and recorded like create_message)."""
+    kwargs.setdefault("model", LLM_MODEL)
+    estimate = estimate_tokens(kwargs)
+    attempt = 0
+    while True:
+        await scheduler.aacquire(priority, estimate)
+        started = time.perf_counter()
+        try:
+            response = await get_async_client().messages.create(**kwargs)
+        except Exception as e:
+            scheduler.settle(estimate, 0)
+            record_call(purpose, kwargs["model"], started, error=e)
+            delay = _retry_delay(e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        scheduler.settle(estimate, _used_tokens(response.usage))
+        record_call(purpose, kwargs["model"], started, usage=response.usage)
+        return response
+
+
+async def astream_message(purpose: str = "generation", priority: str = INTERACTIVE, **kwargs):
+    """Async generator of text chunks from a streamed Messages API call (settled like stream_message)."""
+    kwargs.setdefault("model", LLM_MODEL)
+    estimate = estimate_tokens(kwargs)
+    attempt = 0
+    while True:
+        await scheduler.aacquire(priority, estimate)
+        started = time.perf_counter()
+        streamed = False
+        stream = error = None
+        try:
+            async with get_async_client().messages.stream(**kwargs) as stream:
+                async for text in stream.text_stream:
+                    streamed = True
+                    yield text
+                await stream.get_final_message()
+        except GeneratorExit:
+            # The caller stopped reading: record what was used before the stream closed
+            record_call(purpose, kwargs["model"], started, usage=_stream_usage(stream))
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            scheduler.settle(estimate, _used_tokens(_stream_usage(stream)))
+        if error is None:
+            record_call(purpose, kwargs["model"], started, usage=_stream_usage(stream))
+            return
+        record_call(purpose, kwargs["model"], started, error=error)
+        delay = None if streamed else _retry_delay(error, attempt)
+        if delay is None:
+            raise error
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def response_text(response) -> str:
+    """Concatenate the text blocks of a Messages API response."""
+    return "".join(block.text for block in response.content if getattr(block, "type", "") == "text")
+
+
+def get_call_stats() -> dict:
+    """Summarise recorded LLM calls (totals plus latency over recent calls)."""
+    with _stats_lock:
+        recent = list(_call_log)
+        totals = dict(_totals)
+    latencies = sorted(c["latency_ms"] for c in recent if c["ok"])
+    prompt_tokens = totals["input_tokens"] + totals["cache_read_tokens"] + totals["cache_write_tokens"]
+    totals["cache_read_share"] = round(totals["cache_read_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0
+    if latencies:
+        totals["avg_latency_ms"] = round(sum(latencies) / len(latencies), 1)
+        totals["p95_latency_ms"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    else:
+        totals["avg_latency_ms"] = 0.0
+        totals["p95_latency_ms"] = 0.0
+    return totals
+
+
+def get_scheduler_stats() -> dict:
+    """Rate-limit budgets, queue depth and wait times of the shared scheduler."""
+    return scheduler.stats()
+
+
+def recent_calls(n: int = 20) -> list[dict]:
+    """Return the last n recorded calls, newest last."""
+    with _stats_lock:
+        return list(_call_log)[-n:]
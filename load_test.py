@@ -0,0 +1,300 @@
+"""
+load_test.py — Concurrent load test of the query pipeline
+
+Replays a question corpus through query_planning (or the streaming variant)
+at one or more concurrency levels and reports throughput, end-to-end and
+per-stage latency percentiles (from the metrics.py traces), token usage and
+error and timeout rates. By default Claude is replaced by the local stand-in from
+fake_llm.py with a tunable latency profile, so the retrieval side of the
+stack can be sized without API costs or rate limits.
+
+Corpora:
+    samples    sample questions from the app.py sidebar (all roles)
+    baseline   evaluate.BASELINE_RESPONSES prompts
+    all        both of the above
+    <path>     a log file: one question per line, or JSON lines with a "query" field
+
+Usage:
+    python load_test.py --concurrency 1 4 16 --requests 200
+    python load_test.py --corpus questions.jsonl --latency 1.0 --tokens-per-sec 50 --stream
+    python load_test.py --llm-url https://api.anthropic.com --requests 20   # real API
+    python load_test.py --llm-rpm 60 --rpm 50 --concurrency 16   # provider limit vs. scheduler budget
+    python load_test.py --use-cache --coalesce   # measure the warm path instead
+
+The corpus is cycled, so repeated questions would otherwise be served by the
+answer, retrieval and embedding caches or share an in-flight answer. Both are
+off unless --use-cache / --coalesce turn them on, so by default every request
+runs the full pipeline.
+"""
+
+import argparse
+import ast
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from dotenv import load_dotenv
+load_dotenv()
+
+APP_FILE = Path(__file__).parent / "app.py"
+DEFAULT_REQUESTS = 100  # Questions sent per concurrency level
+
+
+def sample_questions() -> list[str]:
+    """Sample questions of every role in the app sidebar (read from app.py without running it)."""
+    tree = ast.parse(APP_FILE.read_text())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "role_config" for t in node.targets):
+            role_config = ast.literal_eval(node.value)
+            questions = [q for config in role_config.values() for q in config["questions"]]
+            return list(dict.fromkeys(questions))
+    return []
+
+
+def baseline_questions() -> list[str]:
+    from evaluate import BASELINE_RESPONSES
+    return list(BASELINE_RESPONSES)
+
+
+def load_corpus(source: str) -> list[str]:
+    """Questions for a corpus name or log file path."""
+    if source == "samples":
+        return sample_questions()
+    if source == "baseline":
+        return baseline_questions()
+    if source == "all":
+        return list(dict.fromkeys(sample_questions() + baseline_questions()))
+
+    questions = []
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                query = json.loads(line).get("query")
+                if isinstance(query, str) and query.strip():
+                    questions.append(query.strip())
+            else:
+                questions.append(line)
+    return questions
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+def _distribution(values: list[float]) -> dict:
+    return {
+        "avg": round(sum(values) / len(values), 1) if values else 0.0,
+        "p50": round(_percentile(values, 0.50), 1),
+        "p95": round(_percentile(values, 0.95), 1),
+        "p99": round(_percentile(values, 0.99), 1),
+    }
+
+
+@contextmanager
+def _pipeline_caches(use_cache: bool, coalesce: bool):
+    """Switch the retrieval/embedding caches and query coalescing on or off for one run."""
+    import rag_engine
+
+    caches = (rag_engine.retrieval_cache, rag_engine.embedding_cache)
+    saved = [cache.max_entries for cache in caches], rag_engine.COALESCE_QUERIES
+    if not use_cache:
+        for cache in caches:
+            cache.clear()
+            cache.max_entries = 0  # Nothing is stored, so every lookup misses
+    rag_engine.COALESCE_QUERIES = coalesce
+    try:
+        yield
+    finally:
+        for cache, max_entries in zip(caches, saved[0]):
+            cache.max_entries = max_entries
+        rag_engine.COALESCE_QUERIES = saved[1]
+
+
+def _ask(question: str, collection, stream: bool, use_cache: bool) -> tuple[dict, bool]:
+    """Answer one question and return its metrics trace and whether it was coalesced."""
+    from rag_engine import query_planning, stream_query_planning
+
+    if stream:
+        done = list(stream_query_planning(question, collection=collection, use_cache=use_cache))[-1]
+    else:
+        done = query_planning(question, collection=collection, use_cache=use_cache)
+    return done["metrics"], done["coalesced"]
+
+
+def run_load(questions: list[str], concurrency: int, requests: int = DEFAULT_REQUESTS, collection=None,
+             stream: bool = False, use_cache: bool = False, coalesce: bool = False) -> dict:
+    """
+    Send `requests` questions (cycling through the corpus) from `concurrency` threads.
+
+    A question answered with the templated fallback counts as failed when
+    Claude errored and as a timeout when Claude missed the deadline; only
+    Claude answers (and cache hits) count as succeeded. use_cache enables
+    the answer, retrieval and embedding caches; coalesce lets identical
+    in-flight questions share one answer.
+
+    Returns:
+        Summary dict: throughput, latency/stage percentiles (ms), tokens, errors, timeouts
+    """
+    from rag_engine import get_collection
+    from llm_client import scheduler
+
+    collection = collection or get_collection()
+    scheduler.reset_stats()
+    latencies, traces, errors = [], [], {}
+    coalesced = 0
+    lock = threading.Lock()
+
+    def one(question):
+        nonlocal coalesced
+        started = time.perf_counter()
+        try:
+            trace, shared = _ask(question, collection, stream, use_cache)
+        except Exception as e:
+            with lock:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+            traces.append(trace)
+            coalesced += shared
+            if trace.get("fallback") == "error" or trace.get("generation_error"):
+                name = trace.get("generation_error") or "generation_error"
+                errors[name] = errors.get(name, 0) + 1
+
+    jobs = [questions[i % len(questions)] for i in range(requests)]
+    started = time.perf_counter()
+    with _pipeline_caches(use_cache, coalesce), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, jobs))
+    duration = time.perf_counter() - started
+
+    stage_names = sorted({name for trace in traces for name in trace["stages_ms"]} - {"total"})
+    failed = sum(errors.values())
+    timeouts = sum(1 for t in traces if t.get("fallback") == "timeout")
+    succeeded = requests - failed - timeouts
+    summary = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": succeeded,
+        "failed": failed,
+        "error_rate": round(failed / requests, 4) if requests else 0.0,
+        "errors": errors,
+        "timeouts": timeouts,
+        "timeout_rate": round(timeouts / requests, 4) if requests else 0.0,
+        "duration_s": round(duration, 2),
+        "throughput_qps": round(succeeded / duration, 2) if duration else 0.0,
+        "latency_ms": _distribution(latencies),
+        "stages_ms": {
+            name: _distribution([t["stages_ms"][name] for t in traces if name in t["stages_ms"]])
+            for name in stage_names
+        },
+        "cache_hits": sum(1 for t in traces if t.get("cache_hit")),
+        "retrieval_cache_hits": sum(1 for t in traces if t.get("retrieval_cache_hit")),
+        "embedding_cache_hits": sum(t["counts"].get("embedding_cache_hits", 0) for t in traces),
+        "coalesced": coalesced,
+        "input_tokens": sum(t["counts"].get("input_tokens", 0) for t in traces),
+        "output_tokens": sum(t["counts"].get("output_tokens", 0) for t in traces),
+    }
+    if stream:
+        summary["first_token_ms"] = _distribution([t["first_token_ms"] for t in traces if "first_token_ms" in t])
+    llm_queue = scheduler.stats()
+    summary["llm_queue"] = {
+        "wait_ms": llm_queue["wait_ms"]["interactive"],
+        "throttled": llm_queue["throttled"],
+        "rate_limited": llm_queue["rate_limited"],
+        "retries": llm_queue["retries"],
+    }
+    return summary
+
+
+def print_summary(summary: dict):
+    latency = summary["latency_ms"]
+    print(f"\nConcurrency {summary['concurrency']}: {summary['succeeded']}/{summary['requests']} ok "
+          f"in {summary['duration_s']}s — {summary['throughput_qps']} q/s, "
+          f"error rate {summary['error_rate']:.1%} {summary['errors'] or ''}, "
+          f"timeouts {summary['timeouts']} ({summary['timeout_rate']:.1%})")
+    print(f"  {'Stage':<14} {'avg':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    rows = list(summary["stages_ms"].items()) + [("end-to-end", latency)]
+    if "first_token_ms" in summary:
+        rows.append(("first token", summary["first_token_ms"]))
+    for name, dist in rows:
+        print(f"  {name:<14} {dist['avg']:>7.1f}ms {dist['p50']:>7.1f}ms {dist['p95']:>7.1f}ms {dist['p99']:>7.1f}ms")
+    print(f"  Tokens: {summary['input_tokens']:,} in / {summary['output_tokens']:,} out, "
+          f"cache hits: {summary['cache_hits']} answer / {summary['retrieval_cache_hits']} retrieval / "
+          f"{summary['embedding_cache_hits']} embedding, {summary['coalesced']} coalesced")
+    queue = summary["llm_queue"]
+    print(f"  LLM queue: {queue['throttled']} calls waited (avg {queue['wait_ms']['avg']:.0f}ms, "
+          f"p95 {queue['wait_ms']['p95']:.0f}ms), {queue['rate_limited']} rate-limited, {queue['retries']} retries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the planning query pipeline")
+    parser.add_argument("--corpus", default="all", help="samples, baseline, all, or a question log file")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrency levels to run")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="Questions per concurrency level")
+    parser.add_argument("--stream", action="store_true", help="Use stream_query_planning (records first-token time)")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="Allow answer, retrieval and embedding cache hits (off by default)")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="Let identical in-flight questions share one answer (off by default)")
+    parser.add_argument("--llm-url", default=None, help="Send Claude calls here instead of the local stand-in")
+    parser.add_argument("--latency", type=float, default=0.8, help="Stand-in LLM delay before the first token (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=60.0, help="Stand-in LLM output rate")
+    parser.add_argument("--answer-tokens", type=int, default=250, help="Stand-in LLM answer length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stand-in calls failing with 529")
+    parser.add_argument("--llm-rpm", type=int, default=0, help="Stand-in LLM requests per minute before 429s")
+    parser.add_argument("--rpm", type=float, default=None, help="Scheduler requests-per-minute budget (default LLM_RPM)")
+    parser.add_argument("--tpm", type=float, default=None, help="Scheduler tokens-per-minute budget (default LLM_TPM)")
+    parser.add_argument("--output", default=None, help="Write all summaries to a JSON file")
+    args = parser.parse_args()
+
+    if args.llm_url:
+        os.environ["ANTHROPIC_BASE_URL"] = args.llm_url
+    else:
+        from fake_llm import start_fake_llm
+
+        fake_server, fake_url = start_fake_llm(
+            latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+            answer_tokens=args.answer_tokens, error_rate=args.error_rate, rpm=args.llm_rpm,
+        )
+        os.environ["ANTHROPIC_BASE_URL"] = fake_url
+        os.environ.setdefault("ANTHROPIC_API_KEY", "load-test")
+        print(f"Stand-in LLM at {fake_url}: {args.latency}s latency, {args.tokens_per_sec} tokens/s, "
+              f"~{args.answer_tokens} tokens per answer, {args.error_rate:.0%} errors"
+              + (f", {args.llm_rpm} requests/min" if args.llm_rpm else ""))
+
+    from llm_client import reset_client, scheduler
+    reset_client()  # Pick up the endpoint chosen above
+    if args.rpm is not None or args.tpm is not None:
+        scheduler.configure(args.rpm if args.rpm is not None else scheduler.rpm,
+                            args.tpm if args.tpm is not None else scheduler.tpm)
+
+    questions = load_corpus(args.corpus)
+    if not questions:
+        raise SystemExit(f"No questions found in corpus {args.corpus!r}")
+
+    from rag_engine import get_collection, embed_query
+
+    print(f"Loading vector database and embedding model ({len(questions)} questions in corpus)...")
+    collection = get_collection()
+    embed_query("warm up")
+
+    summaries = []
+    for concurrency in args.concurrency:
+        summary = run_load(questions, concurrency, args.requests, collection, args.stream,
+                           args.use_cache, args.coalesce)
+        print_summary(summary)
+        summaries.append(summary)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"corpus": args.corpus, "stream": args.stream, "use_cache": args.use_cache,
+                       "coalesce": args.coalesce, "runs": summaries}, f, indent=2)
+        print(f"\nResults saved to {args.output}")
@@ -0,0 +1,253 @@
+"""
+metrics.py — Per-query stage timings, counts and token usage
+
+query_planning opens a QueryTrace for each question; code along the pipeline
+records into whichever trace is active (embedding, Chroma search, hybrid
+fusion, re-ranking, context assembly, cache lookup, Claude) without having
+to pass it around. When the question finishes the trace is returned to the
+caller and handed to every registered sink:
+
+- HistogramSink (always on): per-stage latency histograms in memory, with
+  percentile summaries and Prometheus text exposition
+- LogSink: one log line per question (METRICS_LOG=1)
+- any object with an emit(trace_dict) method, via add_sink()
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_current = contextvars.ContextVar("query_trace", default=None)
+
+
+class QueryTrace:
+    """Timings (ms), counts and flags for one question."""
+
+    def __init__(self, query: str = ""):
+        self.query = query
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+        self.flags = {}
+        self.final = None
+        self._lock = threading.Lock()
+
+    def add_time(self, stage: str, ms: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def add_count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def set_flag(self, name: str, value):
+        self.flags[name] = value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {name: round(ms, 2) for name, ms in self.stages.items()}
+            counts = dict(self.counts)
+        stages["total"] = round((time.perf_counter() - self.started) * 1000, 2)
+        return {"stages_ms": stages, "counts": counts, **self.flags}
+
+
+def current_trace():
+    """The trace of the question being answered in this context (None outside query_planning)."""
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block into the active trace (no-op when there is none)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_time(name, (time.perf_counter() - started) * 1000)
+
+
+def count(name: str, value: int = 1):
+    """Add to a counter on the active trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+def flag(name: str, value):
+    """Set a flag (e.g. cache_hit, route) on the active trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.set_flag(name, value)
+
+
+def record_tokens(usage):
+    """Add LLM token usage to the active trace (called by llm_client)."""
+    trace = _current.get()
+    if trace is not None and usage is not None:
+        trace.add_count("input_tokens", getattr(usage, "input_tokens", 0) or 0)
+        trace.add_count("output_tokens", getattr(usage, "output_tokens", 0) or 0)
+        trace.add_count("cache_read_tokens", getattr(usage, "cache_read_input_tokens", 0) or 0)
+        trace.add_count("cache_write_tokens", getattr(usage, "cache_creation_input_tokens", 0) or 0)
+
+
+@contextmanager
+def trace_query(query: str):
+    """
+    Activate a new trace for the duration of a question, then emit it to the sinks.
+
+    Yields the QueryTrace; after the block, trace.final holds the emitted dict.
+    """
+    trace = QueryTrace(query)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            pass  # A streaming generator closed from another context
+        trace.final = trace.to_dict()
+        emit(trace.final)
+
+
+# ── Sinks ──────────────────────────────────────────────────────
+
+class HistogramSink:
+    """In-memory latency histograms per stage, plus counter totals."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}  # stage -> {"counts": [...], "sum": float, "n": int}
+            self.counters = {}
+            self.queries = 0
+
+    def emit(self, trace: dict):
+        with self._lock:
+            self.queries += 1
+            for stage_name, ms in trace["stages_ms"].items():
+                hist = self.histograms.setdefault(
+                    stage_name, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "n": 0}
+                )
+                index = next((i for i, bound in enumerate(self.buckets) if ms <= bound), len(self.buckets))
+                hist["counts"][index] += 1
+                hist["sum"] += ms
+                hist["n"] += 1
+            for name, value in trace["counts"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            if trace.get("cache_hit"):
+                self.counters["cache_hits"] = self.counters.get("cache_hits", 0) + 1
+
+    def _quantile(self, hist: dict, q: float) -> float:
+        """Upper bucket bound containing the q-quantile (inf for the overflow bucket)."""
+        target = q * hist["n"]
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), hist["counts"]):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def summary(self) -> dict:
+        """Per-stage count, mean and p50/p95/p99 (bucket upper bounds), plus counter totals."""
+        with self._lock:
+            stages = {
+                stage_name: {
+                    "count": hist["n"],
+                    "avg_ms": round(hist["sum"] / hist["n"], 2) if hist["n"] else 0.0,
+                    "p50_ms": self._quantile(hist, 0.50),
+                    "p95_ms": self._quantile(hist, 0.95),
+                    "p99_ms": self._quantile(hist, 0.99),
+                }
+                for stage_name, hist in self.histograms.items()
+            }
+            return {"queries": self.queries, "stages": stages, "counters": dict(self.counters)}
+
+    def prometheus_text(self, prefix: str = "planning") -> str:
+        """Prometheus text exposition of the histograms and counters."""
+        lines = []
+        with self._lock:
+            lines.append(f"# TYPE {prefix}_stage_latency_ms histogram")
+            for stage_name, hist in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, hist["counts"]):
+                    cumulative += n
+                    lines.append(f'{prefix}_stage_latency_ms_bucket{{stage="{stage_name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_latency_ms_bucket{{stage="{stage_name}",le="+Inf"}} {hist["n"]}')
+                lines.append(f'{prefix}_stage_latency_ms_sum{{stage="{stage_name}"}} {hist["sum"]:.3f}')
+                lines.append(f'{prefix}_stage_latency_ms_count{{stage="{stage_name}"}} {hist["n"]}')
+            lines.append(f"# TYPE {prefix}_queries_total counter")
+            lines.append(f"{prefix}_queries_total {self.queries}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+class LogSink:
+    """Writes one JSON log line per question."""
+
+    def __init__(self, logger: logging.Logger = None):
+        self.logger = logger or logging.getLogger("planning.metrics")
+
+    def emit(self, trace: dict):
+        self.logger.info(json.dumps(trace, default=str))
+
+
+histograms = HistogramSink()
+_sinks = [histograms]
+_sinks_lock = threading.Lock()
+
+if os.getenv("METRICS_LOG", "").lower() in ("1", "true", "yes"):
+    _sinks.append(LogSink())
+
+
+def add_sink(sink):
+    """Register a sink (any object with emit(trace_dict))."""
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def emit(trace: dict):
+    """Send a finished trace to every sink (a failing sink never breaks a question)."""
+    with _sinks_lock:
+        sinks = list(_sinks)
+    for sink in sinks:
+        try:
+            sink.emit(trace)
+        except Exception:
+            pass
+
+
+def format_trace(trace: dict) -> str:
+    """Short human-readable summary, e.g. 'embed 12ms · search 30ms · generate 2100ms · total 2150ms'."""
+    parts = [f"{name} {ms:.0f}ms" for name, ms in trace.get("stages_ms", {}).items()]
+    counts = trace.get("counts", {})
+    if counts.get("input_tokens") or counts.get("output_tokens"):
+        parts.append(f"{counts.get('input_tokens', 0):,} in / {counts.get('output_tokens', 0):,} out tokens")
+    if counts.get("cache_read_tokens"):
+        parts.append(f"{counts['cache_read_tokens']:,} prompt tokens from cache")
+    if trace.get("cache_hit"):
+        parts.append("cache hit")
+    return " · ".join(parts)
@@ -0,0 +1,297 @@
+"""
+query_filters.py — Rule-based extraction of metadata filters from questions
+
+Turns phrases like "refused applications in Dublin 8" or "appeals in Ranelagh"
+into ChromaDB `where` filters so the vector search runs over a much smaller
+candidate set. Date and size constraints ("since 2022", "50+ units") become
+range filters on the typed numeric fields. Also holds the normalisers build_vectordb.py uses to store the
+filterable fields (postcode, decision class, application class), so both
+sides agree on the vocabulary.
+"""
+
+import re
+from datetime import date, timedelta
+
+# ── Normalisers (shared with build_vectordb.create_metadata) ───
+
+_POSTCODE_RE = re.compile(r"^\s*(?:dublin|d)\s*0?(\d{1,2})\s*(w?)\s*$", re.IGNORECASE)
+
+
+def normalize_postcode(value: str) -> str:
+    """Normalise 'DUBLIN 08', 'D8', 'D06W' etc. to 'Dublin 8' / 'Dublin 6W' ('' if unrecognised)."""
+    match = _POSTCODE_RE.match(value or "")
+    if not match:
+        return ""
+    district = int(match.group(1))
+    if not 1 <= district <= 24:
+        return ""
+    return f"Dublin {district}{match.group(2).upper()}"
+
+
+def classify_decision(decision: str) -> str:
+    """Map a raw council decision string to a coarse class used for filtering."""
+    d = (decision or "").upper()
+    if not d or d == "PENDING":
+        return "pending"
+    if "SPLIT" in d:
+        return "split"
+    if "WITHDRAWN" in d:
+        return "withdrawn"
+    if "REFUSE" in d or "REFUSAL" in d:
+        return "refused"
+    if "GRANT" in d or "APPROVED" in d:
+        return "granted"
+    if "INFORMATION" in d:
+        return "further_info"
+    if "INVALID" in d or "INCOMPLETE" in d:
+        return "invalid"
+    return "other"
+
+
+def classify_app_type(app_type: str) -> str:
+    """Map a raw application type to a coarse class used for filtering."""
+    t = (app_type or "").upper()
+    if "RETENTION" in t:
+        return "retention"
+    if "OUTLINE" in t:
+        return "outline"
+    if "EXTENSION OF DURATION" in t:
+        return "extension_of_duration"
+    if "PERMISSION" in t:
+        return "permission"
+    return "other" if t else ""
+
+
+_EPOCH = date(1970, 1, 1)
+
+
+def epoch_day(value: str):
+    """Convert a 'YYYY-MM-DD' date string to days since 1970-01-01 (None if not a date)."""
+    try:
+        return (date.fromisoformat((value or "")[:10]) - _EPOCH).days
+    except ValueError:
+        return None
+
+
+def parse_number(value):
+    """Parse a numeric metadata value ('12', '1,250.5'); None if empty or not a number."""
+    try:
+        return float(str(value).replace(",", "").strip())
+    except (ValueError, TypeError):
+        return None
+
+
+# ── Query parsing ──────────────────────────────────────────────
+
+_QUERY_POSTCODE_RE = re.compile(r"\b(?:dublin\s*0?(\d{1,2})(w?)|D0?(\d{1,2})(W?))\b", re.IGNORECASE)
+
+_DECISION_RULES = [
+    (re.compile(r"\bsplit decision", re.I), "split"),
+    (re.compile(r"\b(refus\w*|reject\w*|turned down|denied)\b", re.I), "refused"),
+    (re.compile(r"\bwithdrawn\b", re.I), "withdrawn"),
+    (re.compile(r"\b(pending|awaiting (a )?decision|undecided|not yet decided)\b", re.I), "pending"),
+    (re.compile(r"\bfurther information\b", re.I), "further_info"),
+    (re.compile(r"\b(grant\w*|approv\w*|permitted)\b", re.I), "granted"),
+]
+
+_APPEAL_RE = re.compile(r"\b(appeal\w*|bord plean[aá]la|ABP)\b", re.I)
+
+# (pattern, value) pairs, checked in order; first match wins per field.
+# Only categories the download_data.py classifier assigns reliably. Extensions
+# and demolitions are usually labelled by building type (a house extension is
+# "residential"), so those are left to semantic search.
+_CATEGORY_RULES = [
+    (re.compile(r"\b(residential|houses?|apartments?|dwellings?|flats?|duplex(es)?)\b", re.I), "residential"),
+    (re.compile(r"\b(commercial|offices?|retail|shops?|restaurants?|hotels?)\b", re.I), "commercial"),
+    (re.compile(r"\b(industrial|warehouses?|factor(y|ies))\b", re.I), "industrial"),
+    (re.compile(r"\b(schools?|colleges?|universit(y|ies)|creches?|childcare)\b", re.I), "education"),
+    (re.compile(r"\b(churche?s?|hospitals?|clinics?)\b", re.I), "public_institutional"),
+]
+
+_LAND_RULES = [
+    (re.compile(r"\b(social|affordable|council) housing\b|\bpart v\b", re.I), "public_housing"),
+    (re.compile(r"\b(public|council|state)(\s+or\s+council)?\s+(land|sites?|property)\b", re.I), "public"),
+]
+
+_SCALE_RULES = [
+    (re.compile(r"\b(large|large-scale|major|strategic housing|SHD)\b", re.I), "large"),
+    (re.compile(r"\b(medium|mid-size|medium-sized)\b", re.I), "medium"),
+    (re.compile(r"\b(one-off|single) (house|dwelling)s?\b", re.I), "single"),
+]
+
+_APP_CLASS_RULES = [
+    (re.compile(r"\bretention\b", re.I), "retention"),
+    (re.compile(r"\boutline permission\b", re.I), "outline"),
+    (re.compile(r"\bextension of duration\b", re.I), "extension_of_duration"),
+]
+
+
+# Date ranges on the registration date ("since 2022", "between 2019 and 2021", "last 2 years")
+_YEAR = r"((?:19|20)\d{2})(?![/\d])"
+_BETWEEN_RE = re.compile(rf"\bbetween\s+{_YEAR}\s+and\s+{_YEAR}", re.I)
+_SINCE_RE = re.compile(rf"\b(since|from|after|post)\s+{_YEAR}", re.I)
+_BEFORE_RE = re.compile(rf"\b(before|prior to|until|up to|pre)\s+{_YEAR}", re.I)
+_IN_YEAR_RE = re.compile(rf"\b(in|during)\s+{_YEAR}", re.I)
+_LAST_PERIOD_RE = re.compile(r"\b(?:last|past)\s+(\d+)\s+(years?|months?)\b", re.I)
+_THIS_YEAR_RE = re.compile(r"\bthis year\b", re.I)
+_LAST_YEAR_RE = re.compile(r"\blast year\b", re.I)
+
+# Numeric thresholds on residential units and floor area ("50+ units", "over 1000 sqm")
+_UNIT_NOUN = r"(?:residential\s+)?(?:units|homes|apartments|dwellings|houses)"
+_AREA_NOUN = r"(?:sq\.?\s?m|sqm|m2|m²|square met(?:re|er)s)"
+_COMPARATORS = [
+    (r"(\d[\d,]*)\s*\+\s*", "$gte"),
+    (r"(?:more than|over|greater than|in excess of)\s+(\d[\d,]*)\s*", "$gt"),
+    (r"(?:at least|minimum of|a minimum of|no fewer than)\s+(\d[\d,]*)\s*", "$gte"),
+    (r"(?:fewer than|less than|under|below)\s+(\d[\d,]*)\s*", "$lt"),
+    (r"(?:at most|up to|no more than|maximum of)\s+(\d[\d,]*)\s*", "$lte"),
+]
+_NUMERIC_RULES = [
+    (re.compile(r"\b" + pattern + noun, re.I), field, op)
+    for field, noun in (("num_units", _UNIT_NOUN), ("floor_area", _AREA_NOUN))
+    for pattern, op in _COMPARATORS
+]
+
+
+def parse_date_range(query: str, today: date = None):
+    """
+    Extract a registration-date range from a question.
+
+    Returns:
+        (start, end) dates with end exclusive (either may be None), or None
+    """
+    today = today or date.today()
+
+    match = _BETWEEN_RE.search(query)
+    if match:
+        first, last = sorted((int(match.group(1)), int(match.group(2))))
+        return date(first, 1, 1), date(last + 1, 1, 1)
+
+    match = _LAST_PERIOD_RE.search(query)
+    if match:
+        n = int(match.group(1))
+        days = n * 365 if match.group(2).lower().startswith("year") else n * 30
+        return today - timedelta(days=days), None
+
+    if _THIS_YEAR_RE.search(query):
+        return date(today.year, 1, 1), None
+    if _LAST_YEAR_RE.search(query):
+        return date(today.year - 1, 1, 1), date(today.year, 1, 1)
+
+    start = end = None
+    match = _SINCE_RE.search(query)
+    if match:
+        year = int(match.group(2))
+        start = date(year + 1 if match.group(1).lower() in ("after", "post") else year, 1, 1)
+    match = _BEFORE_RE.search(query)
+    if match:
+        year = int(match.group(2))
+        end = date(year + 1 if match.group(1).lower() in ("until", "up to") else year, 1, 1)
+    if start or end:
+        return start, end
+
+    match = _IN_YEAR_RE.search(query)
+    if match:
+        year = int(match.group(2))
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    return None
+
+
+def parse_numeric_ranges(query: str) -> dict:
+    """Extract unit-count and floor-area thresholds, e.g. {"num_units": {"$gte": 50}}."""
+    ranges = {}
+    for pattern, field, op in _NUMERIC_RULES:
+        match = pattern.search(query)
+        if match and field not in ranges:
+            ranges[field] = {op: int(match.group(1).replace(",", ""))}
+    return ranges
+
+
+def _first_match(rules, text: str) -> str:
+    for pattern, value in rules:
+        if pattern.search(text):
+            return value
+    return ""
+
+
+def parse_query_filters(query: str) -> dict:
+    """
+    Extract structured metadata constraints from a question.
+
+    Returns a dict of metadata field -> value for the fields that were
+    recognised, e.g. {"decision_class": "refused", "postcode": "Dublin 8"}.
+    Range constraints map to an operator dict on the typed numeric fields,
+    e.g. {"reg_day": {"$gte": 18993}, "num_units": {"$gte": 50}}.
+    """
+    filters = {}
+
+    match = _QUERY_POSTCODE_RE.search(query)
+    if match:
+        district = match.group(1) or match.group(3)
+        suffix = match.group(2) or match.group(4) or ""
+        postcode = normalize_postcode(f"Dublin {district}{suffix}")
+        if postcode:
+            filters["postcode"] = postcode
+
+    # "granted or refused" asks about both outcomes, so only filter on a single one
+    decisions = {value for pattern, value in _DECISION_RULES if pattern.search(query)}
+    if len(decisions) == 1:
+        filters["decision_class"] = decisions.pop()
+
+    if _APPEAL_RE.search(query):
+        filters["has_appeal"] = "True"
+
+    for field, rules in (
+        ("dev_category", _CATEGORY_RULES),
+        ("land_type", _LAND_RULES),
+        ("dev_scale", _SCALE_RULES),
+        ("app_class", _APP_CLASS_RULES),
+    ):
+        value = _first_match(rules, query)
+        if value:
+            filters[field] = value
+
+    date_range = parse_date_range(query)
+    if date_range:
+        start, end = date_range
+        bounds = {}
+        if start:
+            bounds["$gte"] = (start - _EPOCH).days
+        if end:
+            bounds["$lt"] = (end - _EPOCH).days
+        filters["reg_day"] = bounds
+
+    filters.update(parse_numeric_ranges(query))
+    return filters
+
+
+def matches_filters(metadata: dict, filters: dict) -> bool:
+    """Check a record's metadata against parsed filters (same semantics as build_where)."""
+    ops = {
+        "$gte": lambda a, b: a >= b, "$gt": lambda a, b: a > b,
+        "$lte": lambda a, b: a <= b, "$lt": lambda a, b: a < b,
+    }
+    for field, value in (filters or {}).items():
+        actual = metadata.get(field)
+        if isinstance(value, dict):
+            if actual is None or not all(ops[op](actual, bound) for op, bound in value.items()):
+                return False
+        elif actual != value:
+            return False
+    return True
+
+
+def build_where(filters: dict):
+    """Build a ChromaDB `where` clause from parsed filters (None if there are none)."""
+    clauses = []
+    for field, value in (filters or {}).items():
+        if isinstance(value, dict):
+            # One clause per operator: {"reg_day": {"$gte": a, "$lt": b}} -> two clauses
+            clauses.extend({field: {op: bound}} for op, bound in value.items())
+        else:
+            clauses.append({field: value})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
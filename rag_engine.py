@@ -4,13 +4,48 @@ rag_engine.py — Retrieval-Augmented Generation engine for planning queries
 Handles:
 1. Query embedding and semantic search against ChromaDB (sentence-transformers, local)
 2. Context assembly from retrieved planning records
-3. LLM generation with grounded responses (Anthropic Claude)
+3. LLM generation with grounded responses (Anthropic Claude), blocking or streamed
+4. Semantic answer caching for repeated questions, plus LRU caches of query
+   embeddings and retrieval results (see caches.py)
+5. Routing of count/trend questions to exact aggregates (see aggregates.py)
+6. Radius retrieval for "near X" questions (see geo_index.py)
+7. Token-budgeted context assembly (see context_builder.py)
+8. Optional second-stage re-ranking of over-fetched candidates (see reranker.py)
+9. Per-stage latency and token instrumentation (see metrics.py)
+10. Coalescing of identical questions asked concurrently (see coalescing.py)
+11. Follow-up questions answered from the previous turn's records (see followups.py)
+12. Prompt layout for Anthropic prompt caching (stable prefix first)
+13. Generation deadlines with templated fallback answers (see fallback.py)
+14. Area-level questions answered from precomputed area digests (see digests.py)
 """
 
+import contextvars
+import json
 import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 
+from caches import SemanticAnswerCache, LRUCache
+from coalescing import SingleFlight, flight_key
+from followups import resolve_followup
+from fallback import extractive_answer
+from query_filters import parse_query_filters, build_where, matches_filters
+from ref_index import extract_refs, load_ref_index, lookup_refs
+from lexical_index import load_lexical_index, reciprocal_rank_fusion
+from geo_index import load_geo_index, parse_spatial_query, bounding_box
+from context_builder import assemble_context, record_header
+import metrics
+from reranker import RERANK_MODE, RERANK_CANDIDATES, RERANK_TOP_N, rerank as rerank_candidates
+from aggregates import load_aggregates, plan_aggregate, summarize_aggregate
+from digests import DIGEST_COLLECTION_NAME, digest_id, plan_digest
+from scheduler import INTERACTIVE, BATCH
+
 load_dotenv()
 
 # Also try Streamlit secrets (for cloud deployment)
@@ -25,6 +60,69 @@ CHROMA_DIR = Path("chroma_db")
 COLLECTION_NAME = "dublin_planning"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 TOP_K = 10  # Number of results to retrieve
+MAX_ANSWER_TOKENS = 2000  # Longest answer Claude may write
+
+# Retrieval mode: "vector" (semantic only) or "hybrid" (BM25 + vector, fused with RRF)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", 1.0))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", 1.0))
+RRF_K = 60  # Reciprocal rank fusion constant
+HYBRID_OVERFETCH = 3  # Each side contributes top_k * this many candidates to the fusion
+
+# Semantic answer cache: reuse an answer when a new question embeds within this
+# cosine similarity of a cached one and retrieves exactly the same records
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 256))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))  # seconds
+
+# Exact-match caches for repeated questions whose answer must still be regenerated
+# (e.g. a different chat history): query text -> embedding, and
+# (query text, retrieval options) -> retrieve_context result
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 1024))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 256))
+
+# Answer area-level questions ("what's planned in Stoneybatter?") from one
+# precomputed digest per area and period instead of ten individual records
+AREA_DIGESTS = os.getenv("AREA_DIGESTS", "1").lower() not in ("0", "false", "no")
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 8))  # Concurrent Claude calls in batch_query_planning
+
+# Generation deadlines: past these (or if Claude fails) the answer is a labelled
+# list built from the retrieved records' metadata; 0 waits indefinitely
+FALLBACK_ANSWERS = os.getenv("FALLBACK_ANSWERS", "1").lower() not in ("0", "false", "no")
+FIRST_TOKEN_DEADLINE_S = float(os.getenv("FIRST_TOKEN_DEADLINE_S", 8))  # First token (streaming)
+# Whole answer (query_planning): by default long enough for a full-length answer
+# at a conservative GENERATION_TOKENS_PER_S, so the fallback is for real stalls
+GENERATION_TOKENS_PER_S = 50
+ANSWER_DEADLINE_S = float(os.getenv(
+    "ANSWER_DEADLINE_S", FIRST_TOKEN_DEADLINE_S + MAX_ANSWER_TOKENS / GENERATION_TOKENS_PER_S
+))
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", 32))  # Threads for deadline-bound Claude calls
+
+# Mark the system prompt, prior turns and the record block as cacheable prefixes
+# (Anthropic prompt caching; prefixes shorter than the model minimum are simply not cached)
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "1").lower() not in ("0", "false", "no")
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Identical questions (same normalized text and chat history) asked while one
+# is already being answered wait for and share that answer
+COALESCE_QUERIES = os.getenv("COALESCE_QUERIES", "1").lower() not in ("0", "false", "no")
+
+answer_cache = SemanticAnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL,
+)
+query_flights = SingleFlight()
+embedding_cache = LRUCache(max_entries=EMBEDDING_CACHE_SIZE)
+retrieval_cache = LRUCache(max_entries=RETRIEVAL_CACHE_SIZE)
+pending_answers = LRUCache(max_entries=256)  # answer_id -> Future of a Claude answer that missed its deadline
+
+_digest_collections = {}  # index version -> digest collection
+_digest_collections_lock = threading.Lock()
+
+_generation_executor = None
+_generation_executor_lock = threading.Lock()
 
 # System prompt for the planning assistant
 SYSTEM_PROMPT = """You are an expert Dublin City Council planning permission assistant. You have access to a database of real planning applications from Dublin City Council, covering applications from 2003 to the present day.
@@ -43,127 +141,743 @@ Your role is to answer questions about Dublin planning applications accurately u
 Remember: You are providing factual information from real public records. Be helpful, accurate, and thorough."""
 
 
-def get_collection():
-    """Get the ChromaDB collection with sentence-transformer embeddings."""
-    import chromadb
+@lru_cache(maxsize=1)
+def get_embedding_function():
+    """Load the sentence-transformer embedding function once per process."""
     from chromadb.utils import embedding_functions
     
-    st_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
+    return embedding_functions.SentenceTransformerEmbeddingFunction(
         model_name=EMBEDDING_MODEL
     )
+
+
+def get_collection():
+    """Get the ChromaDB collection with sentence-transformer embeddings."""
+    import chromadb
     
     client = chromadb.PersistentClient(path=str(CHROMA_DIR))
     collection = client.get_collection(
         name=COLLECTION_NAME,
-        embedding_function=st_ef
+        embedding_function=get_embedding_function()
     )
     
     return collection
 
 
-def retrieve_context(query: str, collection=None, top_k: int = TOP_K) -> tuple[str, list[dict]]:
+def get_collection_version(collection) -> str:
+    """Identify the index build a collection came from (set by build_vectordb.py)."""
+    return (collection.metadata or {}).get("built_at", "")
+
+
+def get_digest_collection(collection=None):
+    """The area digest collection written alongside the index (None for indexes built without one)."""
+    import chromadb
+
+    version = get_collection_version(collection) if collection is not None else ""
+    with _digest_collections_lock:
+        if version and version in _digest_collections:
+            return _digest_collections[version]
+    # Opening a client creates chroma.sqlite3, which would make a missing index look built
+    if not CHROMA_DIR.exists() or not any(CHROMA_DIR.iterdir()):
+        return None
+    try:
+        client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+        digests = client.get_collection(name=DIGEST_COLLECTION_NAME, embedding_function=get_embedding_function())
+    except Exception:
+        return None
+    if version and (digests.metadata or {}).get("built_at") != version:
+        return None  # Left over from a different build
+    if version:
+        with _digest_collections_lock:
+            _digest_collections.clear()
+            _digest_collections[version] = digests
+    return digests
+
+
+def clear_digest_collections():
+    """Forget the cached digest collections (after a new index is swapped in)."""
+    with _digest_collections_lock:
+        _digest_collections.clear()
+
+
+def embed_query(query: str) -> list[float]:
+    """Embed a query with the same model used to build the index."""
+    return embed_queries([query])[0]
+
+
+def _cache_text(query: str) -> str:
+    """Cache key for a question: MiniLM lower-cases its input, so case and spacing don't change the embedding."""
+    return " ".join(query.lower().split())
+
+
+def embed_queries(queries: list[str]) -> list[list[float]]:
+    """Embed many queries in one model call (repeated questions come from the embedding cache)."""
+    if not queries:
+        return []
+    with metrics.stage("embed"):
+        keys = [_cache_text(query) for query in queries]
+        embeddings = [embedding_cache.get(key, version=EMBEDDING_MODEL) for key in keys]
+        missing = list(dict.fromkeys(key for key, embedding in zip(keys, embeddings) if embedding is None))
+        hits = sum(embedding is not None for embedding in embeddings)
+        if hits:
+            metrics.count("embedding_cache_hits", hits)
+        if missing:
+            computed = {
+                key: [float(x) for x in embedding]
+                for key, embedding in zip(missing, get_embedding_function()(missing))
+            }
+            for key, embedding in computed.items():
+                embedding_cache.put(key, embedding, version=EMBEDDING_MODEL)
+            embeddings = [computed.get(key, embedding) for key, embedding in zip(keys, embeddings)]
+        return embeddings
+
+
+def search_records(collection, search: dict, top_k: int = TOP_K, where: dict = None) -> list[dict]:
+    """
+    Run one vector search and return result dicts (id, document, metadata, distance, relevance).
+    
+    Args:
+        search: {"query_texts": [...]} or {"query_embeddings": [...]}
+        where: Optional ChromaDB metadata filter
+    """
+    return search_records_batch(collection, search, top_k, where)[0]
+
+
+def search_records_batch(collection, search: dict, top_k: int = TOP_K, where: dict = None) -> list[list[dict]]:
+    """
+    Run a multi-query vector search (one collection.query call) and return
+    one list of result dicts per query text/embedding, in input order.
     """
-    Retrieve relevant planning records for a query.
+    kwargs = {"where": where} if where else {}
+    with metrics.stage("search"):
+        results = collection.query(
+            **search,
+            **kwargs,
+            n_results=top_k,
+            include=["documents", "metadatas", "distances"]
+        )
+    metrics.count("searches")
+    
+    num_queries = len(next(iter(search.values())))
+    if not results or not results['documents']:
+        return [[] for _ in range(num_queries)]
+    
+    return [
+        [
+            {
+                "id": doc_id,
+                "document": doc,
+                "metadata": meta,
+                "distance": dist,
+                "relevance": 1 - dist
+            }
+            for doc_id, doc, meta, dist in zip(
+                results['ids'][i], results['documents'][i], results['metadatas'][i], results['distances'][i]
+            )
+        ]
+        for i in range(num_queries)
+    ]
+
+
+def get_records_by_id(collection, doc_ids: list[str]) -> list[dict]:
+    """Fetch records directly by document ID, in the order given (exact matches, relevance 1.0)."""
+    if not doc_ids:
+        return []
+    results = collection.get(ids=doc_ids, include=["documents", "metadatas"])
+    by_id = {
+        doc_id: (doc, meta)
+        for doc_id, doc, meta in zip(results['ids'], results['documents'], results['metadatas'])
+    }
+    return [
+        {
+            "id": doc_id,
+            "document": by_id[doc_id][0],
+            "metadata": by_id[doc_id][1],
+            "distance": 0.0,
+            "relevance": 1.0
+        }
+        for doc_id in doc_ids if doc_id in by_id
+    ]
+
+
+def lookup_references(query: str, collection) -> list[dict]:
+    """Resolve planning/appeal references in the query via the exact-match index."""
+    refs = extract_refs(query)
+    if not refs:
+        return []
+    with metrics.stage("ref_lookup"):
+        index = load_ref_index(CHROMA_DIR)
+        if index is None:
+            return []
+        return get_records_by_id(collection, lookup_refs(refs, index))
+
+
+def format_context(raw_results: list[dict]) -> str:
+    """Format retrieved records in full as numbered context blocks (no token budget)."""
+    context_parts = []
+    for i, result in enumerate(raw_results):
+        context_parts.append(record_header(i + 1, result))
+        context_parts.append(result['document'])
+        context_parts.append("")
+    return "\n".join(context_parts)
+
+
+def fuse_hybrid(query: str, collection, vector_results: list[dict], filters: dict = None,
+                top_k: int = TOP_K) -> list[dict]:
+    """
+    Fuse vector results with BM25 hits over location/proposal text (reciprocal rank fusion).
+    
+    Lexical-only hits are fetched by ID and must satisfy the same metadata
+    filters as the vector search. Relevance becomes the fused score relative
+    to a record ranked first by both retrievers.
+    """
+    lexical = load_lexical_index(CHROMA_DIR)
+    if lexical is None:
+        return vector_results[:top_k]
+    lexical_hits = lexical.search(query, top_n=top_k * HYBRID_OVERFETCH)
+    if not lexical_hits:
+        return vector_results[:top_k]
+    
+    weights = [HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT]
+    fused = reciprocal_rank_fusion(
+        [[r["id"] for r in vector_results], [doc_id for doc_id, _ in lexical_hits]], weights, k=RRF_K
+    )
+    max_score = sum(weights) / (RRF_K + 1)
+    
+    by_id = {r["id"]: r for r in vector_results}
+    missing = [doc_id for doc_id, _ in fused[:top_k * 2] if doc_id not in by_id]
+    for record in get_records_by_id(collection, missing):
+        if matches_filters(record["metadata"], filters):
+            by_id[record["id"]] = record
+    
+    results = []
+    for doc_id, score in fused:
+        if doc_id not in by_id:
+            continue
+        result = dict(by_id[doc_id])
+        result["relevance"] = score / max_score
+        result["distance"] = 1 - result["relevance"]
+        results.append(result)
+        if len(results) == top_k:
+            break
+    return results
+
+
+def find_nearby(query: str, top_k: int = TOP_K):
+    """
+    Resolve a "near X" / "within 500m of X" question to records around X.
+    
+    The radius widens (up to geo_index.MAX_RADIUS_M) until at least top_k
+    records fall inside it, unless the question gave an explicit radius.
     
     Returns:
-        context_text: Formatted string of retrieved records
-        raw_results: List of result dicts with metadata
+        {"place", "lat", "lon", "radius_m", "distances": {doc_id: metres}} or None
+    """
+    spatial = parse_spatial_query(query)
+    if spatial is None:
+        return None
+    index = load_geo_index(CHROMA_DIR)
+    if index is None or not index.doc_ids:
+        return None  # No located records: plain search
+    min_results = 0 if spatial["explicit_radius"] else top_k
+    hits, radius_m = index.nearby(spatial["lat"], spatial["lon"], spatial["radius_m"], min_results)
+    spatial["radius_m"] = radius_m
+    spatial["distances"] = dict(hits)
+    return spatial
+
+
+def restrict_to_radius(collection, ranked: list[dict], spatial: dict, filters: dict = None,
+                       top_k: int = TOP_K) -> list[dict]:
+    """
+    Keep semantically ranked results that lie inside the search circle, then
+    top up with the nearest in-radius records (matching filters) if short.
+    """
+    distances = spatial["distances"]
+    results = [dict(r) for r in ranked if r["id"] in distances][:top_k]
+    if len(results) < top_k:
+        seen = {r["id"] for r in results}
+        nearest = [doc_id for doc_id in distances if doc_id not in seen][:(top_k - len(results)) * 2]
+        for record in get_records_by_id(collection, nearest):
+            if matches_filters(record["metadata"], filters):
+                record["relevance"] = 0.0
+                record["distance"] = 1.0
+                results.append(record)
+                if len(results) == top_k:
+                    break
+    for result in results:
+        result["distance_m"] = distances[result["id"]]
+        result["near"] = spatial["place"]
+    return results
+
+
+def retrieve_records(query: str, collection=None, top_k: int = TOP_K,
+                     query_embedding: list[float] = None, filters: dict = None,
+                     use_filters: bool = True, mode: str = None, rerank: str = None) -> list[dict]:
+    """
+    Retrieve relevant planning records for a query, best first.
+    
+    Planning/appeal references in the question ("2458/24") are resolved
+    directly from the reference index and skip the vector search. Otherwise,
+    metadata constraints in the question ("refused", "Dublin 8", "appeals",
+    "since 2022", "50+ units", ...) are applied as a ChromaDB `where` filter
+    (ranges on the typed date/size fields); if nothing matches the
+    filter, the search falls back to an unfiltered similarity search. In
+    "hybrid" mode the vector ranking is fused with a BM25 ranking over
+    location and proposal text, which keeps exact street names on top.
+    "Near X" questions are first restricted to records within a radius of
+    X (grid index lookup, bounding box in the `where` filter) and then
+    ranked semantically.
+    
+    Args:
+        query_embedding: Precomputed embedding of the query (skips embedding it again)
+        filters: Explicit metadata constraints (default: parsed from the query)
+        use_filters: Set False to always run a pure similarity search
+        mode: "vector" or "hybrid" (default: RETRIEVAL_MODE)
+        rerank: "off", "features" or "cross-encoder" (default: RERANK_MODE). When on,
+            RERANK_CANDIDATES records are fetched and the best min(top_k, RERANK_TOP_N) kept
+    
+    Returns:
+        List of result dicts (id, document, metadata, distance, relevance)
     """
     if collection is None:
         collection = get_collection()
     
-    results = collection.query(
-        query_texts=[query],
-        n_results=top_k,
-        include=["documents", "metadatas", "distances"]
-    )
-    
-    if not results or not results['documents'] or not results['documents'][0]:
-        return "No relevant planning records found.", []
+    # Exact reference lookup short-circuits the semantic search
+    raw_results = lookup_references(query, collection)
+    if raw_results:
+        return raw_results
     
-    documents = results['documents'][0]
-    metadatas = results['metadatas'][0]
-    distances = results['distances'][0]
+    if query_embedding is None:
+        query_embedding = embed_query(query)  # Through the embedding cache
+    search = {"query_embeddings": [query_embedding]}
     
-    # Format context
-    context_parts = []
+    plan = plan_search(query, top_k, filters, use_filters, mode, rerank)
     raw_results = []
+    if plan["where"]:
+        try:
+            raw_results = search_records(collection, search, plan["fetch_k"], where=plan["where"])
+        except Exception:
+            raw_results = []  # e.g. an older index without the filter fields
+    return finish_search(query, collection, search, plan, raw_results)
+
+
+def plan_search(query: str, top_k: int = TOP_K, filters: dict = None, use_filters: bool = True,
+                mode: str = None, rerank: str = None) -> dict:
+    """
+    Work out the vector search for a query: filters and `where` clause, radius
+    restriction, and how many candidates to fetch for fusion/re-ranking.
+    """
+    if filters is None and use_filters:
+        filters = parse_query_filters(query)
+    with metrics.stage("spatial"):
+        spatial = find_nearby(query, top_k) if use_filters else None
+    if spatial and not spatial["distances"]:
+        spatial = None  # Nothing located near the place: plain search
+    if spatial:
+        filters = {**(filters or {}), **bounding_box(spatial["lat"], spatial["lon"], spatial["radius_m"])}
+    hybrid = (mode or RETRIEVAL_MODE) == "hybrid"
+    rerank = rerank or RERANK_MODE
+    final_k = top_k
+    if rerank != "off":
+        final_k = min(top_k, RERANK_TOP_N)
+        top_k = max(top_k, RERANK_CANDIDATES)
+    # Over-fetch for fusion, and for the circle cut (the bounding box includes its corners),
+    # unless the re-ranker's candidate pool is already an over-fetch
+    fetch_k = top_k * HYBRID_OVERFETCH if (hybrid or spatial) and rerank == "off" else top_k
+    return {
+        "filters": filters,
+        "where": build_where(filters) if use_filters else None,
+        "spatial": spatial,
+        "hybrid": hybrid,
+        "rerank": rerank,
+        "top_k": top_k,
+        "final_k": final_k,
+        "fetch_k": fetch_k,
+    }
+
+
+def finish_search(query: str, collection, search: dict, plan: dict, raw_results: list[dict]) -> list[dict]:
+    """
+    Post-process the filtered vector results of a planned search: unfiltered
+    fallback when nothing matched, hybrid fusion, radius cut and re-ranking.
+    """
+    filters, spatial, top_k = plan["filters"], plan["spatial"], plan["top_k"]
+    if not raw_results:
+        filters = None
+        spatial = None
+        raw_results = search_records(collection, search, plan["fetch_k"])
     
-    for i, (doc, meta, dist) in enumerate(zip(documents, metadatas, distances)):
-        context_parts.append(f"--- Planning Record {i+1} (relevance: {1-dist:.2f}) ---")
-        context_parts.append(doc)
-        context_parts.append("")
-        
-        raw_results.append({
-            "document": doc,
-            "metadata": meta,
-            "distance": dist,
-            "relevance": 1 - dist
-        })
+    if plan["hybrid"]:
+        with metrics.stage("lexical"):
+            raw_results = fuse_hybrid(query, collection, raw_results, filters=filters,
+                                      top_k=plan["fetch_k"] if spatial else top_k)
+    if spatial:
+        with metrics.stage("spatial"):
+            raw_results = restrict_to_radius(collection, raw_results, spatial, filters=filters, top_k=top_k)
+    metrics.count("candidates", len(raw_results))
+    if plan["rerank"] != "off":
+        with metrics.stage("rerank"):
+            raw_results, _ = rerank_candidates(query, raw_results, mode=plan["rerank"], top_n=plan["final_k"])
+    return raw_results
+
+
+def retrieve_records_batch(queries: list[str], collection=None, query_embeddings: list = None,
+                           top_k: int = TOP_K) -> list[list[dict]]:
+    """
+    Retrieve records for many questions at once (same steps as retrieve_records).
     
-    context_text = "\n".join(context_parts)
-    return context_text, raw_results
+    Questions are embedded in one model call (unless embeddings are given) and
+    those sharing a `where` filter go to ChromaDB as one multi-query search.
+    """
+    if collection is None:
+        collection = get_collection()
+    if query_embeddings is None:
+        query_embeddings = embed_queries(queries)
+    
+    results = [lookup_references(query, collection) for query in queries]
+    plans = {}
+    groups = {}  # (where, fetch_k) -> [index]
+    for i, query in enumerate(queries):
+        if results[i]:
+            continue
+        plans[i] = plan_search(query, top_k)
+        key = (json.dumps(plans[i]["where"], sort_keys=True), plans[i]["fetch_k"])
+        groups.setdefault(key, []).append(i)
+    
+    for (_, fetch_k), indices in groups.items():
+        where = plans[indices[0]]["where"]
+        if where:
+            try:
+                batch = search_records_batch(
+                    collection, {"query_embeddings": [query_embeddings[i] for i in indices]}, fetch_k, where
+                )
+            except Exception:
+                batch = [[] for _ in indices]  # e.g. an older index without the filter fields
+        else:
+            batch = [None] * len(indices)  # Unfiltered: searched below
+        for i, raw_results in zip(indices, batch):
+            results[i] = raw_results
+    
+    # Unfiltered searches (no filter, or the filter matched nothing) also go in one call per fetch size
+    unfiltered = {}
+    for i in plans:
+        if not results[i]:
+            unfiltered.setdefault(plans[i]["fetch_k"], []).append(i)
+    for fetch_k, indices in unfiltered.items():
+        batch = search_records_batch(
+            collection, {"query_embeddings": [query_embeddings[i] for i in indices]}, fetch_k
+        )
+        for i, raw_results in zip(indices, batch):
+            results[i] = raw_results
+            plans[i] = {**plans[i], "filters": None, "spatial": None}
+    
+    for i, plan in plans.items():
+        search = {"query_embeddings": [query_embeddings[i]]}
+        results[i] = finish_search(queries[i], collection, search, plan, results[i])
+    return results
 
 
-def generate_response(query: str, context: str, chat_history: list = None) -> str:
-    """Generate response using Anthropic Claude."""
-    from anthropic import Anthropic
+def retrieve_context(query: str, collection=None, top_k: int = TOP_K,
+                     query_embedding: list[float] = None, filters: dict = None,
+                     use_filters: bool = True, mode: str = None, rerank: str = None,
+                     token_budget: int = None) -> tuple[str, list[dict]]:
+    """
+    Retrieve relevant planning records and assemble them into prompt context.
     
-    client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    See retrieve_records for the retrieval arguments. The context is built by
+    context_builder.assemble_context: adaptive k on relevance gaps, near-
+    duplicates folded together, only the lines the question needs, within
+    token_budget (default CONTEXT_TOKEN_BUDGET).
     
+    Returns:
+        context_text: Formatted string of retrieved records
+        raw_results: The result dicts that made it into the context
+    """
+    context, raw_results, _ = _retrieve_and_assemble(
+        query, collection, top_k, query_embedding, filters, use_filters, mode, rerank, token_budget
+    )
+    return context, raw_results
+
+
+def _retrieve_and_assemble(query, collection=None, top_k=TOP_K, query_embedding=None, filters=None,
+                           use_filters=True, mode=None, rerank=None, token_budget=None, use_cache=True):
+    """
+    retrieve_records + _assemble, served from the retrieval cache for repeated
+    questions. Entries are keyed by the question text and every retrieval
+    option, and dropped when the index is rebuilt. use_cache=False bypasses
+    the cache: a partially built index (served with use_cache=False) keeps
+    its final build's version while records are still being added.
+    """
+    if collection is None:
+        collection = get_collection()
+    version = get_collection_version(collection)
+    key = json.dumps([_cache_text(query), top_k, filters, use_filters, mode or RETRIEVAL_MODE,
+                      rerank or RERANK_MODE, token_budget], sort_keys=True, default=str)
+    if use_cache:
+        cached = retrieval_cache.get(key, version=version)
+        metrics.flag("retrieval_cache_hit", cached is not None)
+        if cached is not None:
+            context, raw_results, context_stats = cached
+            metrics.count("context_records", len(raw_results))
+            return context, [dict(r) for r in raw_results], context_stats
+    
+    raw_results = retrieve_records(query, collection, top_k, query_embedding, filters, use_filters, mode, rerank)
+    if filters is None and use_filters:
+        filters = parse_query_filters(query)
+    context, raw_results, context_stats = _assemble(query, raw_results, filters, token_budget)
+    if use_cache:
+        retrieval_cache.put(key, (context, [dict(r) for r in raw_results], context_stats), version=version)
+    return context, raw_results, context_stats
+
+
+def _assemble(query, raw_results, filters=None, token_budget=None):
+    if not raw_results:
+        return "No relevant planning records found.", [], None
+    if filters is None:
+        filters = parse_query_filters(query)
+    with metrics.stage("assemble"):
+        context, used, stats = assemble_context(query, raw_results, filters, budget=token_budget)
+    metrics.count("context_records", len(used))
+    metrics.count("context_tokens", stats["context_tokens"])
+    return context, used, stats
+
+
+def aggregate_context(query: str):
+    """
+    Answer count/trend/ranking questions from the full dataset.
+    
+    Returns formatted statistics for the prompt, or None if the question is
+    not an aggregate question (or no aggregate store has been built).
+    """
+    spec = plan_aggregate(query)
+    if spec is None:
+        return None
+    engine = load_aggregates(CHROMA_DIR)
+    if engine is None:
+        return None
+    return summarize_aggregate(engine, spec)
+
+
+def digest_context(query: str, collection=None):
+    """
+    Answer area-level questions from the precomputed area digests.
+
+    Returns:
+        (context, record_ids) — the digest text(s) and the records they list,
+        or None if the question is not area-level or no digest matches
+    """
+    spec = plan_digest(query)
+    if spec is None:
+        return None
+    digests = get_digest_collection(collection)
+    if digests is None:
+        return None
+    ids = [digest_id(spec["area"], period) for period in spec["periods"]]
+    found = digests.get(ids=ids, include=["documents", "metadatas"])
+    by_id = dict(zip(found["ids"], zip(found["documents"], found["metadatas"])))
+    if len(by_id) < len(ids):
+        # A period band without enough records to digest: fall back to the all-years digest
+        ids = [digest_id(spec["area"], "all")]
+        found = digests.get(ids=ids, include=["documents", "metadatas"])
+        by_id = dict(zip(found["ids"], zip(found["documents"], found["metadatas"])))
+        if not by_id:
+            return None
+    record_ids = []
+    for doc_id in ids:
+        record_ids += [r for r in json.loads(by_id[doc_id][1].get("record_ids", "[]")) if r not in record_ids]
+    metrics.count("digests", len(ids))
+    return "\n\n".join(by_id[doc_id][0] for doc_id in ids), record_ids
+
+
+def _text_block(text: str, cache: bool = False) -> dict:
+    block = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = CACHE_CONTROL
+    return block
+
+
+def build_system(cache: bool = PROMPT_CACHING):
+    """The system prompt, as a cacheable block when prompt caching is on."""
+    return [_text_block(SYSTEM_PROMPT, cache=True)] if cache else SYSTEM_PROMPT
+
+
+def build_messages(query: str, context: str, chat_history: list = None,
+                   context_label: str = "Retrieved Planning Records", cache: bool = PROMPT_CACHING) -> list[dict]:
+    """
+    Build the Messages API conversation: recent chat history plus the grounded question.
+    
+    The request is laid out stable-prefix first: prior turns, then the record
+    block, then the question. With caching on, the system prompt (see
+    build_system), the last prior turn and the record block are cache
+    breakpoints, so a later turn of the same conversation, or another question
+    grounded in the same records, reads its prefix from the provider's prompt
+    cache.
+    """
     messages = []
     
-    # Add chat history if provided
+    # Add chat history if provided (text only; turns may also carry record_ids)
     if chat_history:
         for msg in chat_history[-6:]:
-            messages.append(msg)
+            messages.append({"role": msg["role"], "content": msg["content"]})
+        if cache and messages and isinstance(messages[-1]["content"], str) and messages[-1]["content"]:
+            messages[-1]["content"] = [_text_block(messages[-1]["content"], cache=True)]
     
-    # Create the user message with context
-    user_message = f"""Based on the following Dublin City Council planning records, please answer this question:
+    # Records first (stable across questions that retrieve them), then the question
+    records_text = f"""Here are the Dublin City Council planning records for the question below.
 
-**Question:** {query}
-
-**Retrieved Planning Records:**
-{context}
+**{context_label}:**
+{context}"""
+    question_text = f"""**Question:** {query}
 
 Please provide a clear, accurate answer based on these records. Cite specific planning reference numbers where relevant."""
     
-    messages.append({"role": "user", "content": user_message})
+    messages.append({"role": "user", "content": [
+        _text_block(records_text, cache=cache),
+        _text_block(question_text),
+    ]})
+    return messages
+
+
+def generation_params(query: str, context: str, chat_history: list = None,
+                      context_label: str = "Retrieved Planning Records") -> dict:
+    """Messages API arguments for answering a question (shared by the sync, streaming and async paths)."""
+    return {
+        "purpose": "generation",
+        "system": build_system(),
+        "messages": build_messages(query, context, chat_history, context_label),
+        "temperature": 0.1,
+        "max_tokens": MAX_ANSWER_TOKENS,
+    }
+
+
+def generate_response(query: str, context: str, chat_history: list = None,
+                      context_label: str = "Retrieved Planning Records", priority: str = INTERACTIVE) -> str:
+    """Generate response using Anthropic Claude (via the shared pooled client and rate-limit scheduler)."""
+    from llm_client import create_message, response_text
     
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        system=SYSTEM_PROMPT,
-        messages=messages,
-        temperature=0.1,
-        max_tokens=2000
-    )
+    response = create_message(priority=priority, **generation_params(query, context, chat_history, context_label))
+    return response_text(response)
+
+
+def generate_response_stream(query: str, context: str, chat_history: list = None,
+                             context_label: str = "Retrieved Planning Records"):
+    """Stream the Claude response as text chunks as they are generated."""
+    from llm_client import stream_message
     
-    return response.content[0].text
+    yield from stream_message(**generation_params(query, context, chat_history, context_label))
+
+
+def get_generation_executor() -> ThreadPoolExecutor:
+    """Thread pool running deadline-bound Claude calls (they may outlive the request)."""
+    global _generation_executor
+    if _generation_executor is None:
+        with _generation_executor_lock:
+            if _generation_executor is None:
+                _generation_executor = ThreadPoolExecutor(
+                    max_workers=GENERATION_WORKERS, thread_name_prefix="generation"
+                )
+    return _generation_executor
+
 
+def fallback_answer(query: str, state: dict, reason: str) -> str:
+    """Labelled answer built from the state's records (or statistics) alone."""
+    metrics.flag("fallback", reason)
+    return extractive_answer(query, state["raw_results"], state["route"], state["context"], reason)
 
-def query_planning(query: str, chat_history: list = None, collection=None) -> dict:
+
+def generate_with_deadline(query: str, state: dict, chat_history: list = None,
+                           deadline_s: float = ANSWER_DEADLINE_S) -> tuple:
     """
-    Full RAG pipeline: retrieve context and generate response.
+    Generate the answer, falling back to a templated one if Claude fails or
+    takes longer than deadline_s. A late answer keeps generating in the
+    background: it is stored in the answer cache when eligible and can be
+    collected with wait_for_answer(answer_id).
     
-    Args:
-        query: User's question
-        chat_history: Previous conversation messages
-        collection: ChromaDB collection (optional, will create if not provided)
+    Returns:
+        (answer, fallback_reason, answer_id) — reason None/"timeout"/"error";
+        answer_id only when a late answer is still on its way
+    """
+    if not FALLBACK_ANSWERS:
+        return generate_response(query, state["context"], chat_history, state["context_label"]), None, None
+    
+    context = contextvars.copy_context()
+    future = get_generation_executor().submit(
+        context.run, generate_response, query, state["context"], chat_history, state["context_label"]
+    )
+    try:
+        return future.result(timeout=deadline_s or None), None, None
+    except FutureTimeoutError:
+        answer_id = uuid.uuid4().hex
+        pending_answers.put(answer_id, future)
+        future.add_done_callback(lambda done: _store_late_answer(query, state, done))
+        return fallback_answer(query, state, "timeout"), "timeout", answer_id
+    except Exception as e:
+        metrics.flag("generation_error", type(e).__name__)
+        return fallback_answer(query, state, "error"), "error", None
+
+
+def _store_late_answer(query: str, state: dict, future):
+    if not future.cancelled() and future.exception() is None:
+        store_answer(query, state, future.result())
+
+
+def wait_for_answer(answer_id: str, timeout: float = 0) -> dict:
+    """
+    Collect the Claude answer that replaces a "timeout" fallback.
     
     Returns:
-        dict with 'answer', 'sources', and 'context'
+        {"status": "ready", "answer": str}, {"status": "pending"},
+        {"status": "failed", "error": str} or {"status": "unknown"}
+    """
+    future = pending_answers.get(answer_id)
+    if future is None:
+        return {"status": "unknown"}
+    try:
+        answer = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        return {"status": "pending"}
+    except Exception as e:
+        return {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    return {"status": "ready", "answer": answer}
+
+
+def with_first_token_deadline(chunks, deadline_s: float = FIRST_TOKEN_DEADLINE_S):
     """
-    # Retrieve relevant records
-    context, raw_results = retrieve_context(query, collection=collection)
+    Iterate a text stream on a background thread, yielding None once if the
+    first chunk hasn't arrived within deadline_s (the stream keeps going).
+    """
+    items = queue.Queue()
     
-    # Generate with Claude
-    if not os.getenv("ANTHROPIC_API_KEY"):
-        raise ValueError("ANTHROPIC_API_KEY not found. Set it in .env.")
-    answer = generate_response(query, context, chat_history)
+    def produce():
+        try:
+            for text in chunks:
+                items.put(("text", text))
+            items.put(("end", None))
+        except BaseException as e:
+            items.put(("error", e))
     
-    # Extract source references for citation
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
+    timeout = deadline_s or None
+    while True:
+        try:
+            kind, value = items.get(timeout=timeout)
+        except queue.Empty:
+            timeout = None
+            yield None
+            continue
+        timeout = None
+        if kind == "text":
+            yield value
+        elif kind == "error":
+            raise value
+        else:
+            return
+
+
+def extract_sources(raw_results: list[dict], limit: int = 5) -> list[dict]:
+    """Extract source references for citation from retrieved results."""
     sources = []
-    for result in raw_results[:5]:  # Top 5 sources
+    for result in raw_results[:limit]:
         meta = result['metadata']
         sources.append({
             "ref": meta.get('ref', 'Unknown'),
@@ -174,15 +888,353 @@ def query_planning(query: str, chat_history: list = None, collection=None) -> di
             "land_type": meta.get('land_type', ''),
             "dev_scale": meta.get('dev_scale', ''),
         })
+    return sources
+
+
+def _is_fresh_conversation(chat_history: list = None) -> bool:
+    """True when there are no earlier assistant turns the answer could depend on."""
+    return not any(msg.get("role") == "assistant" for msg in (chat_history or []))
+
+
+def prepare_context(query: str, chat_history: list, collection, use_cache: bool,
+                    query_embedding: list[float] = None, records: list[dict] = None) -> dict:
+    """
+    Build the prompt context for a query and, for fresh conversations, check
+    the semantic answer cache.
     
-    return {
-        "answer": answer,
-        "sources": sources,
+    Follow-ups about the previous answer ("tell me more about the second
+    one", "were any of those appealed?") reuse the records behind the last
+    assistant turn (its "record_ids"), fetched by ID. Count/trend questions
+    are routed to the aggregate engine (exact figures over the full
+    dataset) and area-level questions to the area digests; everything else
+    goes through retrieval, unless
+    already-retrieved records (and their query embedding) are passed in, as
+    batch_query_planning does. Questions naming a planning/appeal reference
+    are answered from the exact-match records without embedding the query.
+    
+    Returns a dict with context, raw_results, route, the cache key parts and any cached answer.
+    """
+    if collection is None:
+        collection = get_collection()
+    
+    followup_ids = resolve_followup(query, chat_history) if records is None else None
+    if followup_ids:
+        with metrics.stage("followup_lookup"):
+            followup_records = get_records_by_id(collection, followup_ids)
+        if followup_records:
+            metrics.flag("route", "followup")
+            context, raw_results, context_stats = _assemble(query, followup_records)
+            return {
+                "context": context,
+                "context_label": "Planning Records From the Previous Answer",
+                "route": "followup",
+                "raw_results": raw_results,
+                "context_stats": context_stats,
+                "cacheable": False,
+                "record_ids": [r["id"] for r in raw_results],
+                "cached_answer": None,
+            }
+    
+    with metrics.stage("aggregate"):
+        stats = aggregate_context(query)
+    if stats is not None:
+        metrics.flag("route", "aggregate")
+        return {
+            "context": stats,
+            "context_label": "Computed Statistics (full dataset)",
+            "route": "aggregate",
+            "raw_results": [],
+            "context_stats": None,
+            "cacheable": False,
+            "record_ids": [],
+            "cached_answer": None,
+        }
+    
+    if AREA_DIGESTS:
+        with metrics.stage("digest_lookup"):
+            digest = digest_context(query, collection)
+            listed = get_records_by_id(collection, digest[1]) if digest else []
+        if digest is not None:
+            metrics.flag("route", "digest")
+            return {
+                "context": digest[0],
+                "context_label": "Area Digest (precomputed from all records in the area)",
+                "route": "digest",
+                "raw_results": listed,
+                "context_stats": None,
+                "cacheable": False,
+                "record_ids": [r["id"] for r in listed],
+                "cached_answer": None,
+            }
+    
+    metrics.flag("route", "retrieval")
+    cacheable = use_cache and _is_fresh_conversation(chat_history)
+    referenced = lookup_references(query, collection) if records is None else []
+    embedding = query_embedding
+    if referenced:
+        # Exact reference matches need no embedding (and so skip the semantic answer cache)
+        cacheable = False
+        context, raw_results, context_stats = _assemble(query, referenced)
+    else:
+        # Embedded here (rather than inside the Chroma query) so the two are timed separately
+        if embedding is None:
+            embedding = embed_query(query)
+        if records is None:
+            context, raw_results, context_stats = _retrieve_and_assemble(
+                query, collection=collection, query_embedding=embedding, use_cache=use_cache
+            )
+        else:
+            context, raw_results, context_stats = _assemble(query, records)
+    
+    state = {
         "context": context,
-        "num_results": len(raw_results)
+        "context_label": "Retrieved Planning Records",
+        "route": "retrieval",
+        "raw_results": raw_results,
+        "context_stats": context_stats,
+        "cacheable": cacheable,
+        "embedding": embedding,
+        "record_ids": [r["id"] for r in raw_results],
+        "version": get_collection_version(collection),
+        "cached_answer": None,
+    }
+    if cacheable:
+        with metrics.stage("cache_lookup"):
+            payload, _ = answer_cache.lookup(embedding, state["record_ids"], version=state["version"])
+        if payload is not None:
+            state["cached_answer"] = payload["answer"]
+        metrics.flag("cache_hit", payload is not None)
+    return state
+
+
+def store_answer(query: str, state: dict, answer: str):
+    """Store a freshly generated answer in the semantic cache when eligible."""
+    if state["cacheable"] and state["raw_results"]:
+        answer_cache.store(
+            query, state["embedding"], state["record_ids"], {"answer": answer}, version=state["version"]
+        )
+
+
+def context_summary(state: dict) -> dict:
+    """Sources and context details returned alongside an answer."""
+    return {
+        "sources": extract_sources(state["raw_results"]),
+        "context": state["context"],
+        "num_results": len(state["raw_results"]),
+        "cached": state["cached_answer"] is not None,
+        "route": state["route"],
+        "context_stats": state["context_stats"],
+        "record_ids": state["record_ids"],
     }
 
 
+def query_planning(query: str, chat_history: list = None, collection=None, use_cache: bool = True) -> dict:
+    """
+    Full RAG pipeline: retrieve context and generate response.
+    
+    Args:
+        query: User's question
+        chat_history: Previous conversation messages; assistant turns may carry the
+            'record_ids' returned for them, so follow-ups can reuse those records
+        collection: ChromaDB collection (optional, will create if not provided)
+        use_cache: Serve repeated questions from the semantic answer cache and
+            the retrieval cache (False while serving a partially built index)
+    
+    Returns:
+        dict with 'answer', 'sources', 'context', 'num_results', 'cached',
+        'route' ("retrieval", "aggregate" for count/trend questions, "digest"
+        for area-level questions, or "followup" when the previous answer's
+        records were reused),
+        'record_ids' (IDs of the records in the context),
+        'context_stats' (prompt tokens before/after context assembly, or None),
+        'metrics' (per-stage timings in ms, counts, token usage, cache hit),
+        'coalesced' (True when the answer was shared with an identical in-flight question),
+        'fallback' (None, or "timeout"/"error" when the answer is a templated list
+        built from the records because Claude missed ANSWER_DEADLINE_S or failed) and
+        'answer_id' (after a timeout: pass to wait_for_answer for Claude's answer)
+    """
+    if not COALESCE_QUERIES:
+        return {**_query_planning(query, chat_history, collection, use_cache), "coalesced": False}
+    if collection is None:
+        collection = get_collection()
+    result, shared = query_flights.do(
+        # Keyed by index version so a question never shares an answer across an index swap
+        flight_key(query, chat_history, "answer", use_cache, get_collection_version(collection)),
+        lambda: _query_planning(query, chat_history, collection, use_cache),
+    )
+    return {**result, "coalesced": shared}
+
+
+def _query_planning(query: str, chat_history: list, collection, use_cache: bool) -> dict:
+    with metrics.trace_query(query) as trace:
+        # Retrieve relevant records (and check the answer cache)
+        state = prepare_context(query, chat_history, collection, use_cache)
+        context = state["context"]
+        
+        answer = state["cached_answer"]
+        fallback = answer_id = None
+        if answer is None:
+            # Generate with Claude
+            if not os.getenv("ANTHROPIC_API_KEY"):
+                raise ValueError("ANTHROPIC_API_KEY not found. Set it in .env.")
+            with metrics.stage("generate"):
+                answer, fallback, answer_id = generate_with_deadline(query, state, chat_history)
+            if fallback is None:
+                store_answer(query, state, answer)
+    
+    return {
+        "answer": answer, **context_summary(state), "metrics": trace.final,
+        "fallback": fallback, "answer_id": answer_id,
+    }
+
+
+def stream_query_planning(query: str, chat_history: list = None, collection=None, use_cache: bool = True):
+    """
+    Streaming RAG pipeline: yields the retrieved sources immediately, then
+    answer tokens as Claude generates them.
+    
+    Yields event dicts, in order:
+        {"type": "sources", "sources": [...], "context": str, "num_results": int,
+         "cached": bool, "route": str, "context_stats": dict | None, "record_ids": [...]}
+        {"type": "fallback", "reason": str, "answer": str}   (only if Claude is late or fails)
+        {"type": "token", "text": str}   (repeated; a single token on a cache hit)
+        {"type": "done", "answer": str, "fallback": str | None, "metrics": dict, "coalesced": bool}
+    
+    If no token arrives within FIRST_TOKEN_DEADLINE_S, a templated answer
+    built from the records is sent as a "fallback" event; Claude's tokens
+    replace it if they follow. If Claude fails before its first token, the
+    fallback is the answer (done["fallback"] says why).
+    
+    An identical question already streaming (same normalized text, chat
+    history and index version) is not run twice: this call replays its events instead.
+    """
+    if not os.getenv("ANTHROPIC_API_KEY"):
+        raise ValueError("ANTHROPIC_API_KEY not found. Set it in .env.")
+    
+    def make_events():
+        return _stream_query_planning(query, chat_history, collection, use_cache)
+    
+    if not COALESCE_QUERIES:
+        events, shared = make_events(), False
+    else:
+        if collection is None:
+            collection = get_collection()
+        key = flight_key(query, chat_history, "stream", use_cache, get_collection_version(collection))
+        events, shared = query_flights.stream(key, make_events)
+    for event in events:
+        if event["type"] == "done":
+            event = {**event, "coalesced": shared}
+        yield event
+
+
+def _stream_query_planning(query: str, chat_history: list, collection, use_cache: bool):
+    with metrics.trace_query(query) as trace:
+        state = prepare_context(query, chat_history, collection, use_cache)
+        context = state["context"]
+        answer = state["cached_answer"]
+        yield {"type": "sources", **context_summary(state)}
+        
+        fallback = None
+        if answer is not None:
+            yield {"type": "token", "text": answer}
+        else:
+            answer_parts = []
+            chunks = generate_response_stream(query, context, chat_history, state["context_label"])
+            if FALLBACK_ANSWERS and FIRST_TOKEN_DEADLINE_S:
+                chunks = with_first_token_deadline(chunks, FIRST_TOKEN_DEADLINE_S)
+            with metrics.stage("generate"):
+                try:
+                    for text in chunks:
+                        if text is None:  # Deadline passed: show the records while Claude catches up
+                            yield {"type": "fallback", "reason": "timeout",
+                                   "answer": fallback_answer(query, state, "timeout")}
+                            continue
+                        if not answer_parts:
+                            metrics.flag("first_token_ms", round((time.perf_counter() - trace.started) * 1000, 2))
+                        answer_parts.append(text)
+                        yield {"type": "token", "text": text}
+                except Exception as e:
+                    if answer_parts or not FALLBACK_ANSWERS:
+                        raise
+                    metrics.flag("generation_error", type(e).__name__)
+                    fallback = "error"
+                    answer = fallback_answer(query, state, "error")
+                    yield {"type": "fallback", "reason": "error", "answer": answer}
+            if fallback is None:
+                answer = "".join(answer_parts)
+                store_answer(query, state, answer)
+    
+    yield {"type": "done", "answer": answer, "fallback": fallback, "metrics": trace.final}
+
+
+def batch_query_planning(queries: list[str], collection=None, use_cache: bool = True,
+                         max_workers: int = BATCH_WORKERS) -> list[dict]:
+    """
+    Answer many independent questions (no chat history) with shared overhead.
+    
+    All retrieval questions are embedded in one model call and searched with
+    multi-query ChromaDB calls (see retrieve_records_batch); each question
+    is then routed by prepare_context like query_planning (aggregate, digest
+    or retrieval) and answered on up to max_workers threads, at batch
+    priority (queued behind interactive questions when rate limits bind).
+    Every question gets its own metrics trace; the shared embedding/search
+    time is recorded on it as "batch_retrieval".
+    
+    Returns:
+        One dict per question, in input order: {"query", "ok", "result"} on
+        success (result as from query_planning) or {"query", "ok", "error"}
+    """
+    if collection is None:
+        collection = get_collection()
+    items = [{"query": query, "ok": False} for query in queries]
+    
+    # Shared retrieval for everything that isn't a count/trend or area-level question
+    retrieval = [
+        i for i, query in enumerate(queries)
+        if plan_aggregate(query) is None and not (AREA_DIGESTS and plan_digest(query) is not None)
+    ]
+    records, embeddings = {}, {}
+    started = time.perf_counter()
+    try:
+        batch_embeddings = embed_queries([queries[i] for i in retrieval])
+        batch_records = retrieve_records_batch(
+            [queries[i] for i in retrieval], collection, query_embeddings=batch_embeddings
+        )
+        for i, embedding, raw_results in zip(retrieval, batch_embeddings, batch_records):
+            embeddings[i], records[i] = embedding, raw_results
+    except Exception:
+        pass  # Fall back to per-question retrieval in prepare_context
+    batch_ms = (time.perf_counter() - started) * 1000
+    
+    def answer(i):
+        query = queries[i]
+        with metrics.trace_query(query) as trace:
+            if i in records:
+                trace.add_time("batch_retrieval", batch_ms)
+            state = prepare_context(
+                query, None, collection, use_cache,
+                query_embedding=embeddings.get(i), records=records.get(i)
+            )
+            text = state["cached_answer"]
+            if text is None:
+                if not os.getenv("ANTHROPIC_API_KEY"):
+                    raise ValueError("ANTHROPIC_API_KEY not found. Set it in .env.")
+                with metrics.stage("generate"):
+                    text = generate_response(query, state["context"], None, state["context_label"], priority=BATCH)
+                store_answer(query, state, text)
+        return {"answer": text, **context_summary(state), "metrics": trace.final}
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(answer, i) for i in range(len(queries))]
+        for item, future in zip(items, futures):
+            try:
+                item["result"] = future.result()
+                item["ok"] = True
+            except Exception as e:
+                item["error"] = f"{type(e).__name__}: {e}"
+    return items
+
+
 # Quick test
 if __name__ == "__main__":
     print("Testing RAG engine...")
@@ -202,4 +1254,7 @@ if __name__ == "__main__":
         result = query_planning(query, collection=collection)
         print(f"A: {result['answer'][:500]}...")
         print(f"Sources: {len(result['sources'])} records retrieved")
+        if result['context_stats']:
+            print(f"Context: {result['context_stats']['context_tokens']} tokens "
+                  f"({result['context_stats']['tokens_saved']} saved)")
         print()
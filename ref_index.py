@@ -0,0 +1,93 @@
+"""
+ref_index.py — Exact-match lookup index for planning and appeal references
+
+Users often paste a reference such as "2458/24" or "ABP-312345-22". Embedding
+an identifier and running a semantic search is slow and unreliable, so
+build_vectordb.py also writes a small JSON index mapping every normalised
+planning reference and appeal reference to its ChromaDB document ID(s).
+Queries containing reference patterns resolve with a dict lookup.
+"""
+
+import json
+import re
+import threading
+from pathlib import Path
+
+REF_INDEX_FILE = "ref_index.json"  # Stored alongside the ChromaDB files
+
+# Dublin City Council refs: "2458/24", "WEB1234/24", "DSDZ3456/20", "0123/03"
+_PLANNING_REF_RE = re.compile(r"\b(?:[A-Z]{2,5})?\d{3,5}/\d{2}\b", re.IGNORECASE)
+# An Bord Pleanála refs: "ABP-312345-22", "ABP 312345-22", "PL29S.123456", "PL 29N.234567"
+_APPEAL_REF_RE = re.compile(
+    r"\bABP[-\s]?\d{6}[-\s]?\d{2}\b|\bPL\s?\d{2}[A-Z]?\s?\.\s?\d{5,6}\b", re.IGNORECASE
+)
+
+_cache = {"path": None, "mtime": None, "index": None}
+_cache_lock = threading.Lock()
+
+
+def normalize_ref(ref: str) -> str:
+    """Normalise a reference for lookup: uppercase, no spaces, dashes or dots."""
+    return re.sub(r"[\s\-.]", "", (ref or "").upper())
+
+
+def extract_refs(text: str) -> list[str]:
+    """Find planning and appeal references in free text (normalised, in order, unique)."""
+    found = []
+    for pattern in (_PLANNING_REF_RE, _APPEAL_REF_RE):
+        for match in pattern.finditer(text or ""):
+            ref = normalize_ref(match.group(0))
+            if ref not in found:
+                found.append(ref)
+    return found
+
+
+def build_ref_index(entries, version: str = "") -> dict:
+    """
+    Build the index from (doc_id, ref, appeal_refs) tuples.
+
+    Returns:
+        {"version": ..., "refs": {ref: [doc_ids]}, "appeal_refs": {ref: [doc_ids]}}
+    """
+    refs, appeal_refs = {}, {}
+    for doc_id, ref, record_appeal_refs in entries:
+        if ref:
+            refs.setdefault(normalize_ref(ref), []).append(doc_id)
+        for appeal_ref in record_appeal_refs:
+            if appeal_ref:
+                ids = appeal_refs.setdefault(normalize_ref(appeal_ref), [])
+                if doc_id not in ids:
+                    ids.append(doc_id)
+    return {"version": version, "refs": refs, "appeal_refs": appeal_refs}
+
+
+def save_ref_index(index: dict, chroma_dir: Path):
+    """Write the index next to the vector database."""
+    path = Path(chroma_dir) / REF_INDEX_FILE
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    return path
+
+
+def load_ref_index(chroma_dir: Path):
+    """Load the index (cached in memory, reloaded when the file changes). None if missing."""
+    path = Path(chroma_dir) / REF_INDEX_FILE
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    with _cache_lock:
+        if _cache["path"] != path or _cache["mtime"] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                _cache.update(path=path, mtime=mtime, index=json.load(f))
+        return _cache["index"]
+
+
+def lookup_refs(refs: list[str], index: dict) -> list[str]:
+    """Resolve normalised references to document IDs (planning refs first, then appeal refs)."""
+    doc_ids = []
+    for ref in refs:
+        for doc_id in index["refs"].get(ref, []) + index["appeal_refs"].get(ref, []):
+            if doc_id not in doc_ids:
+                doc_ids.append(doc_id)
+    return doc_ids
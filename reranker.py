@@ -0,0 +1,151 @@
+"""
+reranker.py — Second-stage re-ranking of over-fetched retrieval candidates
+
+With RERANK_MODE set, retrieve_records over-fetches RERANK_CANDIDATES records
+from the vector/hybrid index and this module re-orders them on CPU so only
+the best RERANK_TOP_N reach the prompt:
+
+- "features": a fast scorer over first-stage relevance, query-term overlap
+  with the record's location and proposal, neighbourhood match and (for
+  "recent"/"latest" questions) registration date
+- "cross-encoder": the feature order refined by a small cross-encoder
+  (ms-marco-MiniLM-L-6-v2) scored in batches until RERANK_BUDGET_MS is
+  spent; candidates not reached keep their feature order
+
+See benchmark_rerank.py for added latency vs. prompt tokens saved.
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+from lexical_index import tokenize
+from gazetteer import find_places, record_place
+
+RERANK_MODE = os.getenv("RERANK_MODE", "off")  # "off", "features" or "cross-encoder"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 50))  # First-stage over-fetch
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", 6))  # Records kept after re-ranking
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 150))  # Cross-encoder time budget per query
+RERANK_BATCH_SIZE = 16
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Weights of the feature scorer (sum to 1 so scores stay in 0..1)
+FEATURE_WEIGHTS = {"relevance": 0.5, "overlap": 0.3, "place": 0.15, "recency": 0.05}
+
+_RECENT_RE = re.compile(r"\b(recent\w*|latest|newest|new|this year|last year)\b", re.I)
+
+_totals = {"queries": 0, "candidates": 0, "rerank_ms": 0.0, "budget_exceeded": 0}
+_totals_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def get_cross_encoder():
+    """Load the cross-encoder once per process."""
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(CROSS_ENCODER_MODEL, max_length=256)
+
+
+def _record_text(result: dict) -> str:
+    meta = result.get("metadata", {})
+    return f"{meta.get('location', '')}. {meta.get('proposal_short', '')}. Decision: {meta.get('decision', '')}"
+
+
+def feature_scores(query: str, candidates: list[dict]) -> list[float]:
+    """Score all candidates in one pass (0..1, higher is better)."""
+    query_terms = set(tokenize(query))
+    query_places = set(find_places(query))
+    wants_recent = bool(_RECENT_RE.search(query))
+    days = [c["metadata"].get("reg_day") for c in candidates]
+    known_days = [d for d in days if d is not None]
+    first_day, last_day = (min(known_days), max(known_days)) if known_days else (0, 0)
+
+    scores = []
+    for candidate, day in zip(candidates, days):
+        meta = candidate["metadata"]
+        features = {"relevance": min(max(candidate["relevance"], 0.0), 1.0)}
+        if query_terms:
+            record_terms = set(tokenize(f"{meta.get('location', '')} {meta.get('proposal_short', '')}"))
+            features["overlap"] = len(query_terms & record_terms) / len(query_terms)
+        if query_places:
+            features["place"] = 1.0 if record_place(meta.get("location", "")) in query_places else 0.0
+        if wants_recent and day is not None and last_day > first_day:
+            features["recency"] = (day - first_day) / (last_day - first_day)
+        scores.append(sum(FEATURE_WEIGHTS[name] * value for name, value in features.items()))
+    return scores
+
+
+def cross_encoder_scores(query: str, candidates: list[dict], deadline: float) -> list[float]:
+    """
+    Cross-encoder scores (0..1) for candidates in order, batch by batch, until
+    the deadline (time.perf_counter() value). Candidates not reached are omitted.
+    """
+    model = get_cross_encoder()
+    scores = []
+    for start in range(0, len(candidates), RERANK_BATCH_SIZE):
+        if scores and time.perf_counter() >= deadline:
+            break
+        batch = candidates[start:start + RERANK_BATCH_SIZE]
+        logits = model.predict([(query, _record_text(c)) for c in batch], batch_size=RERANK_BATCH_SIZE)
+        scores.extend(1 / (1 + math.exp(-float(logit))) for logit in logits)
+    return scores
+
+
+def rerank(query: str, candidates: list[dict], mode: str = None, top_n: int = RERANK_TOP_N,
+           budget_ms: float = RERANK_BUDGET_MS) -> tuple[list[dict], dict]:
+    """
+    Re-order candidates and keep the best top_n.
+
+    Each returned result's relevance becomes its re-rank score (the first-stage
+    value is kept as first_stage_relevance).
+
+    Returns:
+        (results, stats) — stats: mode, candidates, scored, rerank_ms, budget_exceeded
+    """
+    mode = mode or RERANK_MODE
+    started = time.perf_counter()
+    stats = {"mode": mode, "candidates": len(candidates), "scored": 0,
+             "rerank_ms": 0.0, "budget_exceeded": False}
+    if mode == "off" or not candidates:
+        return candidates[:top_n], stats
+
+    scores = feature_scores(query, candidates)
+    order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+    ranked = [(scores[i], candidates[i]) for i in order]
+    stats["scored"] = len(ranked)
+
+    if mode == "cross-encoder":
+        deadline = started + budget_ms / 1000
+        ce_scores = cross_encoder_scores(query, [c for _, c in ranked], deadline)
+        stats["scored"] = len(ce_scores)
+        stats["budget_exceeded"] = len(ce_scores) < len(ranked)
+        scored = sorted(zip(ce_scores, (c for _, c in ranked)), key=lambda item: item[0], reverse=True)
+        # Candidates the budget didn't reach rank below every scored one
+        floor = scored[-1][0] if scored else 1.0
+        ranked = scored + [(min(score, floor), c) for score, c in ranked[len(ce_scores):]]
+
+    results = []
+    for score, candidate in ranked[:top_n]:
+        result = dict(candidate)
+        result["first_stage_relevance"] = candidate["relevance"]
+        result["relevance"] = score
+        result["distance"] = 1 - score
+        results.append(result)
+
+    stats["rerank_ms"] = (time.perf_counter() - started) * 1000
+    with _totals_lock:
+        _totals["queries"] += 1
+        _totals["candidates"] += len(candidates)
+        _totals["rerank_ms"] += stats["rerank_ms"]
+        _totals["budget_exceeded"] += stats["budget_exceeded"]
+    return results, stats
+
+
+def get_rerank_stats() -> dict:
+    """Running totals for re-ranked queries."""
+    with _totals_lock:
+        totals = dict(_totals)
+    totals["avg_rerank_ms"] = (totals["rerank_ms"] / totals["queries"]) if totals["queries"] else 0.0
+    return totals
@@ -0,0 +1,224 @@
+"""
+scheduler.py — Rate-limit-aware admission of LLM calls
+
+Every Claude call (see llm_client.py) passes through one process-wide
+scheduler before it is sent:
+
+- token buckets for requests per minute and tokens per minute, refilled
+  continuously; a call is admitted once both can cover it (token cost is
+  estimated up front and settled against the real usage afterwards)
+- a priority queue: interactive questions always go ahead of batch work
+  (evaluation, batch_query_planning), first come first served within a
+  priority
+- rate-limit responses (429, 529 overloaded) pause admission for everyone
+  for the backoff period, so a burst queues instead of cascading into more
+  rejections
+- queue depth and wait times per priority, for /metrics
+
+A budget of 0 means unlimited; the queue then only forms during backoff.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 30.0
+ASYNC_POLL_S = 0.05  # How often an async waiter re-checks the buckets
+WAIT_LOG_SIZE = 500  # Recent waits kept per priority for stats
+
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """Exponential backoff with jitter; honours the server's retry-after when given."""
+    if retry_after is not None and retry_after > 0:
+        return min(retry_after, BACKOFF_MAX_S)
+    delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class _Ticket:
+    __slots__ = ("priority", "tokens", "enqueued")
+
+    def __init__(self, priority: str, tokens: int):
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+
+
+class RateLimitScheduler:
+    """Token-bucket RPM/TPM limits with a priority queue, shared by threads and event loops."""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority rank, seq, ticket)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self.configure(rpm, tpm)
+        self.reset_stats()
+
+    def configure(self, rpm: float = 0, tpm: float = 0):
+        """Set the per-minute budgets (0 = unlimited); the buckets start full."""
+        with self._cond:
+            self.rpm = float(rpm or 0)
+            self.tpm = float(tpm or 0)
+            self._requests = self.rpm
+            self._tokens = self.tpm
+            self._refilled = time.monotonic()
+            self._cond.notify_all()
+
+    # ── Buckets ────────────────────────────────────────────────
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled
+        self._refilled = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _delay(self, ticket: _Ticket, now: float) -> float:
+        """Seconds until the buckets (and any backoff pause) allow this ticket; 0 = now."""
+        delay = max(0.0, self._paused_until - now)
+        if self.rpm and self._requests < 1:
+            delay = max(delay, (1 - self._requests) * 60 / self.rpm)
+        if self.tpm:
+            cost = min(ticket.tokens, self.tpm)  # A call larger than the whole budget waits for a full bucket
+            if self._tokens < cost:
+                delay = max(delay, (cost - self._tokens) * 60 / self.tpm)
+        return delay
+
+    def _try_admit(self, ticket: _Ticket) -> float:
+        """Admit the ticket if it heads the queue and the buckets allow; else seconds to wait (None = not head)."""
+        now = time.monotonic()
+        self._refill(now)
+        if not self._queue or self._queue[0][2] is not ticket:
+            return None
+        delay = self._delay(ticket, now)
+        if delay > 0:
+            return delay
+        heapq.heappop(self._queue)
+        if self.rpm:
+            self._requests -= 1
+        if self.tpm:
+            self._tokens -= ticket.tokens
+        waited = now - ticket.enqueued
+        self._waits[ticket.priority].append(waited)
+        self._counts["admitted"] += 1
+        if waited > 0.001:
+            self._counts["throttled"] += 1
+        self._cond.notify_all()  # The next ticket is now head
+        return 0.0
+
+    def _enqueue(self, priority: str, tokens: int) -> _Ticket:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r} (expected one of {', '.join(PRIORITIES)})")
+        ticket = _Ticket(priority, max(0, int(tokens)))
+        heapq.heappush(self._queue, (PRIORITIES[priority], next(self._seq), ticket))
+        self._cond.notify_all()  # A new head may have arrived
+        return ticket
+
+    def _abandon(self, ticket: _Ticket):
+        for i, entry in enumerate(self._queue):
+            if entry[2] is ticket:
+                self._queue.pop(i)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                return
+
+    # ── Admission ──────────────────────────────────────────────
+
+    def acquire(self, priority: str = INTERACTIVE, tokens: int = 0) -> float:
+        """
+        Block until a call of roughly `tokens` tokens may be sent.
+
+        Returns:
+            Seconds spent queued
+        """
+        with self._cond:
+            ticket = self._enqueue(priority, tokens)
+            try:
+                while True:
+                    delay = self._try_admit(ticket)
+                    if delay == 0:
+                        return time.monotonic() - ticket.enqueued
+                    self._cond.wait(delay)
+            except BaseException:
+                self._abandon(ticket)
+                raise
+
+    async def aacquire(self, priority: str = INTERACTIVE, tokens: int = 0) -> float:
+        """acquire() for coroutines: waits without blocking the event loop."""
+        with self._cond:
+            ticket = self._enqueue(priority, tokens)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_admit(ticket)
+                if delay == 0:
+                    return time.monotonic() - ticket.enqueued
+                await asyncio.sleep(min(delay or ASYNC_POLL_S, ASYNC_POLL_S))
+        except BaseException:
+            with self._cond:
+                self._abandon(ticket)
+            raise
+
+    def settle(self, estimated: int, actual: int):
+        """Correct the token bucket once a call's real usage is known (refunds over-estimates)."""
+        if not self.tpm:
+            return
+        with self._cond:
+            self._tokens = min(self.tpm, self._tokens + estimated - actual)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Hold all admissions for a while (after a 429/529 from the provider)."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._counts["rate_limited"] += 1
+            self._cond.notify_all()
+
+    def record_retry(self):
+        with self._cond:
+            self._counts["retries"] += 1
+
+    # ── Stats ──────────────────────────────────────────────────
+
+    def reset_stats(self):
+        with self._cond:
+            self._waits = {p: deque(maxlen=WAIT_LOG_SIZE) for p in PRIORITIES}
+            self._counts = {"admitted": 0, "throttled": 0, "rate_limited": 0, "retries": 0}
+
+    def stats(self) -> dict:
+        """Budgets, queue depth per priority, wait times (ms) per priority and admission counts."""
+        with self._cond:
+            depth = {p: 0 for p in PRIORITIES}
+            for _, _, ticket in self._queue:
+                depth[ticket.priority] += 1
+            waits = {p: sorted(w) for p, w in self._waits.items()}
+            counts = dict(self._counts)
+            paused = max(0.0, self._paused_until - time.monotonic())
+        wait_ms = {
+            p: {
+                "avg": round(sum(w) / len(w) * 1000, 1) if w else 0.0,
+                "p95": round(w[min(len(w) - 1, int(len(w) * 0.95))] * 1000, 1) if w else 0.0,
+                "max": round(w[-1] * 1000, 1) if w else 0.0,
+            }
+            for p, w in waits.items()
+        }
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": depth,
+            "wait_ms": wait_ms,
+            "paused_for_s": round(paused, 2),
+            **counts,
+        }
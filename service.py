@@ -0,0 +1,388 @@
+"""
+service.py — HTTP/JSON query service around the RAG engine
+
+Loads the embedding model and ChromaDB collection once and serves many
+clients from a fixed pool of worker threads, so other tools can use the same
+warm index instead of each loading MiniLM.
+
+Endpoints:
+    POST /query          {"query": str, "chat_history": [...], "use_cache": bool} -> query_planning result
+                         (chat_history turns may include the "record_ids" of earlier results)
+    POST /query/stream   same body; server-sent events (sources, token..., done)
+    POST /batch          {"queries": [str, ...]} -> {"results": [...]} (batch_query_planning)
+    POST /retrieve       {"query": str, "top_k": int} -> matching records, no LLM call
+    GET  /answer/<id>    Claude's answer replacing a "timeout" fallback ({"status": "ready"|"pending"|...}),
+                         ?wait=<seconds> to wait for it
+    GET  /health         readiness, record count and index version
+    GET  /metrics        service, LLM, LLM queue, context, cache, coalescing, re-rank and per-stage latency statistics
+    GET  /metrics/prometheus  per-stage latency histograms in Prometheus text format
+
+Usage:
+    python service.py --port 8000 --workers 16
+
+Load-test locally against the stand-in LLM (see fake_llm.py):
+    python fake_llm.py --latency 0.5 &
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 ANTHROPIC_API_KEY=test python service.py
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import metrics
+
+DEFAULT_PORT = 8000
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", 16))  # Concurrent requests handled
+MAX_BATCH_SIZE = 200  # Questions accepted per /batch request
+MAX_TOP_K = 100  # Largest "top_k" accepted by /retrieve
+CHAT_ROLES = ("user", "assistant")
+
+_state = {"collection": None, "version": "", "started": time.time(), "ready": False, "workers": SERVICE_WORKERS}
+_metrics = {"requests": {}, "errors": 0, "in_flight": 0, "peak_in_flight": 0, "latency_ms": {}}
+_metrics_lock = threading.Lock()
+
+
+def warm_up():
+    """Open the collection (restoring a snapshot if there is no index) and load the embedding model before accepting traffic."""
+    from rag_engine import get_collection, get_collection_version, embed_query
+    from snapshot import restore_if_missing
+
+    restored = restore_if_missing()
+    if restored:
+        print(f"  Restored index snapshot built {restored.get('built_at', '?')}")
+    collection = get_collection()
+    embed_query("warm up")
+    _state.update(collection=collection, version=get_collection_version(collection), ready=True)
+    return collection
+
+
+def request_options_error(body: dict):
+    """Why the optional request fields (top_k, chat_history, use_cache) are invalid, or None."""
+    top_k = body.get("top_k")
+    if top_k is not None and (isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K):
+        return f'"top_k" must be an integer from 1 to {MAX_TOP_K}'
+    if "use_cache" in body and not isinstance(body["use_cache"], bool):
+        return '"use_cache" must be true or false'
+    history = body.get("chat_history")
+    if history is not None:
+        if not isinstance(history, list):
+            return '"chat_history" must be a list of {"role", "content"} objects'
+        for i, turn in enumerate(history):
+            if (not isinstance(turn, dict) or turn.get("role") not in CHAT_ROLES
+                    or not isinstance(turn.get("content"), str)):
+                return f'"chat_history"[{i}] must be an object with "role" ({" or ".join(CHAT_ROLES)}) and "content" strings'
+            record_ids = turn.get("record_ids")
+            if record_ids is not None and (not isinstance(record_ids, list)
+                                           or not all(isinstance(r, str) for r in record_ids)):
+                return f'"chat_history"[{i}]["record_ids"] must be a list of strings'
+    return None
+
+
+def _record_request(endpoint: str, started: float, ok: bool):
+    elapsed = (time.perf_counter() - started) * 1000
+    with _metrics_lock:
+        _metrics["requests"][endpoint] = _metrics["requests"].get(endpoint, 0) + 1
+        total, count = _metrics["latency_ms"].get(endpoint, (0.0, 0))
+        _metrics["latency_ms"][endpoint] = (total + elapsed, count + 1)
+        if not ok:
+            _metrics["errors"] += 1
+
+
+def get_service_stats() -> dict:
+    """Request counts, errors, concurrency and average latency per endpoint."""
+    with _metrics_lock:
+        return {
+            "requests": dict(_metrics["requests"]),
+            "errors": _metrics["errors"],
+            "in_flight": _metrics["in_flight"],
+            "peak_in_flight": _metrics["peak_in_flight"],
+            "avg_latency_ms": {
+                endpoint: round(total / count, 1) for endpoint, (total, count) in _metrics["latency_ms"].items()
+            },
+            "workers": _state["workers"],
+            "uptime_s": round(time.time() - _state["started"], 1),
+        }
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """JSON request handler for the query endpoints."""
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return body if isinstance(body, dict) else None
+
+    def _handle(self, endpoint: str, handler):
+        started = time.perf_counter()
+        with _metrics_lock:
+            _metrics["in_flight"] += 1
+            _metrics["peak_in_flight"] = max(_metrics["peak_in_flight"], _metrics["in_flight"])
+        ok = False
+        try:
+            ok = handler()
+        except Exception as e:
+            try:
+                self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            except OSError:
+                pass  # Client went away mid-stream
+        finally:
+            with _metrics_lock:
+                _metrics["in_flight"] -= 1
+            _record_request(endpoint, started, ok)
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path == "/health":
+            self._handle("health", self._health)
+        elif path == "/metrics":
+            self._handle("metrics", self._metrics)
+        elif path == "/metrics/prometheus":
+            self._handle("metrics", self._prometheus)
+        elif path.startswith("/answer/"):
+            self._handle("answer", self._late_answer)
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        routes = {
+            "/query": ("query", self._query),
+            "/query/stream": ("query_stream", self._query_stream),
+            "/batch": ("batch", self._batch),
+            "/retrieve": ("retrieve", self._retrieve),
+        }
+        route = routes.get(self.path.rstrip("/"))
+        if route is None:
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        if not _state["ready"]:
+            self._send_json(503, {"error": "Service is still loading the index"})
+            return
+        self._handle(*route)
+
+    # ── Endpoints (return True on success) ─────────────────────
+
+    def _health(self):
+        collection = _state["collection"]
+        self._send_json(200 if _state["ready"] else 503, {
+            "status": "ok" if _state["ready"] else "loading",
+            "records": collection.count() if collection is not None else 0,
+            "index_version": _state["version"],
+            "uptime_s": round(time.time() - _state["started"], 1),
+        })
+        return True
+
+    def _metrics(self):
+        from llm_client import get_call_stats, get_scheduler_stats
+        from context_builder import get_context_stats
+        from reranker import get_rerank_stats
+        from rag_engine import answer_cache, embedding_cache, retrieval_cache, query_flights
+
+        self._send_json(200, {
+            "service": get_service_stats(),
+            "llm": get_call_stats(),
+            "llm_scheduler": get_scheduler_stats(),
+            "context": get_context_stats(),
+            "answer_cache": answer_cache.stats(),
+            "embedding_cache": embedding_cache.stats(),
+            "retrieval_cache": retrieval_cache.stats(),
+            "coalescing": query_flights.stats(),
+            "rerank": get_rerank_stats(),
+            "stages": metrics.histograms.summary(),
+        })
+        return True
+
+    def _prometheus(self):
+        data = metrics.histograms.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return True
+
+    def _late_answer(self):
+        from urllib.parse import urlsplit, parse_qs
+        from rag_engine import wait_for_answer
+
+        url = urlsplit(self.path)
+        answer_id = url.path.rstrip("/").rsplit("/", 1)[-1]
+        try:
+            wait = min(max(float(parse_qs(url.query).get("wait", ["0"])[0]), 0.0), 60.0)
+        except ValueError:
+            wait = 0.0
+        result = wait_for_answer(answer_id, timeout=wait)
+        self._send_json(404 if result["status"] == "unknown" else 200, result)
+        return result["status"] != "unknown"
+
+    def _question(self):
+        """Parse a {"query": ...} body, replying 400 if it (or an optional field) is invalid."""
+        body = self._read_json()
+        if body is None or not isinstance(body.get("query"), str) or not body["query"].strip():
+            self._send_json(400, {"error": 'Expected a JSON body with a non-empty "query" string'})
+            return None
+        error = request_options_error(body)
+        if error:
+            self._send_json(400, {"error": error})
+            return None
+        return body
+
+    def _query(self):
+        from rag_engine import query_planning
+
+        body = self._question()
+        if body is None:
+            return False
+        result = query_planning(
+            body["query"], chat_history=body.get("chat_history"),
+            collection=_state["collection"], use_cache=body.get("use_cache", True),
+        )
+        self._send_json(200, result)
+        return True
+
+    def _query_stream(self):
+        from rag_engine import stream_query_planning
+
+        body = self._question()
+        if body is None:
+            return False
+        events = stream_query_planning(
+            body["query"], chat_history=body.get("chat_history"),
+            collection=_state["collection"], use_cache=body.get("use_cache", True),
+        )
+        first = next(events)  # Retrieval errors still get a JSON 500
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self._send_event(first)
+        try:
+            for event in events:
+                self._send_event(event)
+        except Exception as e:
+            self._send_event({"type": "error", "error": f"{type(e).__name__}: {e}"})
+            return False
+        return True
+
+    def _send_event(self, event: dict):
+        self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _batch(self):
+        from rag_engine import batch_query_planning
+
+        body = self._read_json()
+        queries = body.get("queries") if body else None
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            self._send_json(400, {"error": 'Expected a JSON body with a "queries" list of strings'})
+            return False
+        empty = [i for i, q in enumerate(queries) if not q.strip()]
+        if empty:
+            self._send_json(400, {"error": f'"queries"[{empty[0]}] must be a non-empty string'})
+            return False
+        error = request_options_error({"use_cache": body["use_cache"]} if "use_cache" in body else {})
+        if error:
+            self._send_json(400, {"error": error})
+            return False
+        if len(queries) > MAX_BATCH_SIZE:
+            self._send_json(413, {"error": f"At most {MAX_BATCH_SIZE} queries per batch"})
+            return False
+        results = batch_query_planning(
+            queries, collection=_state["collection"], use_cache=body.get("use_cache", True)
+        )
+        self._send_json(200, {"results": results})
+        return True
+
+    def _retrieve(self):
+        from rag_engine import TOP_K, retrieve_records
+
+        body = self._question()
+        if body is None:
+            return False
+        records = retrieve_records(body["query"], collection=_state["collection"], top_k=body.get("top_k", TOP_K))
+        self._send_json(200, {"results": [
+            {"id": r["id"], "relevance": r["relevance"], "metadata": r["metadata"], "document": r["document"]}
+            for r in records
+        ]})
+        return True
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles each connection on a fixed-size thread pool."""
+
+    request_queue_size = 128  # Listen backlog
+
+    def __init__(self, server_address, handler_class, workers: int = SERVICE_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="service-worker")
+        _state["workers"] = workers
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+def start_service(host: str = "127.0.0.1", port: int = 0, workers: int = SERVICE_WORKERS):
+    """
+    Warm up and start the service on a background thread.
+
+    Returns:
+        (server, base_url) — call server.shutdown() to stop it
+    """
+    warm_up()
+    server = PooledHTTPServer((host, port), QueryHandler, workers=workers)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/JSON service for Dublin planning questions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Worker threads")
+    args = parser.parse_args()
+
+    print("Loading embedding model and vector database...")
+    collection = warm_up()
+    print(f"  {collection.count():,} records ready")
+
+    server = PooledHTTPServer((args.host, args.port), QueryHandler, workers=args.workers)
+    print(f"Planning query service listening on http://{args.host}:{args.port} ({args.workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,321 @@
+"""
+snapshot.py — Portable prebuilt index snapshots
+
+A fresh deployment (Streamlit Cloud, a new container) has no chroma_db/ and
+used to rebuild it from the ArcGIS API: minutes of downloading and
+embedding. A snapshot packages a finished build into one compressed file:
+
+- manifest.json (first member, so compatibility is checked without reading
+  the rest): format version, index version (built_at), embedding model,
+  chromadb version, record count, the parts the index contains, and the
+  size and SHA-256 of every file
+- chroma_db/ (the collections plus the reference, lexical, spatial and
+  aggregate indexes)
+- data/processed_records.json
+
+Restoring streams the archive into a staging directory, hashing each file
+as it is written, and only swaps it in when every checksum matches, so cold
+start is bounded by reading and unpacking the file. IndexBuilder restores
+the snapshot at INDEX_SNAPSHOT before falling back to a full build.
+
+    python snapshot.py create [path]     # after build_vectordb.py
+    python snapshot.py verify [path]
+    python snapshot.py restore [path]
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SNAPSHOT_PATH = Path(os.getenv("INDEX_SNAPSHOT", "snapshots/dublin_planning_index.tar.gz"))
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+CHROMA_ARCNAME = "chroma_db"
+DATA_FILES = ["processed_records.json"]  # Under data/, enough to rebuild without downloading
+CHUNK_SIZE = 1 << 20
+
+
+class SnapshotError(Exception):
+    """The snapshot is missing, incompatible or corrupt."""
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _chromadb_version() -> str:
+    import chromadb
+    return getattr(chromadb, "__version__", "")
+
+
+def _index_identity(chroma_dir: Path) -> dict:
+    """Index version, record count and collections of a built index."""
+    import chromadb
+    from build_vectordb import COLLECTION_NAME
+
+    client = chromadb.PersistentClient(path=str(chroma_dir))
+    collection = client.get_collection(name=COLLECTION_NAME)
+    names = sorted(getattr(c, "name", c) for c in client.list_collections())
+    return {
+        "built_at": (collection.metadata or {}).get("built_at", ""),
+        "num_records": collection.count(),
+        "collections": names,
+    }
+
+
+def _expected_parts() -> dict:
+    """What the current build_vectordb.py writes, for comparing against a snapshot."""
+    from build_vectordb import COLLECTION_NAME
+    from digests import DIGEST_COLLECTION_NAME
+    from index_builder import SIDE_INDEX_FILES
+
+    return {"collections": [COLLECTION_NAME, DIGEST_COLLECTION_NAME], "files": list(SIDE_INDEX_FILES)}
+
+
+# ── Create ─────────────────────────────────────────────────────
+
+def create_snapshot(path: Path = SNAPSHOT_PATH, chroma_dir: Path = Path("chroma_db"),
+                    data_dir: Path = Path("data")) -> dict:
+    """
+    Package a built index and its processed records into one .tar.gz.
+
+    Run it when nothing is writing to chroma_dir (after build_vectordb.py).
+
+    Returns:
+        The manifest
+    """
+    from build_vectordb import EMBEDDING_MODEL
+
+    path, chroma_dir, data_dir = Path(path), Path(chroma_dir), Path(data_dir)
+    if not chroma_dir.exists() or not any(chroma_dir.iterdir()):
+        raise SnapshotError(f"No index at {chroma_dir} — run build_vectordb.py first")
+
+    members = []  # (arcname, source path)
+    for source in sorted(p for p in chroma_dir.rglob("*") if p.is_file()):
+        members.append((f"{CHROMA_ARCNAME}/{source.relative_to(chroma_dir).as_posix()}", source))
+    for name in DATA_FILES:
+        source = data_dir / name
+        if not source.exists():
+            raise SnapshotError(f"{source} not found — run download_data.py first")
+        members.append((f"data/{name}", source))
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "embedding_model": EMBEDDING_MODEL,
+        "chromadb_version": _chromadb_version(),
+        **_index_identity(chroma_dir),
+        "side_indexes": sorted(p.name for p in chroma_dir.iterdir() if p.is_file() and p.suffix != ".sqlite3"),
+        "files": {arcname: {"size": source.stat().st_size, "sha256": _sha256(source)} for arcname, source in members},
+    }
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + ".part")
+    with tarfile.open(partial, "w:gz", compresslevel=6) as tar:
+        data = json.dumps(manifest, indent=2).encode()
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size, info.mtime = len(data), time.time()
+        tar.addfile(info, io.BytesIO(data))
+        for arcname, source in members:
+            info = tar.gettarinfo(str(source), arcname=arcname)
+            if info.size != manifest["files"][arcname]["size"]:
+                raise SnapshotError(f"{source} changed while the snapshot was being written")
+            with open(source, "rb") as f:
+                tar.addfile(info, f)
+    os.replace(partial, path)
+    return manifest
+
+
+# ── Inspect ────────────────────────────────────────────────────
+
+def read_manifest(path: Path = SNAPSHOT_PATH) -> dict:
+    """The snapshot's manifest, read without unpacking the rest of the archive."""
+    path = Path(path)
+    if not path.exists():
+        raise SnapshotError(f"No snapshot at {path}")
+    try:
+        with tarfile.open(path, "r:gz") as tar:
+            first = tar.next()
+            if first is None or first.name != MANIFEST_NAME:
+                raise SnapshotError(f"{path} does not start with {MANIFEST_NAME}")
+            return json.load(tar.extractfile(first))
+    except (tarfile.TarError, OSError, EOFError, ValueError) as e:
+        raise SnapshotError(f"Cannot read {path}: {e}") from e
+
+
+def incompatibilities(manifest: dict) -> list[str]:
+    """Reasons the snapshot cannot serve this code; empty when it can."""
+    from build_vectordb import EMBEDDING_MODEL
+
+    problems = []
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        problems.append(f"snapshot format {manifest.get('format')} (expected {SNAPSHOT_FORMAT})")
+    if manifest.get("embedding_model") != EMBEDDING_MODEL:
+        problems.append(f"embedding model {manifest.get('embedding_model')} (expected {EMBEDDING_MODEL})")
+    # Chroma's on-disk format is stable within a major version
+    built_with = (manifest.get("chromadb_version") or "").split(".")[0]
+    installed = _chromadb_version().split(".")[0]
+    if built_with != installed:
+        problems.append(f"chromadb {manifest.get('chromadb_version')} (installed {_chromadb_version()})")
+    expected = _expected_parts()
+    missing = [c for c in expected["collections"] if c not in manifest.get("collections", [])]
+    missing += [f for f in expected["files"] if f not in manifest.get("side_indexes", [])]
+    if missing:
+        problems.append(f"missing {', '.join(missing)}")
+    return problems
+
+
+def _safe_arcname(name: str) -> bool:
+    parts = Path(name).parts
+    return bool(parts) and not Path(name).is_absolute() and ".." not in parts and parts[0] in (CHROMA_ARCNAME, "data")
+
+
+# ── Restore ────────────────────────────────────────────────────
+
+def unpack_snapshot(path: Path, chroma_target: Path, data_target: Path, progress=None) -> dict:
+    """
+    Unpack and verify a snapshot: the index into chroma_target, the records into data_target.
+
+    Every file is hashed while it is written; on any mismatch the partially
+    written files are removed and SnapshotError is raised.
+
+    Args:
+        progress: optional callback(fraction, message) as bytes are unpacked
+
+    Returns:
+        The manifest
+    """
+    path, chroma_target, data_target = Path(path), Path(chroma_target), Path(data_target)
+    manifest = read_manifest(path)
+    problems = incompatibilities(manifest)
+    if problems:
+        raise SnapshotError(f"Incompatible snapshot: {'; '.join(problems)}")
+
+    expected = manifest.get("files", {})
+    total = sum(f["size"] for f in expected.values()) or 1
+    shutil.rmtree(chroma_target, ignore_errors=True)
+    chroma_target.mkdir(parents=True)
+    data_target.mkdir(parents=True, exist_ok=True)
+    seen, unpacked, written = set(), 0, []
+    try:
+        with tarfile.open(path, "r:gz") as tar:
+            for member in tar:
+                if member.name == MANIFEST_NAME or member.isdir():
+                    continue
+                if not member.isfile() or not _safe_arcname(member.name) or member.name not in expected:
+                    raise SnapshotError(f"Unexpected member {member.name} in {path}")
+                relative = Path(member.name).relative_to(member.name.split("/")[0])
+                if member.name.startswith(f"{CHROMA_ARCNAME}/"):
+                    target = chroma_target / relative
+                else:
+                    target = data_target / (relative.name + ".restoring")  # Renamed once everything checks out
+                target.parent.mkdir(parents=True, exist_ok=True)
+                written.append(target)
+                digest = hashlib.sha256()
+                source = tar.extractfile(member)
+                with open(target, "wb") as out:
+                    for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                        out.write(chunk)
+                        unpacked += len(chunk)
+                        if progress:
+                            progress(unpacked / total, f"{unpacked / 1e6:,.0f} of {total / 1e6:,.0f} MB restored")
+                if digest.hexdigest() != expected[member.name]["sha256"]:
+                    raise SnapshotError(f"Checksum mismatch for {member.name}")
+                seen.add(member.name)
+        missing = set(expected) - seen
+        if missing:
+            raise SnapshotError(f"Snapshot is missing {', '.join(sorted(missing))}")
+    except (SnapshotError, tarfile.TarError, OSError, EOFError) as e:
+        shutil.rmtree(chroma_target, ignore_errors=True)
+        for target in written:
+            if target.name.endswith(".restoring"):
+                target.unlink(missing_ok=True)
+        if isinstance(e, SnapshotError):
+            raise
+        raise SnapshotError(f"Cannot unpack {path}: {e}") from e
+
+    for target in written:
+        if target.name.endswith(".restoring"):
+            os.replace(target, target.with_name(target.name[:-len(".restoring")]))
+    return manifest
+
+
+def restore_snapshot(path: Path = SNAPSHOT_PATH, chroma_dir: Path = Path("chroma_db"),
+                     data_dir: Path = Path("data"), progress=None) -> dict:
+    """Unpack a snapshot into a staging directory and swap it in for chroma_dir (see index_builder.swap_in)."""
+    from index_builder import STAGING_SUFFIX, swap_in
+
+    chroma_dir = Path(chroma_dir)
+    staging = chroma_dir.with_name(chroma_dir.name + STAGING_SUFFIX)
+    manifest = unpack_snapshot(path, staging, data_dir, progress=progress)
+    swap_in(staging, chroma_dir)
+    return manifest
+
+
+def restore_if_missing(path: Path = SNAPSHOT_PATH, chroma_dir: Path = Path("chroma_db"),
+                       data_dir: Path = Path("data")):
+    """
+    Restore the snapshot when there is no index yet (for processes without a background builder).
+
+    Returns:
+        The manifest if it was restored; None if an index exists or there is no compatible snapshot
+    """
+    from index_builder import index_exists
+
+    if index_exists(chroma_dir) or not Path(path).exists():
+        return None
+    try:
+        return restore_snapshot(path, chroma_dir, data_dir)
+    except SnapshotError as e:
+        print(f"  Snapshot not used: {e}")
+        return None
+
+
+def _describe(manifest: dict) -> str:
+    size = sum(f["size"] for f in manifest.get("files", {}).values())
+    return (f"index built {manifest.get('built_at', '?')}, {manifest.get('num_records', 0):,} records, "
+            f"{manifest.get('embedding_model')}, chromadb {manifest.get('chromadb_version')}, "
+            f"{len(manifest.get('files', {}))} files ({size / 1e6:,.1f} MB unpacked)")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    target = Path(sys.argv[2]) if len(sys.argv) > 2 else SNAPSHOT_PATH
+    if command not in ("create", "verify", "restore"):
+        print(__doc__)
+        sys.exit(2)
+
+    started = time.perf_counter()
+    try:
+        if command == "create":
+            manifest = create_snapshot(target)
+            print(f"Wrote {target} ({target.stat().st_size / 1e6:,.1f} MB): {_describe(manifest)}")
+        elif command == "verify":
+            with_tmp = Path(f".snapshot-verify-{os.getpid()}")
+            try:
+                manifest = unpack_snapshot(target, with_tmp / "chroma_db", with_tmp / "data")
+            finally:
+                shutil.rmtree(with_tmp, ignore_errors=True)
+            print(f"{target} OK: {_describe(manifest)}")
+        else:
+            manifest = restore_snapshot(target)
+            print(f"Restored {target}: {_describe(manifest)}")
+    except SnapshotError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"  ({time.perf_counter() - started:.1f}s)")